@@ -4,6 +4,7 @@ Agents package containing different types of AI agents.
 
 from agents.langchain_agent import LangChainAgent
 from agents.base_agent import BaseAgent
+from agents.runtime import AgentRuntime, AgentSession
 
 # Define what should be available when someone does: from agents import *
-__all__ = ['LangChainAgent', 'BaseAgent']
+__all__ = ['LangChainAgent', 'BaseAgent', 'AgentRuntime', 'AgentSession']
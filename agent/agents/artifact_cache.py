@@ -0,0 +1,168 @@
+"""Persistent cache of synthesized artifact text, keyed by chunk content, prompt version and model."""
+
+import os
+import time
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from services.metrics import track_dependency
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_CACHE_ENABLED = os.getenv("ARTIFACT_CACHE_ENABLED", "true").lower() == "true"
+ARTIFACT_CACHE_TTL = int(os.getenv("ARTIFACT_CACHE_TTL", str(30 * 86400)))
+ARTIFACT_CACHE_MAX_ENTRIES = int(os.getenv("ARTIFACT_CACHE_MAX_ENTRIES", "20000"))
+ARTIFACT_CACHE_PATH = os.getenv("ARTIFACT_CACHE_PATH", "cache/artifact_cache.sqlite3")
+
+
+def chunk_hash(text: str) -> str:
+    """Stable identity of a chunk: hash of its text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+class DiskArtifactStore:
+    """SQLite-backed LRU store used when Redis is unavailable."""
+
+    def __init__(self, path: str = ARTIFACT_CACHE_PATH, max_entries: int = ARTIFACT_CACHE_MAX_ENTRIES,
+                 ttl_seconds: int = ARTIFACT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS artifacts (key TEXT PRIMARY KEY, value TEXT, created_at REAL, accessed_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS artifacts_accessed ON artifacts (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM artifacts WHERE key = ? AND created_at > ?", (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row:
+                self._conn.execute("UPDATE artifacts SET accessed_at = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str) -> int:
+        """Store a value and return the number of entries evicted to stay within max_entries."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?)", (key, value, now, now))
+            cursor = self._conn.execute(
+                "DELETE FROM artifacts WHERE created_at <= ? OR key IN ("
+                "SELECT key FROM artifacts ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (now - self.ttl_seconds, self.max_entries)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ArtifactCache:
+    """Caches the raw synthesis output for a chunk.
+
+    Keys combine the artifact type, model, synthesis prompt version and a hash of
+    the chunk text, so editing a prompt or switching models starts a fresh cache.
+    The query is deliberately not part of the key: the card is determined by the
+    chunk, and reusing it is what lets repeated retrievals skip the LLM.
+
+    Redis is the primary store, with a sliding TTL (refreshed on every hit) and
+    eviction left to the server's maxmemory policy. The SQLite store is used when
+    there is no Redis client or a Redis call fails; it enforces TTL and LRU itself.
+    """
+
+    def __init__(self, redis_client=None, disk_store: Optional[DiskArtifactStore] = None,
+                 ttl_seconds: int = ARTIFACT_CACHE_TTL, enabled: bool = ARTIFACT_CACHE_ENABLED):
+        self.redis = redis_client
+        self.disk_store = disk_store
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._stats = {"hits": 0, "misses": 0, "redis_hits": 0, "disk_hits": 0,
+                       "stores": 0, "evictions": 0, "errors": 0}
+
+    @staticmethod
+    def key(artifact_type: str, model_name: str, prompt_version: str, chunk_text: str) -> str:
+        return f"artifact:{artifact_type}:{model_name}:{prompt_version}:{chunk_hash(chunk_text)}"
+
+    async def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        value = None
+        if self.redis is not None:
+            try:
+                with track_dependency("redis", "artifact_cache_get"):
+                    value = await self.redis.getex(key, ex=self.ttl_seconds)
+                if value is not None:
+                    self._stats["redis_hits"] += 1
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Error reading artifact cache from Redis: {str(e)}")
+        if value is None and self.disk_store is not None:
+            try:
+                value = await asyncio.to_thread(self.disk_store.get, key)
+                if value is not None:
+                    self._stats["disk_hits"] += 1
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Error reading artifact cache from disk: {str(e)}")
+        self._stats["hits" if value is not None else "misses"] += 1
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    async def set(self, key: str, value: str):
+        if not self.enabled:
+            return
+        if self.redis is not None:
+            try:
+                with track_dependency("redis", "artifact_cache_set"):
+                    await self.redis.set(key, value, ex=self.ttl_seconds)
+                self._stats["stores"] += 1
+                return
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Error writing artifact cache to Redis: {str(e)}. Using disk store.")
+        if self.disk_store is not None:
+            try:
+                self._stats["evictions"] += await asyncio.to_thread(self.disk_store.set, key, value)
+                self._stats["stores"] += 1
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Error writing artifact cache to disk: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "backend": "redis" if self.redis is not None else "disk",
+            "hit_rate": self._stats["hits"] / lookups if lookups else 0.0
+        }
+
+    def close(self):
+        if self.disk_store is not None:
+            self.disk_store.close()
+
+
+_artifact_cache: Optional[ArtifactCache] = None
+
+
+def get_artifact_cache() -> Optional[ArtifactCache]:
+    """Return the process-wide artifact cache, or None if none is installed."""
+    return _artifact_cache
+
+
+def set_artifact_cache(cache: Optional[ArtifactCache]):
+    """Install (or clear, with None) the process-wide artifact cache."""
+    global _artifact_cache
+    _artifact_cache = cache
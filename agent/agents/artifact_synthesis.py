@@ -0,0 +1,184 @@
+"""Prompts and prebuilt runnables for synthesizing guideline and case study cards from retrieved chunks."""
+
+import re
+import uuid
+import asyncio
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import Runnable
+
+logger = logging.getLogger(__name__)
+
+GUIDELINE_TEMPLATE = """
+            Based on the following retrieved document sections related to the query "{query}", please synthesize a concise and relevant ethical guideline. 
+            Focus on extracting the core principle or recommendation. Present it clearly.
+            Include the source document name if available in the metadata.
+
+            Retrieved Sections:
+            {text}
+
+            Synthesized Guideline (include Title, Description, and Source):
+            Title: [Your synthesized title based on the core principle]
+            Description: [Your synthesized description of the guideline]
+            Source: [Source document name, e.g., {source}]
+            """
+
+CASE_STUDY_TEMPLATE = """
+            Based on the following retrieved document section related to the query "{query}", please synthesize a concise summary of the case study.
+            Include a title, a brief summary of the situation, the outcome (if available), and the source.
+
+            Retrieved Section:
+            {text}
+
+            Synthesized Case Study (include Title, Summary, Outcome, and Source):
+            Title: [Your synthesized title for the case study]
+            Summary: [Your synthesized summary of the case study situation]
+            Outcome: [Your synthesized summary of the outcome or key lesson]
+            Source: [Source document name, e.g., {source}]
+            """
+
+GUIDELINE_PROMPT = PromptTemplate(template=GUIDELINE_TEMPLATE, input_variables=["text", "query", "source"])
+CASE_STUDY_PROMPT = PromptTemplate(template=CASE_STUDY_TEMPLATE, input_variables=["text", "query", "source"])
+
+# artifact_type metadata value -> synthesis prompt
+SYNTHESIS_PROMPTS = {
+    "guideline": GUIDELINE_PROMPT,
+    "case_study": CASE_STUDY_PROMPT,
+}
+
+# Content hash of each template; part of the artifact cache key so prompt edits invalidate cached cards
+SYNTHESIS_PROMPT_VERSIONS = {
+    artifact_type: hashlib.sha256(prompt.template.encode("utf-8")).hexdigest()[:12]
+    for artifact_type, prompt in SYNTHESIS_PROMPTS.items()
+}
+
+
+def synthesis_chain(artifact_type: str, llm) -> Runnable:
+    """Build the `prompt | llm | parser` runnable for one artifact type. It is stateless and safe to share."""
+    return SYNTHESIS_PROMPTS[artifact_type] | llm | StrOutputParser()
+
+
+def build_synthesis_chains(llm) -> Dict[str, Runnable]:
+    """Build one synthesis runnable per artifact type."""
+    return {artifact_type: synthesis_chain(artifact_type, llm) for artifact_type in SYNTHESIS_PROMPTS}
+
+
+# Stand-in query for cards synthesized at index build time, when there is no user query yet
+PRESYNTHESIS_QUERY = "ethical decision-making in technology projects"
+
+
+def parse_card(llm_output: str, source: str) -> Optional[Dict[str, Any]]:
+    """Parse a synthesis response into card fields (title, description, summary, outcome, source).
+
+    Returns None if no title or description can be extracted.
+    """
+    title = "Synthesized Information"
+    description = llm_output # Default to full output if parsing fails
+    summary = ""
+    outcome = ""
+    parsed_source = source
+    is_case_study = False # Flag to check if case study fields are found
+
+    # Basic parsing based on expected keywords (Title:, Description:, Summary:, Outcome:, Source:)
+    title_match = re.search(r"Title:(.*?)(?:Description:|Summary:|Source:|$)", llm_output, re.IGNORECASE | re.DOTALL)
+    if title_match:
+        title = title_match.group(1).strip()
+
+    desc_match = re.search(r"Description:(.*?)(?:Source:|$)", llm_output, re.IGNORECASE | re.DOTALL)
+    if desc_match:
+        description = desc_match.group(1).strip()
+
+    # Look for case study specific fields
+    summary_match = re.search(r"Summary:(.*?)(?:Outcome:|Source:|$)", llm_output, re.IGNORECASE | re.DOTALL)
+    if summary_match:
+        summary = summary_match.group(1).strip()
+        is_case_study = True
+        description = summary # Use summary as description for case studies if Description field isn't explicit
+
+    outcome_match = re.search(r"Outcome:(.*?)(?:Source:|$)", llm_output, re.IGNORECASE | re.DOTALL)
+    if outcome_match:
+        outcome = outcome_match.group(1).strip()
+        is_case_study = True
+
+    source_match = re.search(r"Source:(.*?)$", llm_output, re.IGNORECASE | re.DOTALL)
+    if source_match:
+        parsed_source = source_match.group(1).strip()
+
+    # Clean up potential artifacts
+    title = title.replace("[Your synthesized title based on the core principle]", "").replace("[Your synthesized title for the case study]", "").strip()
+    description = description.replace("[Your synthesized description of the guideline]", "").replace("[Your synthesized summary of the case study situation]", "").strip()
+    outcome = outcome.replace("[Your synthesized summary of the outcome or key lesson]", "").strip()
+    parsed_source = parsed_source.replace("[Source document name, e.g., {source}]", source).strip()
+
+    if not title or not description:
+        logger.warning(f"Could not parse title or description reliably from LLM output: {llm_output[:100]}...")
+        return None
+
+    return {
+        "title": title,
+        "description": description,
+        "source": parsed_source,
+        "summary": summary if is_case_study else None,
+        "outcome": outcome if is_case_study else None,
+    }
+
+
+def card_to_artifact(card: Dict[str, Any], score: float) -> Dict[str, Any]:
+    """Turn card fields plus a retrieval distance into the artifact dict returned by the agent."""
+    return {
+        "id": card["source"] + "-" + str(uuid.uuid4())[:8],
+        "title": card["title"],
+        "description": card["description"],
+        "source": card["source"],
+        "category": "Synthesized", # Or try to get from original doc metadata if needed
+        "relevance": float(1.0 - min(float(score), 1.0)), # Convert distance score to relevance
+        # Add case study fields if present
+        "summary": card.get("summary"),
+        "outcome": card.get("outcome"),
+    }
+
+
+async def presynthesize_cards(chunks: List[Dict[str, Any]], llm, model_name: str,
+                              concurrency: int = 8, text_key: str = "content") -> int:
+    """Synthesize a card for every guideline and case study chunk and store it in the chunk's metadata.
+
+    Meant for index build time, so retrieval can return cards without LLM calls. Each
+    chunk is a dict with the text under `text_key` and a `metadata` dict carrying
+    `artifact_type` and `filename` (or `source`). Returns the number of cards created.
+    """
+    chains = build_synthesis_chains(llm)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def synthesize(chunk: Dict[str, Any]) -> bool:
+        metadata = chunk["metadata"]
+        artifact_type = metadata.get("artifact_type")
+        source = metadata.get("filename", metadata.get("source", "unknown"))
+        try:
+            async with semaphore:
+                output = await chains[artifact_type].ainvoke(
+                    {"text": chunk[text_key], "query": PRESYNTHESIS_QUERY, "source": source}
+                )
+        except Exception as e:
+            logger.error(f"Error pre-synthesizing {artifact_type} card for {source}: {str(e)}")
+            return False
+        card = parse_card(output, source)
+        if not card:
+            return False
+        card["source"] = source
+        # Copy rather than mutate: chunkers may share one metadata dict between all chunks of a document
+        chunk["metadata"] = {
+            **metadata,
+            "card": {**card, "prompt_version": SYNTHESIS_PROMPT_VERSIONS[artifact_type], "model": model_name}
+        }
+        return True
+
+    eligible = [chunk for chunk in chunks if chunk["metadata"].get("artifact_type") in chains]
+    logger.info(f"Pre-synthesizing cards for {len(eligible)} of {len(chunks)} chunks")
+    results = await asyncio.gather(*(synthesize(chunk) for chunk in eligible))
+    created = sum(results)
+    logger.info(f"Pre-synthesized {created} cards ({len(eligible) - created} failed)")
+    return created
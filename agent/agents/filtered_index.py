@@ -0,0 +1,144 @@
+"""Exact metadata-filtered search over a LangChain FAISS store using precomputed ID bitmaps."""
+
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# Metadata fields with a precomputed bitmap per value
+FILTER_FIELDS = ("artifact_type", "category", "filename")
+
+# Older indexes tag chunks with "type" instead of "artifact_type"
+FIELD_ALIASES = {"artifact_type": "type"}
+
+
+class FilteredVectorIndex:
+    """Wraps a loaded FAISS vector store so filtered top-k search is exact.
+
+    LangChain's FAISS `filter=` over-fetches `fetch_k` neighbours and drops the
+    non-matching ones afterwards, so a filter on a small partition (say, case
+    studies) can come back short or empty even when matching chunks exist.
+
+    Here every value of the fields in `FILTER_FIELDS` gets a bitmap of the index
+    positions holding it, built once when the store is loaded. A filtered search
+    ANDs the bitmaps of the requested fields (ORing values given as a list) and
+    hands the result to FAISS as an `IDSelectorBitmap`, so only matching vectors
+    are scored and the top-k is always taken from the partition itself.
+    Filters on other fields fall back to the store's own filtering.
+    """
+
+    def __init__(self, vectorstore, embeddings=None, fields: Sequence[str] = FILTER_FIELDS):
+        """
+        Args:
+            vectorstore: A langchain_community FAISS store.
+            embeddings: Embeddings used for queries; defaults to the store's own.
+            fields: Metadata fields to build bitmaps for.
+        """
+        self.vectorstore = vectorstore
+        self.embeddings = embeddings or vectorstore.embeddings
+        self.fields = tuple(fields)
+        self._bitmaps: Dict[str, Dict[Any, np.ndarray]] = {}
+        self._ntotal = -1
+        self.build()
+
+    @property
+    def index(self):
+        return self.vectorstore.index
+
+    def build(self):
+        """(Re)build the per-value bitmaps from the docstore."""
+        ntotal = self.index.ntotal
+        masks: Dict[str, Dict[Any, np.ndarray]] = {field: {} for field in self.fields}
+        for position in range(ntotal):
+            doc = self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[position])
+            metadata = doc.metadata if isinstance(doc, Document) else {}
+            for field in self.fields:
+                value = metadata.get(field, metadata.get(FIELD_ALIASES.get(field, field)))
+                if value is None:
+                    continue
+                mask = masks[field].get(value)
+                if mask is None:
+                    mask = masks[field][value] = np.zeros(ntotal, dtype=bool)
+                mask[position] = True
+
+        self._bitmaps = {
+            field: {value: np.packbits(mask, bitorder="little") for value, mask in values.items()}
+            for field, values in masks.items()
+        }
+        self._ntotal = ntotal
+        logger.info(f"Built filter bitmaps over {ntotal} vectors: " + ", ".join(
+            f"{field} ({len(values)} values)" for field, values in self._bitmaps.items()))
+
+    def _ensure_current(self):
+        # Vectors added after loading shift nothing but leave new positions unfiltered
+        if self.index.ntotal != self._ntotal:
+            self.build()
+
+    def values(self, field: str) -> Dict[Any, int]:
+        """Number of indexed vectors for each value of a field."""
+        self._ensure_current()
+        return {value: int(np.unpackbits(bitmap, bitorder="little").sum())
+                for value, bitmap in self._bitmaps.get(field, {}).items()}
+
+    def supports(self, filter: Optional[Dict[str, Any]]) -> bool:
+        """Whether the filter can be answered from bitmaps alone."""
+        return not filter or (isinstance(filter, dict) and all(field in self.fields for field in filter))
+
+    def bitmap(self, filter: Dict[str, Any]) -> np.ndarray:
+        """Packed bitmap (little bit order) of the positions matching every field of the filter."""
+        self._ensure_current()
+        result = None
+        for field, wanted in filter.items():
+            values = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+            field_bitmap = np.zeros((self._ntotal + 7) // 8, dtype=np.uint8)
+            for value in values:
+                value_bitmap = self._bitmaps[field].get(value)
+                if value_bitmap is not None:
+                    field_bitmap |= value_bitmap
+            result = field_bitmap if result is None else result & field_bitmap
+        return result
+
+    def search_by_vector(self, embedding: List[float], k: int = 4,
+                         filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """Top-k (document, distance) pairs among the vectors matching `filter`."""
+        if not self.supports(filter):
+            return self.vectorstore.similarity_search_with_score_by_vector(embedding, k=k, filter=filter)
+
+        vector = np.array([embedding], dtype=np.float32)
+        if self.vectorstore._normalize_L2:
+            faiss.normalize_L2(vector)
+
+        if not filter:
+            k = min(k, self.index.ntotal)
+            if k <= 0:
+                return []
+            scores, indices = self.index.search(vector, k)
+        else:
+            bitmap = self.bitmap(filter)
+            matches = int(np.unpackbits(bitmap, bitorder="little").sum())
+            k = min(k, matches)
+            if k <= 0:
+                return []
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBitmap(self._ntotal, faiss.swig_ptr(bitmap)))
+            scores, indices = self.index.search(vector, k, params=params)
+
+        results = []
+        for score, position in zip(scores[0], indices[0]):
+            if position == -1:
+                continue
+            doc = self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[position])
+            if isinstance(doc, Document):
+                results.append((doc, float(score)))
+        return results
+
+    def search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        return self.search_by_vector(self.embeddings.embed_query(query), k=k, filter=filter)
+
+    async def asearch(self, query: str, k: int = 4,
+                      filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """Embed the query without blocking, then search (a flat search is fast enough to run inline)."""
+        return self.search_by_vector(await self.embeddings.aembed_query(query), k=k, filter=filter)
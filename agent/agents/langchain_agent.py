@@ -1,6 +1,7 @@
 """LangChain-based Ethical Decision-Making Agent."""
 
 import os
+import asyncio
 import logging
 from typing import Dict, List, Tuple, Optional, Any
 from pathlib import Path
@@ -63,14 +64,36 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain.memory import ConversationBufferMemory
 from langchain_core.prompts import PromptTemplate
-from langchain_community.callbacks.manager import get_openai_callback
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain.chains.summarize import load_summarize_chain
 
 from agents.base_agent import BaseAgent
+from agents.runtime import AgentRuntime, AgentSession
+from agents.artifact_cache import ArtifactCache, chunk_hash, get_artifact_cache
+from agents.artifact_synthesis import SYNTHESIS_PROMPT_VERSIONS, card_to_artifact, parse_card, synthesis_chain
+from services.embedding_cache import CachedEmbeddings
+from services.governor import get_llm_governor
+from services.metrics import track_llm_call, track_stage
+from services.model_routing import get_model_router
+from services.resilience import get_llm_resilience
+from services.usage import get_usage_tracker
 
 logger = logging.getLogger(__name__)
 
+# Artifacts returned per type by the combined retrieval
+DEFAULT_ARTIFACT_QUOTAS = {"guideline": 3, "case_study": 2}
+
+# The combined search fetches this many times the total quota before splitting by type
+ARTIFACT_RETRIEVAL_OVERFETCH = int(os.getenv("ARTIFACT_RETRIEVAL_OVERFETCH", "2"))
+
+
+def _session_attr(name: str) -> property:
+    """Expose an AgentSession field as an attribute of the agent."""
+    return property(
+        lambda self: getattr(self.session, name),
+        lambda self, value: setattr(self.session, name, value)
+    )
+
 class ArgumentationStrategy(BaseModel):
     """Model for argumentation strategy evaluation."""
     strategy: str = Field(description="The argumentation strategy used")
@@ -99,42 +122,34 @@ class LangChainAgent(BaseAgent):
         }
     }
 
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], runtime: Optional[AgentRuntime] = None,
+                 session: Optional[AgentSession] = None):
         """Initialize the agent.
         
         Args:
             config: Configuration dictionary with necessary parameters.
+            runtime: Shared runtime holding the LLM, embeddings and vector store.
+                A new one is built from config if not provided.
+            session: Per-conversation state. A fresh session is created if not provided.
         """
+        # Conversation state
+        self.session = session or AgentSession()
         try:
             # Configure logging
             self.logger = logging.getLogger("langchain_agent")
             
             # Store important configuration
             self.config = config
-            self.openai_api_key = config.get('openai_api_key', os.getenv('OPENAI_API_KEY'))
-            self.model_name = config.get('model_name', "gpt-4o-mini")
-            self.temperature = config.get('temperature', 0.7)
-            
-            # Conversation state
-            self.conversation_id = None
-            self.history = []
-            self.practice_mode = False
-            self.manager_type = None  # Default to no specific manager type
-            
-            # Initialize Langchain components
-            self.llm = ChatOpenAI(
-                model_name=self.model_name,
-                temperature=self.temperature,
-                openai_api_key=self.openai_api_key
-            )
-            
-            # Initialize knowledge retrieval
-            if 'index_dir' in config:
-                self._initialize_knowledge_base(config['index_dir'])
-            else:
-                logger.warning("No index_dir provided. Running without knowledge base.")
-                self.vectorstore = None
-                self.qa_chain = None
+            self.runtime = runtime or AgentRuntime(config)
+            self.openai_api_key = self.runtime.openai_api_key
+            self.model_name = self.runtime.model_name
+            self.temperature = self.runtime.temperature
+            
+            # Shared Langchain components
+            self.llm = self.runtime.llm
+            self.vectorstore = self.runtime.vectorstore
+            self.filtered_index = self.runtime.filtered_index
+            self.qa_chain = self.runtime.qa_chain
                 
             # Initialize conversation chain
             self._setup_conversation_chain()
@@ -143,6 +158,7 @@ class LangChainAgent(BaseAgent):
             logger.error(f"Error initializing agent: {str(e)}")
             traceback.print_exc()
             # Initialize minimal components to avoid crashes
+            self.openai_api_key = config.get('openai_api_key', os.getenv('OPENAI_API_KEY'))
             self.llm = ChatOpenAI(
                 model_name="gpt-4o-mini",
                 temperature=0.7,
@@ -151,19 +167,27 @@ class LangChainAgent(BaseAgent):
             self.memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
             self.conversation_chain = None
             self.vectorstore = None
+            self.filtered_index = None
             self.qa_chain = None
+
+    @classmethod
+    def from_runtime(cls, runtime: AgentRuntime, session: Optional[AgentSession] = None) -> "LangChainAgent":
+        """Create a lightweight agent bound to a shared runtime."""
+        return cls(dict(runtime.config), runtime=runtime, session=session)
+
+    # Conversation state lives in the session so the runtime can be shared
+    conversation_id = _session_attr('conversation_id')
+    history = _session_attr('history')
+    practice_mode = _session_attr('practice_mode')
+    manager_type = _session_attr('manager_type')
+    current_scenario = _session_attr('current_scenario')
+    practice_scores = _session_attr('practice_scores')
+    user_role = _session_attr('user_role')
             
     def _setup_conversation_chain(self):
         """Set up the core conversation chain."""
         # Initialize the memory buffer for the conversation chain
         self.memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-        
-        # Initialize the LLM for the conversation chain
-        conversation_llm = ChatOpenAI(
-            model_name=self.model_name,
-            temperature=self.temperature,
-            openai_api_key=self.openai_api_key
-        )
 
     def initialize_components(self):
         """Initialize LangChain components such as embeddings, retriever, and LLM."""
@@ -179,9 +203,9 @@ class LangChainAgent(BaseAgent):
                 logger.warning("No OpenAI API key found, some features may not work")
             
             # Initialize embeddings with OpenAI API key
-            self.embeddings = OpenAIEmbeddings(
+            self.embeddings = CachedEmbeddings(OpenAIEmbeddings(
                 openai_api_key=openai_api_key
-            )
+            ))
             
             # Initialize FAISS vector store
             self._initialize_faiss_index()
@@ -492,7 +516,8 @@ Would you like to try asking your question again in a different way?"""
             # First, retrieve relevant knowledge using our QA chain
             logger.info("Invoking QA chain...")
             try:
-                qa_response = self.qa_chain({"query": query})
+                with get_usage_tracker().track("understanding_mode"):
+                    qa_response = self.qa_chain({"query": query})
                 
                 logger.info(f"QA response type: {type(qa_response)}")
                 logger.info(f"QA response keys: {qa_response.keys()}")
@@ -560,8 +585,12 @@ Tailor your advice to help the user handle this specific manager type effectivel
             ]
             
             try:
-                # Set a timeout for the LLM call to prevent long waits
-                response = self.llm.predict_messages(messages, timeout=10)
+                # Set a deadline for the LLM call to prevent long waits
+                router = get_model_router()
+                route = router.route("understanding_mode")
+                llm = router.configure(self.llm, "understanding_mode")
+                with get_usage_tracker().track("understanding_mode"), router.timed("understanding_mode", route.model):
+                    response = get_llm_resilience().invoke(llm, messages, deadline=route.timeout)
                 agent_response = response.content
                 
                 # Ensure response ends with practice suggestion if appropriate
@@ -609,9 +638,10 @@ Would you mind trying your question again? I'd really like to give you a more sp
             # Get strategies from knowledge base - use invoke() instead of run()
             try:
                 logger.info("Getting argumentation strategies...")
-                qa_response = self.qa_chain.invoke({
-                    "query": strategy_query,
-                })
+                with get_usage_tracker().track("argumentation_strategies"):
+                    qa_response = self.qa_chain.invoke({
+                        "query": strategy_query,
+                    })
                 
                 # Extract the result from response, handling different possible formats
                 if isinstance(qa_response, dict):
@@ -646,11 +676,12 @@ Format:
     ...
 ]""")
             
-            parse_chain = LLMChain(llm=self.llm, prompt=parse_prompt)
+            parse_chain = LLMChain(llm=get_model_router().configure(self.llm, "strategy_parsing"), prompt=parse_prompt)
             
             # Use invoke instead of run
             try:
-                strategies_json = parse_chain.invoke({"strategies": strategies_response})
+                with get_usage_tracker().track("argumentation_strategies"):
+                    strategies_json = parse_chain.invoke({"strategies": strategies_response})
                 if isinstance(strategies_json, dict) and "text" in strategies_json:
                     strategies_json = strategies_json["text"]
                 
@@ -717,11 +748,12 @@ Type the number (1-4) of your chosen strategy."""
                 chain = self.evaluation_prompt | self.llm | self.strategy_parser
                 
                 # Evaluate strategy
-                evaluation = chain.invoke({
-                    "strategy": f"{chosen_strategy['name']}: {chosen_strategy['description']}",
-                    "response": self.memory.chat_history[-1] if self.memory.chat_history else "",
-                    "manager_type": self.manager_type
-                })
+                with get_usage_tracker().track("strategy_evaluation"):
+                    evaluation = chain.invoke({
+                        "strategy": f"{chosen_strategy['name']}: {chosen_strategy['description']}",
+                        "response": self.memory.chat_history[-1] if self.memory.chat_history else "",
+                        "manager_type": self.manager_type
+                    })
                 
                 # Store score
                 self.practice_scores.append(evaluation.effectiveness)
@@ -811,218 +843,281 @@ Please describe the ethical concern you'd like to discuss."""
         logger.info(f"Received feedback for query {query_id}: rating={rating}, comment={comment}")
         return feedback_id
 
-    def get_relevant_guidelines(self, conversation_text: str, max_results: int = 3) -> List[Dict]:
-        """Retrieve relevant ethical guidelines based on conversation text."""
+    def search_documents(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                         embedding: Optional[List[float]] = None):
+        """Top-k (document, distance) pairs, restricted to chunks whose metadata matches `filter`.
+
+        Uses the runtime's filter bitmaps so the top-k is exact within the filtered
+        partition; without them, falls back to the store's over-fetch-and-filter search.
+        Pass `embedding` to reuse a query vector the caller already computed.
+        """
+        if embedding is None:
+            embedding = self.vectorstore.embeddings.embed_query(query)
+        if self.filtered_index is not None:
+            return self.filtered_index.search_by_vector(embedding, k=k, filter=filter)
+        return self.vectorstore.similarity_search_with_score_by_vector(embedding, k=k, filter=filter)
+
+    async def asearch_documents(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                                embedding: Optional[List[float]] = None):
+        """Async search_documents (embeds the query without blocking)."""
+        if embedding is None:
+            embedding = await self.vectorstore.embeddings.aembed_query(query)
+        if self.filtered_index is not None:
+            return self.filtered_index.search_by_vector(embedding, k=k, filter=filter)
+        return self.vectorstore.similarity_search_with_score_by_vector(embedding, k=k, filter=filter)
+
+    def _retrieve_artifact_docs(self, artifact_type: str, conversation_text: str, max_results: int):
+        """Vector search for chunks of one artifact type."""
+        return self.search_documents(conversation_text, k=max_results, filter={"artifact_type": artifact_type})
+
+    async def _aretrieve_artifact_docs(self, artifact_type: str, conversation_text: str, max_results: int,
+                                       embedding: Optional[List[float]] = None):
+        """Async vector search for chunks of one artifact type (embeds the query without blocking)."""
+        with track_stage("retrieval"):
+            return await self.asearch_documents(conversation_text, k=max_results,
+                                                filter={"artifact_type": artifact_type}, embedding=embedding)
+
+    @staticmethod
+    def artifact_id(doc) -> str:
+        """Stable identifier of a retrieved chunk: filename and chunk number, else the docstore id or a content hash."""
+        filename = doc.metadata.get("filename", doc.metadata.get("source"))
+        chunk_id = doc.metadata.get("chunk_id")
+        if filename and chunk_id is not None:
+            return f"{filename}#{chunk_id}"
+        return getattr(doc, "id", None) or chunk_hash(doc.page_content)
+
+    @staticmethod
+    def _artifact_llm_input(doc, conversation_text: str) -> Dict[str, str]:
+        # Correctly get filename from metadata, fall back to old 'source' or 'unknown'
+        source_identifier = doc.metadata.get("filename", doc.metadata.get("source", "unknown"))
+        return {"text": doc.page_content, "query": conversation_text, "source": source_identifier}
+
+    def _build_artifact(self, artifact_type: str, llm_response_text: str, source_identifier: str, score: float) -> Optional[Dict]:
+        """Parse a synthesis response into an artifact dict, or None if it cannot be parsed."""
+        parsed = self._parse_llm_output(llm_response_text, source_identifier, score)
+        if not parsed:
+            logger.warning(f"Could not parse LLM output for {artifact_type} from source: {source_identifier}")
+            return None
+        # Ensure the final source field uses the correct identifier
+        parsed['source'] = source_identifier
+        return parsed
+
+    def _precomputed_artifact(self, doc, score: float) -> Optional[Dict]:
+        """Artifact from a card pre-synthesized at index build time, or None if the chunk has none."""
+        card = doc.metadata.get("card")
+        if not card:
+            return None
+        artifact = card_to_artifact(card, score)
+        artifact['source'] = doc.metadata.get("filename", doc.metadata.get("source", card.get("source", "unknown")))
+        return artifact
+
+    @property
+    def live_artifact_synthesis(self) -> bool:
+        """Whether chunks without a pre-synthesized card are synthesized at request time."""
+        return getattr(self.runtime, 'live_artifact_synthesis', True)
+
+    def get_relevant_artifacts(self, artifact_type: str, conversation_text: str, max_results: int) -> List[Dict]:
+        """Retrieve chunks of one artifact type ("guideline" or "case_study") and return a card for each.
+
+        Cards pre-synthesized at index build time are returned as is; other chunks are
+        synthesized live unless live synthesis is disabled.
+        """
         if self.vectorstore is None:
-            logger.warning("Vector store not initialized. Cannot retrieve guidelines.")
+            logger.warning(f"Vector store not initialized. Cannot retrieve {artifact_type} artifacts.")
             return []
 
         try:
-            logger.info(f"Retrieving guidelines relevant to: '{conversation_text[:100]}...'")
-            # Retrieve relevant document chunks with scores
-            retrieved_docs_with_scores = self.vectorstore.similarity_search_with_score(
-                query=conversation_text,
-                k=max_results, # Fetch k docs
-                filter={"artifact_type": "guideline"} # Filter for guidelines
-            )
-
+            logger.info(f"Retrieving {artifact_type} artifacts relevant to: '{conversation_text[:100]}...'")
+            retrieved_docs_with_scores = self._retrieve_artifact_docs(artifact_type, conversation_text, max_results)
             if not retrieved_docs_with_scores:
-                logger.info("No relevant guideline documents found.")
+                logger.info(f"No relevant {artifact_type} documents found.")
                 return []
 
-            # Prepare documents for synthesis
-            retrieved_docs = [doc for doc, score in retrieved_docs_with_scores]
-            scores = [score for doc, score in retrieved_docs_with_scores]
-
-            # Define a prompt for synthesizing guidelines
-            prompt_template = """
-            Based on the following retrieved document sections related to the query "{query}", please synthesize a concise and relevant ethical guideline. 
-            Focus on extracting the core principle or recommendation. Present it clearly.
-            Include the source document name if available in the metadata.
-
-            Retrieved Sections:
-            {text}
-
-            Synthesized Guideline (include Title, Description, and Source):
-            Title: [Your synthesized title based on the core principle]
-            Description: [Your synthesized description of the guideline]
-            Source: [Source document name, e.g., {source}]
-            """
-            GUIDELINE_PROMPT = PromptTemplate(template=prompt_template, input_variables=["text", "query", "source"])
-
-            synthesized_guidelines = []
-            # Synthesize each retrieved document chunk individually
-            for i, doc in enumerate(retrieved_docs):
-                # Correctly get filename from metadata, fall back to old 'source' or 'unknown'
-                filename = doc.metadata.get("filename", doc.metadata.get("source", "unknown"))
-                
-                # Use filename as the source identifier passed to the prompt and parser
-                source_identifier = filename 
+            chain = self._synthesis_chain(artifact_type)
+            artifacts = []
+            for doc, score in retrieved_docs_with_scores:
+                precomputed = self._precomputed_artifact(doc, score)
+                if precomputed or not self.live_artifact_synthesis:
+                    if precomputed:
+                        artifacts.append(precomputed)
+                    continue
+                llm_input = self._artifact_llm_input(doc, conversation_text)
+                try:
+                    with get_usage_tracker().track(f"synthesis_{artifact_type}"):
+                        llm_response_text = chain.invoke(llm_input)
+                    artifact = self._build_artifact(artifact_type, llm_response_text, llm_input["source"], score)
+                    if artifact:
+                        artifacts.append(artifact)
+                except Exception as chain_error:
+                    logger.error(f"Error running synthesis chain for {artifact_type} from {llm_input['source']}: {chain_error}")
 
-                chain_input = {
-                    "input_documents": [doc], # Process one doc at a time
-                    "query": conversation_text,
-                    "source": source_identifier # Pass the actual filename/source to the prompt
-                }
+            logger.info(f"Synthesized {len(artifacts)} {artifact_type} artifacts.")
+            return artifacts
 
-                # Use a refine chain for potentially better synthesis of individual docs
-                # chain = load_summarize_chain(self.llm, chain_type="refine", question_prompt=GUIDELINE_PROMPT)
-                # For simplicity and speed, using a basic LLMChain first
-                chain = LLMChain(llm=self.llm, prompt=GUIDELINE_PROMPT)
-                
-                try:
-                    # Prepare input for basic LLMChain (expects 'text' variable from prompt)
-                    llm_input = {"text": doc.page_content, "query": conversation_text, "source": source_identifier}
-                    llm_response_text = chain.run(llm_input)
-                    
-                    # Basic parsing of the LLM response (assumes format adherence)
-                    # Pass the original source_identifier to the parser
-                    parsed_guideline = self._parse_llm_output(llm_response_text, source_identifier, scores[i]) 
-                    if parsed_guideline:
-                       # Ensure the final source field uses the correct identifier
-                       parsed_guideline['source'] = source_identifier 
-                       synthesized_guidelines.append(parsed_guideline)
-                    else:
-                       logger.warning(f"Could not parse LLM output for guideline from source: {source_identifier}")
+        except Exception as e:
+            logger.error(f"Error retrieving/synthesizing {artifact_type} artifacts: {e}")
+            return [] # Return empty on error
 
-                except Exception as chain_error:
-                   logger.error(f"Error running synthesis chain for guideline from {source_identifier}: {chain_error}")
+    def _synthesis_chain(self, artifact_type: str):
+        """The runtime's prebuilt synthesis runnable; built here only for an agent with its own LLM."""
+        runtime = getattr(self, "runtime", None)
+        if runtime is not None and self.llm is runtime.llm:
+            return runtime.synthesis_chain(artifact_type)
+        return synthesis_chain(artifact_type, get_model_router().configure(self.llm, "synthesis"))
+
+    async def _asynthesize_artifact(self, artifact_type: str, doc, score: float, conversation_text: str) -> Optional[Dict]:
+        precomputed = self._precomputed_artifact(doc, score)
+        if precomputed or not self.live_artifact_synthesis:
+            return precomputed
+        llm_input = self._artifact_llm_input(doc, conversation_text)
+        try:
+            # Cards depend on the chunk, not the query, so a cached synthesis can be reused
+            cache = get_artifact_cache()
+            router = get_model_router()
+            route = router.route("synthesis")
+            cache_key = ArtifactCache.key(artifact_type, route.model, SYNTHESIS_PROMPT_VERSIONS[artifact_type],
+                                          doc.page_content)
+            llm_response_text = await cache.get(cache_key) if cache else None
+            if llm_response_text is None:
+                chain = self._synthesis_chain(artifact_type)
+                async with self.runtime.synthesis_semaphore, get_llm_governor().slot("synthesis"):
+                    with track_llm_call("synthesis"), router.timed("synthesis", route.model):
+                        async with get_usage_tracker().atrack(f"synthesis_{artifact_type}"):
+                            llm_response_text = await get_llm_resilience().arun(
+                                route.model, lambda: chain.ainvoke(llm_input), deadline=route.timeout, hedge=False)
+                if cache:
+                    await cache.set(cache_key, llm_response_text)
+            return self._build_artifact(artifact_type, llm_response_text, llm_input["source"], score)
+        except Exception as chain_error:
+            logger.error(f"Error running synthesis chain for {artifact_type} from {llm_input['source']}: {chain_error}")
+            return None
+
+    async def aget_relevant_artifacts(self, artifact_type: str, conversation_text: str, max_results: int,
+                                      embedding: Optional[List[float]] = None) -> List[Dict]:
+        """Async get_relevant_artifacts: all retrieved chunks are synthesized concurrently.
+
+        Concurrency across requests is capped by the runtime's synthesis semaphore.
+        Pass `embedding` to reuse a query vector the caller already computed.
+        """
+        if self.vectorstore is None:
+            logger.warning(f"Vector store not initialized. Cannot retrieve {artifact_type} artifacts.")
+            return []
+
+        try:
+            logger.info(f"Retrieving {artifact_type} artifacts relevant to: '{conversation_text[:100]}...'")
+            retrieved_docs_with_scores = await self._aretrieve_artifact_docs(artifact_type, conversation_text, max_results,
+                                                                             embedding)
+            if not retrieved_docs_with_scores:
+                logger.info(f"No relevant {artifact_type} documents found.")
+                return []
+
+            results = await asyncio.gather(*(
+                self._asynthesize_artifact(artifact_type, doc, score, conversation_text)
+                for doc, score in retrieved_docs_with_scores
+            ))
+            artifacts = [artifact for artifact in results if artifact]
+            logger.info(f"Synthesized {len(artifacts)} {artifact_type} artifacts.")
+            return artifacts
 
-            logger.info(f"Synthesized {len(synthesized_guidelines)} guidelines.")
-            return synthesized_guidelines
-            
         except Exception as e:
-            logger.error(f"Error retrieving/synthesizing guidelines: {e}")
+            logger.error(f"Error retrieving/synthesizing {artifact_type} artifacts: {e}")
             return [] # Return empty on error
 
+    def get_relevant_guidelines(self, conversation_text: str, max_results: int = 3) -> List[Dict]:
+        """Retrieve relevant ethical guidelines based on conversation text."""
+        return self.get_relevant_artifacts("guideline", conversation_text, max_results)
+
+    async def aget_relevant_guidelines(self, conversation_text: str, max_results: int = 3,
+                                       embedding: Optional[List[float]] = None) -> List[Dict]:
+        """Async get_relevant_guidelines."""
+        return await self.aget_relevant_artifacts("guideline", conversation_text, max_results, embedding)
+
     def _parse_llm_output(self, llm_output: str, source: str, score: float) -> Optional[Dict]:
         """Parses the LLM output string to extract structured guideline/case study data."""
         try:
-            title = "Synthesized Information"
-            description = llm_output # Default to full output if parsing fails
-            summary = ""
-            outcome = ""
-            parsed_source = source
-            is_case_study = False # Flag to check if case study fields are found
-
-            # Basic parsing based on expected keywords (Title:, Description:, Summary:, Outcome:, Source:)
-            title_match = re.search(r"Title:(.*?)(?:Description:|Summary:|Source:|$)", llm_output, re.IGNORECASE | re.DOTALL)
-            if title_match:
-                title = title_match.group(1).strip()
-
-            desc_match = re.search(r"Description:(.*?)(?:Source:|$)", llm_output, re.IGNORECASE | re.DOTALL)
-            if desc_match:
-                description = desc_match.group(1).strip()
-
-            # Look for case study specific fields
-            summary_match = re.search(r"Summary:(.*?)(?:Outcome:|Source:|$)", llm_output, re.IGNORECASE | re.DOTALL)
-            if summary_match:
-                summary = summary_match.group(1).strip()
-                is_case_study = True
-                description = summary # Use summary as description for case studies if Description field isn't explicit
-            
-            outcome_match = re.search(r"Outcome:(.*?)(?:Source:|$)", llm_output, re.IGNORECASE | re.DOTALL)
-            if outcome_match:
-                outcome = outcome_match.group(1).strip()
-                is_case_study = True
-
-            source_match = re.search(r"Source:(.*?)$", llm_output, re.IGNORECASE | re.DOTALL)
-            if source_match:
-                parsed_source = source_match.group(1).strip()
-            
-            # Clean up potential artifacts
-            title = title.replace("[Your synthesized title based on the core principle]", "").replace("[Your synthesized title for the case study]", "").strip()
-            description = description.replace("[Your synthesized description of the guideline]", "").replace("[Your synthesized summary of the case study situation]", "").strip()
-            outcome = outcome.replace("[Your synthesized summary of the outcome or key lesson]", "").strip()
-            parsed_source = parsed_source.replace("[Source document name, e.g., {source}]", source).strip()
-            
-            if not title or not description:
-                logger.warning(f"Could not parse title or description reliably from LLM output: {llm_output[:100]}...")
-                return None # Or return with default values if preferred
-
-            return {
-                "id": parsed_source + "-" + str(uuid.uuid4())[:8],
-                "title": title,
-                "description": description, 
-                "source": parsed_source,
-                "category": "Synthesized", # Or try to get from original doc metadata if needed
-                "relevance": float(1.0 - min(float(score), 1.0)), # Convert distance score to relevance
-                # Add case study fields if present
-                "summary": summary if is_case_study else None, 
-                "outcome": outcome if is_case_study else None,
-            }
+            card = parse_card(llm_output, source)
+            return card_to_artifact(card, score) if card else None
         except Exception as e:
             logger.error(f"Error parsing LLM output '{llm_output[:50]}...': {e}")
             return None
 
     def get_relevant_case_studies(self, conversation_text: str, max_results: int = 2) -> List[Dict]:
         """Retrieve relevant case studies based on conversation text."""
-        if self.vectorstore is None:
-            logger.warning("Vector store not initialized. Cannot retrieve case studies.")
-            return []
+        return self.get_relevant_artifacts("case_study", conversation_text, max_results)
 
-        try:
-            logger.info(f"Retrieving case studies relevant to: '{conversation_text[:100]}...'")
-            # Retrieve relevant document chunks with scores
-            retrieved_docs_with_scores = self.vectorstore.similarity_search_with_score(
-                query=conversation_text,
-                k=max_results,
-                filter={"artifact_type": "case_study"} # Filter for case studies
-            )
-
-            if not retrieved_docs_with_scores:
-                logger.info("No relevant case study documents found.")
-                return []
+    async def aget_relevant_case_studies(self, conversation_text: str, max_results: int = 2,
+                                         embedding: Optional[List[float]] = None) -> List[Dict]:
+        """Async get_relevant_case_studies."""
+        return await self.aget_relevant_artifacts("case_study", conversation_text, max_results, embedding)
 
-            retrieved_docs = [doc for doc, score in retrieved_docs_with_scores]
-            scores = [score for doc, score in retrieved_docs_with_scores]
-
-            # Define prompt for synthesizing case studies
-            prompt_template = """
-            Based on the following retrieved document section related to the query "{query}", please synthesize a concise summary of the case study.
-            Include a title, a brief summary of the situation, the outcome (if available), and the source.
-
-            Retrieved Section:
-            {text}
-
-            Synthesized Case Study (include Title, Summary, Outcome, and Source):
-            Title: [Your synthesized title for the case study]
-            Summary: [Your synthesized summary of the case study situation]
-            Outcome: [Your synthesized summary of the outcome or key lesson]
-            Source: [Source document name, e.g., {source}]
-            """
-            CASE_STUDY_PROMPT = PromptTemplate(template=prompt_template, input_variables=["text", "query", "source"])
-
-            synthesized_case_studies = []
-            for i, doc in enumerate(retrieved_docs):
-                # Correctly get filename from metadata, fall back to old 'source' or 'unknown'
-                filename = doc.metadata.get("filename", doc.metadata.get("source", "unknown"))
-                
-                # Use filename as the source identifier passed to the prompt and parser
-                source_identifier = filename
+    async def aretrieve_artifact_docs_by_type(self, conversation_text: str,
+                                              quotas: Optional[Dict[str, int]] = None,
+                                              embedding: Optional[List[float]] = None) -> Dict[str, List]:
+        """Retrieve chunks of several artifact types with one embedding and one index scan.
 
-                chain = LLMChain(llm=self.llm, prompt=CASE_STUDY_PROMPT)
-                try:
-                    llm_input = {"text": doc.page_content, "query": conversation_text, "source": source_identifier}
-                    llm_response_text = chain.run(llm_input)
-                    
-                    # Pass the original source_identifier to the parser
-                    parsed_case_study = self._parse_llm_output(llm_response_text, source_identifier, scores[i]) 
-                    if parsed_case_study:
-                        # Ensure the final source field uses the correct identifier
-                        parsed_case_study['source'] = source_identifier
-                        synthesized_case_studies.append(parsed_case_study)
-                    else:
-                        logger.warning(f"Could not parse LLM output for case study from source: {source_identifier}")
-                except Exception as chain_error:
-                    logger.error(f"Error running synthesis chain for case study from {source_identifier}: {chain_error}")
+        Searches all requested types at once with k = total quota * ARTIFACT_RETRIEVAL_OVERFETCH,
+        splits the hits by artifact_type in rank order and keeps up to each type's quota.
+        A type that comes up short while its partition holds more chunks gets one exact
+        filtered search with the same vector, so quotas are met whenever matches exist.
 
-            logger.info(f"Synthesized {len(synthesized_case_studies)} case studies.")
-            return synthesized_case_studies
-            
+        Returns a dict mapping each artifact type to its (document, distance) pairs.
+        """
+        quotas = quotas or DEFAULT_ARTIFACT_QUOTAS
+        results: Dict[str, List] = {artifact_type: [] for artifact_type in quotas}
+        if self.vectorstore is None:
+            logger.warning("Vector store not initialized. Cannot retrieve artifacts.")
+            return results
+
+        with track_stage("retrieval"):
+            return await self._aretrieve_artifact_docs_by_type(conversation_text, quotas, results, embedding)
+
+    async def _aretrieve_artifact_docs_by_type(self, conversation_text: str, quotas: Dict[str, int],
+                                               results: Dict[str, List], embedding: Optional[List[float]]):
+        if embedding is None:
+            embedding = await self.vectorstore.embeddings.aembed_query(conversation_text)
+        k = max(sum(quotas.values()), 1) * ARTIFACT_RETRIEVAL_OVERFETCH
+        hits = await self.asearch_documents(conversation_text, k=k, filter={"artifact_type": list(quotas)},
+                                            embedding=embedding)
+        for doc, score in hits:
+            artifact_type = doc.metadata.get("artifact_type", doc.metadata.get("type"))
+            if artifact_type in results and len(results[artifact_type]) < quotas[artifact_type]:
+                results[artifact_type].append((doc, score))
+
+        available = self.filtered_index.values("artifact_type") if self.filtered_index is not None else {}
+        for artifact_type, quota in quotas.items():
+            found = len(results[artifact_type])
+            if found < quota and available.get(artifact_type, quota) > found:
+                results[artifact_type] = await self.asearch_documents(
+                    conversation_text, k=quota, filter={"artifact_type": artifact_type}, embedding=embedding)
+        logger.info("Retrieved artifact chunks: " + ", ".join(f"{len(docs)} {t}" for t, docs in results.items()))
+        return results
+
+    async def aget_relevant_artifacts_by_type(self, conversation_text: str,
+                                              quotas: Optional[Dict[str, int]] = None) -> Dict[str, List[Dict]]:
+        """Single-pass retrieval of several artifact types, with every chunk synthesized concurrently."""
+        quotas = quotas or DEFAULT_ARTIFACT_QUOTAS
+        try:
+            docs_by_type = await self.aretrieve_artifact_docs_by_type(conversation_text, quotas)
+            pairs = [(artifact_type, doc, score) for artifact_type, docs in docs_by_type.items() for doc, score in docs]
+            synthesized = await asyncio.gather(*(
+                self._asynthesize_artifact(artifact_type, doc, score, conversation_text)
+                for artifact_type, doc, score in pairs
+            ))
+            artifacts: Dict[str, List[Dict]] = {artifact_type: [] for artifact_type in quotas}
+            for (artifact_type, _, _), artifact in zip(pairs, synthesized):
+                if artifact:
+                    artifacts[artifact_type].append(artifact)
+            return artifacts
         except Exception as e:
-            logger.error(f"Error retrieving/synthesizing case studies: {e}")
-            return [] # Return empty on error
+            logger.error(f"Error retrieving/synthesizing artifacts: {e}")
+            return {artifact_type: [] for artifact_type in quotas}
+
+    async def aget_guidelines_and_case_studies(self, conversation_text: str, max_guidelines: int = 3,
+                                               max_case_studies: int = 2) -> Tuple[List[Dict], List[Dict]]:
+        """Fetch and synthesize guidelines and case studies in one retrieval pass."""
+        artifacts = await self.aget_relevant_artifacts_by_type(
+            conversation_text, {"guideline": max_guidelines, "case_study": max_case_studies})
+        return artifacts["guideline"], artifacts["case_study"]
 
     # Add a helper method to add messages to history manually
     def _add_to_history(self, role: str, content: str):
@@ -1036,29 +1131,3 @@ Please describe the ethical concern you'd like to discuss."""
                 logger.warning(f"Unknown role: {role}")
         except Exception as e:
             logger.error(f"Error adding message to history: {str(e)}")
-
-    def _initialize_knowledge_base(self, index_dir: str):
-        """Initialize the knowledge base from a saved FAISS index."""
-        try:
-            logger.info(f"Loading vector store from {index_dir}")
-            
-            # Load the FAISS index with safe deserialization enabled
-            self.vectorstore = FAISS.load_local(
-                index_dir,
-                OpenAIEmbeddings(openai_api_key=self.openai_api_key),
-                allow_dangerous_deserialization=True  # Enable safe deserialization
-            )
-            
-            # Initialize the QA chain
-            self.qa_chain = RetrievalQA.from_chain_type(
-                llm=self.llm,
-                chain_type="stuff",
-                retriever=self.vectorstore.as_retriever(),
-                return_source_documents=True
-            )
-            
-            logger.info("Successfully loaded knowledge base")
-        except Exception as e:
-            logger.error(f"Error loading vector store: {str(e)}")
-            self.vectorstore = None
-            self.qa_chain = None 
\ No newline at end of file
@@ -0,0 +1,224 @@
+"""Process-wide agent runtime shared by all requests, plus per-conversation session state."""
+
+import os
+import json
+import asyncio
+import time
+import logging
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import MappingProxyType
+from typing import Dict, List, Optional, Any, Tuple
+
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain.chains import RetrievalQA
+from langchain_community.vectorstores import FAISS
+
+from langchain_core.runnables import Runnable
+
+from agents.artifact_synthesis import SYNTHESIS_PROMPTS, synthesis_chain
+from agents.filtered_index import FilteredVectorIndex
+from services.model_routing import ModelRoute, get_model_router
+from services.embedding_cache import CachedEmbeddings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG_PATH = Path('config/agent_config.json')
+
+# Maximum number of concurrent artifact synthesis LLM calls per process
+ARTIFACT_SYNTHESIS_CONCURRENCY = int(os.getenv("ARTIFACT_SYNTHESIS_CONCURRENCY", "5"))
+
+# Synthesize cards at request time for chunks indexed without a pre-synthesized card
+ARTIFACT_LIVE_SYNTHESIS = os.getenv("ARTIFACT_LIVE_SYNTHESIS", "true").lower() == "true"
+
+# Seconds after a failed runtime build during which requests get 503 instead of retrying the load
+RUNTIME_RETRY_INTERVAL = float(os.getenv("RUNTIME_RETRY_INTERVAL", "30"))
+
+
+def load_agent_config(config_path: Path = DEFAULT_CONFIG_PATH) -> Dict[str, Any]:
+    """Load the agent configuration file, falling back to defaults if it is missing or invalid."""
+    default_config = {
+        'cache_dir': 'cache',
+        'index_dir': str(Path('data/processed/combined')),
+        'openai_api_key': os.getenv('OPENAI_API_KEY')
+    }
+    if not config_path.exists():
+        logger.info("No configuration file found, using default config")
+        return default_config
+    try:
+        with open(config_path, 'r') as f:
+            config = json.load(f)
+        logger.info("Loaded agent configuration from config file")
+        return config
+    except Exception as e:
+        logger.error(f"Error loading config from {config_path}: {e}")
+        return default_config
+
+
+@dataclass
+class AgentSession:
+    """Lightweight, per-conversation state. One instance per request/conversation, never shared."""
+    conversation_id: Optional[str] = None
+    history: List[Dict[str, str]] = field(default_factory=list)
+    practice_mode: bool = False
+    manager_type: Optional[str] = None
+    current_scenario: Optional[Dict[str, Any]] = None
+    practice_scores: List[int] = field(default_factory=list)
+    user_role: Optional[str] = None
+
+
+class AgentRuntime:
+    """Immutable bundle of the expensive LangChain components.
+
+    Built once per process (normally in the FastAPI lifespan) and shared by every
+    request. It holds no conversation state, so concurrent requests can use it
+    without locking; all mutable state lives in AgentSession.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        """Load embeddings, LLM client, vector store and QA chain.
+
+        Args:
+            config: Configuration dictionary (see load_agent_config).
+        """
+        object.__setattr__(self, '_frozen', False)
+        self.config = MappingProxyType(dict(config))
+        self.openai_api_key = config.get('openai_api_key', os.getenv('OPENAI_API_KEY'))
+        self.model_name = config.get('model_name', "gpt-4o-mini")
+        self.temperature = config.get('temperature', 0.7)
+
+        self.llm = ChatOpenAI(
+            model_name=self.model_name,
+            temperature=self.temperature,
+            openai_api_key=self.openai_api_key
+        )
+        # Query and document embeddings go through the shared embedding cache
+        self.embeddings = CachedEmbeddings(OpenAIEmbeddings(openai_api_key=self.openai_api_key))
+        self.synthesis_semaphore = asyncio.Semaphore(
+            config.get('artifact_synthesis_concurrency', ARTIFACT_SYNTHESIS_CONCURRENCY)
+        )
+        self.live_artifact_synthesis = config.get('live_artifact_synthesis', ARTIFACT_LIVE_SYNTHESIS)
+        # Synthesis runnables per (artifact type, "synthesis" route), built once and shared by all requests
+        self._synthesis_chains: Dict[Tuple[str, ModelRoute], Runnable] = {}
+        for artifact_type in SYNTHESIS_PROMPTS:
+            self.synthesis_chain(artifact_type)
+
+        vectorstore = None
+        filtered_index = None
+        qa_chain = None
+        index_dir = config.get('index_dir')
+        if index_dir:
+            try:
+                logger.info(f"Loading vector store from {index_dir}")
+                vectorstore = FAISS.load_local(
+                    index_dir,
+                    self.embeddings,
+                    allow_dangerous_deserialization=True  # We only load indexes we built ourselves
+                )
+                qa_chain = RetrievalQA.from_chain_type(
+                    llm=self.llm,
+                    chain_type="stuff",
+                    retriever=vectorstore.as_retriever(),
+                    return_source_documents=True
+                )
+                logger.info("Successfully loaded knowledge base")
+            except Exception as e:
+                logger.error(f"Error loading vector store: {str(e)}")
+                vectorstore = None
+                qa_chain = None
+            if vectorstore is not None:
+                try:
+                    filtered_index = FilteredVectorIndex(vectorstore, self.embeddings)
+                except Exception as e:
+                    logger.error(f"Error building filter bitmaps, filtered search will over-fetch: {str(e)}")
+        else:
+            logger.warning("No index_dir provided. Running without knowledge base.")
+
+        self.vectorstore = vectorstore
+        self.filtered_index = filtered_index
+        self.qa_chain = qa_chain
+        self._frozen = True
+
+    def synthesis_chain(self, artifact_type: str) -> Runnable:
+        """Prebuilt synthesis runnable for an artifact type under the current "synthesis" route.
+
+        A changed route (routes file reload) builds its chain once on first use; the
+        previous ones stay cached, so switching back costs nothing.
+        """
+        router = get_model_router()
+        key = (artifact_type, router.route("synthesis"))
+        chain = self._synthesis_chains.get(key)
+        if chain is None:
+            chain = self._synthesis_chains[key] = synthesis_chain(artifact_type, router.configure(self.llm, "synthesis"))
+        return chain
+
+    def __setattr__(self, name: str, value: Any):
+        if getattr(self, '_frozen', False):
+            raise AttributeError(f"AgentRuntime is immutable; cannot set '{name}'")
+        object.__setattr__(self, name, value)
+
+    @classmethod
+    def from_config_file(cls, config_path: Path = DEFAULT_CONFIG_PATH) -> "AgentRuntime":
+        """Build a runtime from the agent configuration file."""
+        return cls(load_agent_config(config_path))
+
+
+_runtime: Optional[AgentRuntime] = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime() -> AgentRuntime:
+    """Return the process-wide runtime, building it on first use."""
+    global _runtime
+    if _runtime is None:
+        with _runtime_lock:
+            if _runtime is None:
+                _runtime = AgentRuntime.from_config_file()
+    return _runtime
+
+
+def set_runtime(runtime: Optional[AgentRuntime]):
+    """Install (or clear, with None) the process-wide runtime."""
+    global _runtime
+    with _runtime_lock:
+        _runtime = runtime
+
+
+class RuntimeUnavailable(Exception):
+    """The shared runtime is not loaded and could not be built."""
+
+
+_async_build_lock = asyncio.Lock()
+_last_build_failure: Optional[float] = None
+
+
+def loaded_runtime() -> AgentRuntime:
+    """Return the runtime if it is loaded, without building it. Raises RuntimeUnavailable otherwise."""
+    if _runtime is None:
+        raise RuntimeUnavailable("Agent runtime is not loaded")
+    return _runtime
+
+
+async def aget_runtime() -> AgentRuntime:
+    """Async get_runtime for request handlers: the build (FAISS and model load) runs in a worker thread.
+
+    Concurrent callers wait for a single build. After a failed build, callers get
+    RuntimeUnavailable for RUNTIME_RETRY_INTERVAL seconds instead of starting another.
+    """
+    global _last_build_failure
+    if _runtime is not None:
+        return _runtime
+    async with _async_build_lock:
+        if _runtime is not None:
+            return _runtime
+        if _last_build_failure is not None and time.monotonic() - _last_build_failure < RUNTIME_RETRY_INTERVAL:
+            raise RuntimeUnavailable("Agent runtime failed to load; retrying shortly")
+        try:
+            runtime = await asyncio.to_thread(get_runtime)
+        except Exception as e:
+            _last_build_failure = time.monotonic()
+            logger.error(f"Failed to build shared agent runtime: {str(e)}")
+            raise RuntimeUnavailable(f"Agent runtime failed to load: {str(e)}") from e
+        _last_build_failure = None
+        return runtime
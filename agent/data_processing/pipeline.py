@@ -1,4 +1,5 @@
 import os
+import asyncio
 import logging
 from pathlib import Path
 from typing import Dict, List, Optional
@@ -14,6 +15,8 @@ from embeddings.embedding_model import EmbeddingModel
 from langchain_core.documents import Document
 from langchain.vectorstores import FAISS
 
+from services.embedding_cache import CachedEmbeddings
+
 logger = logging.getLogger(__name__)
 
 class DataPipeline:
@@ -77,6 +80,12 @@ class DataPipeline:
             if total_chunks == 0:
                 raise ValueError("No chunks were created from the documents")
             
+            # Optional: pre-synthesize artifact cards so retrieval needs no LLM calls
+            if self.config.get('presynthesize_cards', False):
+                logger.info("Pre-synthesizing artifact cards...")
+                print("\nPre-synthesizing artifact cards...")
+                self._presynthesize_cards(chunked_documents)
+            
             # Step 3: Create embeddings with progress tracking
             logger.info("Creating embeddings...")
             print("\nCreating embeddings (this may take several minutes)...")
@@ -131,6 +140,18 @@ class DataPipeline:
             
         return chunked
         
+    def _presynthesize_cards(self, documents: Dict[str, List[Dict]]) -> int:
+        """Store a synthesized card in the metadata of every guideline and case study chunk."""
+        from langchain_openai import ChatOpenAI
+        from agents.artifact_synthesis import presynthesize_cards
+
+        model_name = self.config.get('synthesis_model', 'gpt-4o-mini')
+        llm = ChatOpenAI(model_name=model_name, temperature=0,
+                         openai_api_key=self.config.get('openai_api_key', os.getenv('OPENAI_API_KEY')))
+        chunks = documents["guidelines"] + documents["case_studies"]
+        return asyncio.run(presynthesize_cards(chunks, llm, model_name, text_key="text",
+                                               concurrency=self.config.get('synthesis_concurrency', 8)))
+        
     def _create_embeddings(self, documents: Dict[str, List[Dict]]) -> Dict[str, List]:
         """Create embeddings for all document chunks."""
         all_chunks = []
@@ -177,12 +198,10 @@ class DataPipeline:
         # Combine all documents and create mapping
         all_chunks_content = []
         all_chunks_metadata = []
-        for chunk in documents["guidelines"]:
-            all_chunks_content.append(chunk.get('text', ''))
-            all_chunks_metadata.append(chunk.get('metadata', {}))
-        for chunk in documents["case_studies"]:
+        for chunk in documents["guidelines"] + documents["case_studies"]:
             all_chunks_content.append(chunk.get('text', ''))
-            all_chunks_metadata.append(chunk.get('metadata', {}))
+            # _create_embeddings flattens TextChunker metadata onto the chunk itself
+            all_chunks_metadata.append(chunk.get('metadata') or {k: v for k, v in chunk.items() if k != 'text'})
             
         # Create LangChain Documents
         lc_docs = [Document(page_content=content, metadata=meta) 
@@ -192,7 +211,8 @@ class DataPipeline:
         # This handles saving in the format expected by load_local
         try:
             logger.info("Creating FAISS index from documents...")
-            vectorstore = FAISS.from_documents(lc_docs, self.embedding_model.embeddings) # Use the actual embedding function
+            # Rebuilding an unchanged corpus reuses cached chunk embeddings
+            vectorstore = FAISS.from_documents(lc_docs, CachedEmbeddings(self.embedding_model.embeddings))
             
             # Save index using the standard FAISS method
             save_path = str(self.index_dir)
@@ -1,26 +1,46 @@
-from fastapi import FastAPI, HTTPException, Depends, Header, Request, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, List, Any, Union, Literal
+from typing import Optional, Dict, List, Any, Union, Literal, Tuple, Set
 import uvicorn
 import os
 from dotenv import load_dotenv
 import logging
 from agents.langchain_agent import LangChainAgent
+from agents.runtime import (RUNTIME_RETRY_INTERVAL, AgentRuntime, AgentSession, RuntimeUnavailable, aget_runtime,
+                            loaded_runtime, set_runtime)
+from agents.artifact_cache import ArtifactCache, DiskArtifactStore, set_artifact_cache
+from services.embedding_cache import EmbeddingCache, set_embedding_cache
+from services.metrics import MetricsMiddleware, registry as metrics_registry, track_llm_call, track_stage
+from services.backend_client import get_backend_client, close_backend_client
+from services.semantic_cache import SemanticResponseCache
+from services.job_queue import JobWorkerPool, create_job_queue
+from services.governor import AdmissionRejected, LLMGovernor, set_llm_governor
+from services.resilience import LLMResilience, set_llm_resilience
+from services.cancellation import ClientDisconnected, cancel_on_disconnect, record_cancellation
+from services.model_routing import ModelRouter, set_model_router
+from services.conversation_channel import ConversationChannel
+from services.idempotency import RequestCoalescer, idempotency_key
+from services.admin_auth import require_admin
+from services.usage import (UsageTracker, get_usage_context, seconds_until_next_day, set_usage_context,
+                            set_usage_tracker, start_usage_attribution, usage_day)
+from memory.conversation_memory import ConversationMemory, create_redis_clients
+from memory.history_cache import HistoryCache
+from memory.token_budget import TokenBudgetedHistory
+from prompts.registry import Prompt, get_prompt_registry
 from datetime import datetime, UTC
 import uuid
 from pathlib import Path
 import json
-import requests
+import hashlib
 import traceback
 import asyncio
 import httpx
 import concurrent.futures
-from langchain_core.messages import SystemMessage, HumanMessage
+import time
+from contextlib import aclosing, asynccontextmanager
 from langchain.chat_models import ChatOpenAI
-from fastapi.responses import JSONResponse
-import redis
-from langchain.memory import ConversationBufferMemory
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
 # Load environment variables
 load_dotenv()
@@ -42,12 +62,59 @@ BACKEND_API_KEY = os.getenv("BACKEND_API_KEY", "")  # If needed for authenticati
 
 # Initialize Redis connection for conversation memory
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-try:
-    redis_client = redis.from_url(REDIS_URL)
-    logger.info(f"Connected to Redis at {REDIS_URL}")
-except Exception as e:
-    logger.error(f"Failed to connect to Redis: {str(e)}. Using fallback memory.")
-    redis_client = None
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+redis_client, async_redis_client = create_redis_clients(REDIS_URL, REDIS_MAX_CONNECTIONS)
+
+# History mode: "turns" sends the last historyLimit exchanges verbatim, "token_budget" fits
+# recent exchanges into HISTORY_TOKEN_BUDGET tokens and summarizes the rest in the background
+HISTORY_MODE = os.getenv("HISTORY_MODE", "turns")
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "300"))
+HISTORY_MODES = ("turns", "token_budget")
+
+# Start artifact retrieval alongside the LLM call in send_message, and how long to wait for it
+# after the answer is ready when the client asks for artifact ids in the response
+ARTIFACT_PREFETCH = os.getenv("ARTIFACT_PREFETCH", "true").lower() == "true"
+ARTIFACT_PREFETCH_WAIT = float(os.getenv("ARTIFACT_PREFETCH_WAIT", "2.0"))
+
+# Prompts of the practice flow (feedback, rehearsal, simulated replies), admitted after plain chat
+PRACTICE_PROMPTS = {"post_feedback", "rehearsal", "simulate_reply"}
+
+# Strong references to running prefetch tasks (the event loop only keeps weak ones)
+artifact_prefetch_tasks: Set[asyncio.Task] = set()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the shared agent runtime and backend HTTP client once at startup and release them on shutdown."""
+    set_embedding_cache(embedding_cache)
+    set_usage_tracker(usage_tracker)
+    set_llm_governor(llm_governor)
+    set_llm_resilience(llm_resilience)
+    set_model_router(model_router)
+    try:
+        runtime = await asyncio.to_thread(AgentRuntime.from_config_file)
+        set_runtime(runtime)
+        logger.info("Shared agent runtime loaded")
+    except Exception as e:
+        logger.error(f"Failed to load shared agent runtime at startup: {str(e)}. Will retry on first request.")
+    get_backend_client()
+    set_artifact_cache(artifact_cache)
+    artifact_jobs.start()
+    await history_cache.start()
+    yield
+    await history_cache.stop()
+    await artifact_jobs.stop()
+    set_artifact_cache(None)
+    artifact_cache.close()
+    await close_backend_client()
+    await budgeted_history.aclose()
+    await conversation_memory.aclose()
+    set_runtime(None)
+    set_model_router(None)
+    set_llm_resilience(None)
+    set_llm_governor(None)
+    set_usage_tracker(None)
+    set_embedding_cache(None)
 
 # Initialize FastAPI app with detailed documentation
 app = FastAPI(
@@ -55,7 +122,8 @@ app = FastAPI(
     description="API for ethical decision-making assistance in technology projects",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # Configure CORS for frontend
@@ -67,122 +135,81 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-class ConversationMemory:
-    """Manages conversation memory storage and retrieval."""
-    
-    def __init__(self, redis_client=None, expiry_seconds=86400):  # Default 24-hour expiry
-        self.redis_client = redis_client
-        self.expiry_seconds = expiry_seconds
-        self.fallback_storage = {}  # In-memory fallback if Redis unavailable
-    
-    def get_conversation_key(self, conversation_id: str) -> str:
-        """Create a Redis key for the conversation."""
-        return f"conversation:{conversation_id}:history"
-    
-    def save_exchange(self, conversation_id: str, user_message: str, assistant_message: str) -> bool:
-        """Save a conversation exchange to memory."""
-        try:
-            # Generate a timestamp for this exchange
-            timestamp = datetime.now().isoformat()
-            
-            # Create the exchange object with timestamp
-            exchange = {
-                "user": user_message,
-                "assistant": assistant_message,
-                "timestamp": timestamp
-            }
-            
-            history_key = self.get_conversation_key(conversation_id)
-            existing_history = self.redis_client.get(history_key)
-            
-            if existing_history:
-                history = json.loads(existing_history)
-            else:
-                history = []
-                
-            history.append(exchange)
-            
-            # Save the updated history
-            self.redis_client.set(history_key, json.dumps(history))
-            logger.info(f"Saved conversation exchange for {conversation_id} at {timestamp}")
-            return True
-        except Exception as e:
-            logger.error(f"Error saving exchange: {str(e)}")
-            return False
-    
-    def get_history(self, conversation_id: str, max_turns: int = 10) -> List[Dict[str, str]]:
-        """Retrieve conversation history for a conversation."""
-        try:
-            if self.redis_client:
-                key = self.get_conversation_key(conversation_id)
-                data = self.redis_client.get(key)
-                
-                if data:
-                    history = json.loads(data)
-                    # Return the most recent exchanges up to max_turns
-                    return history[-max_turns:] if max_turns > 0 else history
-                return []
-            else:
-                # Fallback to in-memory storage
-                history = self.fallback_storage.get(conversation_id, [])
-                return history[-max_turns:] if max_turns > 0 else history
-        except Exception as e:
-            logger.error(f"Error retrieving conversation history: {str(e)}")
-            return []
-    
-    def format_for_prompt(self, conversation_id: str, max_turns: int = 20) -> str:
-        """Format conversation history for inclusion in a prompt."""
-        history = self.get_history(conversation_id, max_turns)
-        if not history:
-            return ""
-        
-        # Reverse the history to put most recent conversations last (chronological order)
-        history = history[::-1]
-        
-        formatted = "===== CONVERSATION HISTORY (CHRONOLOGICAL ORDER) =====\n\n"
-        
-        # Add each exchange with clear formatting and timestamps if available
-        for i, exchange in enumerate(history):
-            exchange_num = i + 1
-            timestamp = exchange.get('timestamp', 'unknown time')
-            formatted += f"EXCHANGE {exchange_num} (Time: {timestamp}):\n"
-            formatted += f"USER: {exchange.get('user', '')}\n"
-            formatted += f"ASSISTANT: {exchange.get('assistant', '')}\n\n"
-        
-        return formatted
-    
-    def clear_history(self, conversation_id: str) -> bool:
-        """Clear conversation history."""
-        try:
-            if self.redis_client:
-                key = self.get_conversation_key(conversation_id)
-                self.redis_client.delete(key)
-            else:
-                if conversation_id in self.fallback_storage:
-                    del self.fallback_storage[conversation_id]
-            
-            logger.info(f"Cleared conversation history for {conversation_id}")
-            return True
-        except Exception as e:
-            logger.error(f"Error clearing conversation history: {str(e)}")
-            return False
-    
-    def get_langchain_memory(self, conversation_id: str) -> ConversationBufferMemory:
-        """Get a LangChain ConversationBufferMemory object for the conversation."""
-        from langchain_core.messages import AIMessage, HumanMessage
-        
-        memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-        
-        # Load history from storage into memory
-        history = self.get_history(conversation_id)
-        for exchange in history:
-            memory.chat_memory.add_user_message(exchange.get('user', ''))
-            memory.chat_memory.add_ai_message(exchange.get('assistant', ''))
-        
-        return memory
+# Request counts and latency per route template, exported on /metrics
+app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    """LLM calls that admission control turned away get a fast 429 instead of waiting to time out."""
+    logger.warning(f"Rejected {request.url.path} ({exc.reason}): {str(exc)}")
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+        content={"detail": str(exc), "reason": exc.reason, "retryAfter": exc.retry_after}
+    )
 
-# Initialize the conversation memory manager
-conversation_memory = ConversationMemory(redis_client)
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnected):
+    """Nobody is listening; 499 (client closed request) only shows up in access logs and metrics."""
+    logger.info(f"Cancelled {request.url.path}: client disconnected")
+    return Response(status_code=499)
+
+# Initialize the conversation memory manager, with an in-process L1 of active histories in front of Redis
+history_cache = HistoryCache(async_redis_client)
+conversation_memory = ConversationMemory(redis_client, async_redis_client, history_cache=history_cache)
+budgeted_history = TokenBudgetedHistory(
+    conversation_memory,
+    llm_provider=lambda: loaded_runtime().llm,
+    token_budget=HISTORY_TOKEN_BUDGET,
+    summary_token_limit=HISTORY_SUMMARY_TOKENS
+)
+
+# System prompts are loaded and versioned once at startup
+prompt_registry = get_prompt_registry()
+
+# Artifact generation runs on a bounded, retrying job queue instead of per-request background tasks
+artifact_jobs = JobWorkerPool(
+    create_job_queue("artifacts", async_redis_client),
+    handlers={"artifacts": lambda job: generate_artifacts_only(job.payload["conversation_id"], job.payload["user_query"],
+                                                               job.payload.get("user_id"))},
+    name="artifacts"
+)
+
+# Synthesized artifact cards, keyed by chunk content (Redis, with a local SQLite fallback)
+artifact_cache = ArtifactCache(async_redis_client, DiskArtifactStore())
+
+# Query and document embeddings shared across requests and workers (in-process LRU in front of Redis)
+embedding_cache = EmbeddingCache(redis_client, async_redis_client)
+
+# Token, cost and latency rollups per request type, conversation and user, plus per-user daily budgets
+usage_tracker = UsageTracker(redis_client, async_redis_client)
+
+# Duplicate submissions of a chat turn share one execution; results are replayed for IDEMPOTENCY_WINDOW seconds
+message_coalescer = RequestCoalescer(async_redis_client)
+
+# Process-wide cap on concurrent LLM calls, with priority classes and per-user rate limits
+llm_governor = LLMGovernor()
+
+# Per-route deadlines, hedging, circuit breakers and fallbacks around LLM calls
+llm_resilience = LLMResilience()
+
+# Model, output budget and timeout per request type, from config/model_routes.json
+model_router = ModelRouter()
+
+# Background queue state, read when /metrics is scraped
+metrics_registry.gauge("eva_job_queue_depth", "Jobs waiting in the background queue (including delayed retries).",
+                       ("queue",), callback=lambda: job_queue_depths())
+metrics_registry.gauge("eva_jobs_in_flight", "Background jobs currently being processed.",
+                       ("queue",), callback=lambda: {("artifacts",): artifact_jobs.in_flight})
+
+async def job_queue_depths() -> Dict[Tuple[str], int]:
+    return {("artifacts",): await artifact_jobs.depth()}
+
+# Semantic cache for first-turn answers (enable with SEMANTIC_CACHE_ENABLED=true)
+async def embed_with_runtime(text: str):
+    return await (await aget_runtime()).embeddings.aembed_query(text)
+
+response_cache = SemanticResponseCache(embed=embed_with_runtime)
 
 class StartConversationRequest(BaseModel):
     """Model for starting a new conversation."""
@@ -262,6 +289,9 @@ class Query(BaseModel):
     request_type: Optional[str] = "initial_query"
     includeHistory: Optional[bool] = True
     historyLimit: Optional[int] = 20
+    historyMode: Optional[str] = None  # "turns" or "token_budget"; defaults to HISTORY_MODE
+    historyTokenBudget: Optional[int] = None
+    userId: Optional[str] = None  # Usage is attributed to this user (or the X-User-Id header)
 
 class PracticeModeRequest(BaseModel):
     """Model for entering/exiting practice mode."""
@@ -334,6 +364,11 @@ class CaseStudiesResponse(BaseModel):
     """Model for case studies response."""
     caseStudies: List[CaseStudyItem] = Field(..., description="List of relevant case studies")
 
+class RelevantArtifactsResponse(BaseModel):
+    """Model for the combined guidelines and case studies response."""
+    guidelines: List[GuidelineItem] = Field(..., description="List of relevant ethical guidelines")
+    caseStudies: List[CaseStudyItem] = Field(..., description="List of relevant case studies")
+
 class ConversationContext(BaseModel):
     """Model for conversation context."""
     messages: List[Dict[str, Any]] = Field(
@@ -360,6 +395,14 @@ class ArtifactGenerationResponse(BaseModel):
     guidelines: List[ArtifactItem]
     caseStudies: List[ArtifactItem]
 
+class TokenBudgetRequest(BaseModel):
+    """Model for overriding a user's daily token budget."""
+    dailyTokens: Optional[int] = Field(
+        None,
+        description="Tokens the user may spend per UTC day (0 = unlimited, null = use the default)",
+        example=200000
+    )
+
 class PracticeScorePayload(BaseModel):
     conversationId: str
     managerType: str
@@ -370,45 +413,157 @@ class PracticeScorePayload(BaseModel):
 class MessageExchangeResponse(BaseModel):
     messages: List[ConversationContentResponseDTO] # Expecting a list of message objects
 
-def get_agent():
-    """Create a new agent instance for each request to avoid state sharing."""
+async def get_agent():
+    """Return a lightweight agent bound to the shared runtime.
+
+    The heavy components (vector store, embeddings, LLM clients, chains) are loaded
+    once per process; each call only creates fresh per-conversation session state.
+    If startup could not load them, the rebuild runs off the event loop, and requests
+    get 503 while it keeps failing.
+    """
     try:
-        # Try to load configuration from config file
-        config_path = Path('config/agent_config.json')
-        if config_path.exists():
-            try:
-                with open(config_path, 'r') as f:
-                    config = json.load(f)
-                logger.info("Loaded agent configuration from config file")
-            except Exception as e:
-                logger.error(f"Error loading config from {config_path}: {e}")
-                # Fallback configuration
-                config = {
-                    'cache_dir': 'cache',
-                    'index_dir': str(Path('data/processed/combined')),
-                    'openai_api_key': os.getenv('OPENAI_API_KEY')
-                }
-        else:
-            logger.info("No configuration file found, using default config")
-            # Default configuration
-            config = {
-                'cache_dir': 'cache',
-                'index_dir': str(Path('data/processed/combined')),
-                'openai_api_key': os.getenv('OPENAI_API_KEY')
-            }
-            
-        # IMPORTANT: Create a new agent instance for each request
-        # This ensures no state is shared between different conversations
-        new_agent = LangChainAgent(config)
-        return new_agent
-        
-    except Exception as e:
+        runtime = await aget_runtime()
+    except RuntimeUnavailable as e:
         logger.error(f"Error creating agent: {e}")
-        # Return a basic agent as fallback
-        fallback_config = {
-            'openai_api_key': os.getenv('OPENAI_API_KEY')
-        }
-        return LangChainAgent(fallback_config)
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={"Retry-After": str(int(RUNTIME_RETRY_INTERVAL))})
+    return LangChainAgent.from_runtime(runtime, AgentSession())
+
+async def get_conversation_context(conversation_id: str, include_history: bool, history_limit: int,
+                                   history_mode: Optional[str] = None, token_budget: Optional[int] = None) -> str:
+    """Fetch the formatted conversation history for a prompt, or "" if disabled or empty."""
+    if not include_history:
+        logger.info(f"Skipping conversation history for {conversation_id} as includeHistory=False")
+        return ""
+    history_mode = history_mode if history_mode in HISTORY_MODES else HISTORY_MODE
+    if history_mode == "token_budget":
+        try:
+            budget = int(token_budget) if token_budget and int(token_budget) > 0 else HISTORY_TOKEN_BUDGET
+        except (ValueError, TypeError):
+            logger.warning(f"Invalid historyTokenBudget value provided: {token_budget}. Using default {HISTORY_TOKEN_BUDGET}.")
+            budget = HISTORY_TOKEN_BUDGET
+        with track_stage("history_fetch"):
+            conversation_context = await budgeted_history.aformat_for_prompt(conversation_id, budget)
+        limit_description = f"token budget {budget}"
+    else:
+        with track_stage("history_fetch"):
+            conversation_context = await conversation_memory.aformat_for_prompt(conversation_id, history_limit)
+        limit_description = f"limit {history_limit}"
+    if conversation_context:
+        logger.info(f"Retrieved conversation history for {conversation_id} with {limit_description}")
+    else:
+        logger.info(f"No conversation history found for {conversation_id}")
+    return conversation_context
+
+def response_cache_namespace(prompt: Prompt) -> str:
+    """Cache namespace for a prompt; includes its version so edits invalidate old answers."""
+    return prompt.key
+
+async def lookup_cached_response(namespace: Optional[str], user_query: str) -> Tuple[Optional[str], Any]:
+    """Look up a first-turn answer. Returns the cached response (or None) and the query embedding for storing."""
+    if not namespace or not response_cache.enabled:
+        return None, None
+    with track_stage("semantic_cache_lookup"):
+        vector = await response_cache.embed_query(user_query)
+        if vector is None:
+            return None, None
+        return await response_cache.lookup(namespace, user_query, vector), vector
+
+def cached_fallback_answer(prompt: Prompt, user_query: str, request_type: Optional[str] = None,
+                           conversation_context: str = ""):
+    """Last-resort answer source when the LLM cannot answer in time: the semantic cache entry for
+    this prompt and query. Like the cache itself it only applies to prompts without history, since a
+    cached first-turn answer would reply to a different context. None for per-turn feedback."""
+    if request_type == "post_feedback" or conversation_context:
+        return None
+
+    async def lookup() -> Optional[str]:
+        cached_response, _ = await lookup_cached_response(response_cache_namespace(prompt), user_query)
+        return cached_response
+    return lookup
+
+def build_llm_messages(prompt: Prompt, conversation_context: str, user_query: str, label: str = "") -> List:
+    """Assemble the chat messages (static system prompt first, then history, then the user query) and log their token counts."""
+    with track_stage("prompt_assembly"):
+        messages = prompt_registry.build_messages(prompt, conversation_context, user_query)
+        prompt_registry.log_prompt_tokens(prompt, messages, label)
+    return messages
+
+async def token_budget_exceeded(user_id: Optional[str]) -> Optional[str]:
+    """Reason the user may not make another LLM call today, or None while within the daily token budget."""
+    allowed, used, budget = await usage_tracker.check_budget(user_id)
+    if allowed:
+        return None
+    logger.warning(f"User {user_id} exceeded the daily token budget ({used}/{budget} tokens)")
+    return f"Daily token budget exhausted ({used}/{budget} tokens). It resets at 00:00 UTC."
+
+def token_budget_headers() -> Dict[str, str]:
+    return {"Retry-After": str(seconds_until_next_day())}
+
+async def record_streamed_usage(prompt: Prompt, messages: List, completion: str, model_name: str, started: float):
+    """Record the usage of a streamed completion, which the provider does not report for streams."""
+    prompt_text = "\n".join(str(message.content) for message in messages)
+    await usage_tracker.arecord(prompt.name, usage_tracker.estimated_chat_usage(
+        prompt_text, completion, model_name, time.perf_counter() - started))
+
+def llm_priority(prompt: Prompt) -> str:
+    """Admission priority class of a chat call: practice flows rank below plain chat."""
+    return "feedback" if prompt.name in PRACTICE_PROMPTS else "interactive"
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Encode one Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"  # Disable proxy buffering so tokens reach the client immediately
+}
+
+def select_generate_response_prompt(request_type: Optional[str]) -> Prompt:
+    """Pick the system prompt used by /generate-response."""
+    if request_type == "post_feedback":
+        logger.info("Using post-feedback prompt.")
+        return prompt_registry.get("post_feedback")
+    logger.info("Using initial query prompt.")
+    return prompt_registry.get("initial_query")
+
+def select_message_prompt(user_query: str, request_type: str, conversation_id: str) -> Tuple[Prompt, bool]:
+    """Pick the system prompt used by /api/v1/conversation/message.
+
+    Returns the prompt and whether it is the default prompt, which is the only one that triggers artifact generation.
+    """
+    # --- Determine Prompt based on User Query ---
+    selected_system_prompt = prompt_registry.get("default_system")
+    lower_user_query = user_query.lower()
+    
+    # Check for specific flows first
+    if request_type == "post_feedback":
+        selected_system_prompt = prompt_registry.get("post_feedback")
+        logger.info(f"Using post-feedback prompt for conv {conversation_id} based on request_type")
+    elif (lower_user_query.startswith("please help me draft an email") or 
+          lower_user_query.startswith("generate a concise, professional email") or
+          "user preferences:" in lower_user_query): 
+        selected_system_prompt = prompt_registry.get("email_draft")
+        logger.info(f"Using email draft prompt for conv {conversation_id}")
+    elif lower_user_query.startswith("okay, i've copied the draft."):
+        selected_system_prompt = prompt_registry.get("rehearsal")
+        logger.info(f"Using rehearsal prompt for conv {conversation_id}")
+    elif lower_user_query.startswith("okay, please simulate a"): 
+        selected_system_prompt = prompt_registry.get("simulate_reply")
+        logger.info(f"Using simulate reply prompt for conv {conversation_id}")
+    # ADD CHECK: Detect post-practice feedback summary
+    elif (
+        "practice scenario" in lower_user_query and 
+        ("completed" in lower_user_query or "finished" in lower_user_query) and
+        ("score was" in lower_user_query or "decision-making score" in lower_user_query)
+    ):
+         selected_system_prompt = prompt_registry.get("post_feedback") # Use the correct prompt
+         logger.info(f"Using post-feedback prompt for conv {conversation_id} based on keywords")
+    else:
+         # Fallback to default
+         logger.info(f"Using default system prompt for conv {conversation_id}")
+
+    return selected_system_prompt, selected_system_prompt.name == "default_system"
 
 @app.get("/",
     response_model=Dict[str, str],
@@ -440,7 +595,7 @@ async def start_conversation(
         conversation_id = str(uuid.uuid4())
         
         # Clear any existing conversation memory for this ID
-        conversation_memory.clear_history(conversation_id)
+        await conversation_memory.aclear_history(conversation_id)
         logger.info(f"Initialized conversation memory for ID: {conversation_id}")
         
         # Get the time now
@@ -462,12 +617,18 @@ async def start_conversation(
     summary="Process ethical query",
     description="Processes an ethical query and returns guidance"
 )
+@cancel_on_disconnect
 async def generate_response(
+    request: Request,
     query: Query,
-    background_tasks: BackgroundTasks,
-    agent: LangChainAgent = Depends(get_agent)
+    agent: LangChainAgent = Depends(get_agent),
+    x_user_id: Optional[str] = Header(default=None)
 ) -> ConversationContentResponseDTO:
     """Generate a response to an ethical query - with memory between calls."""
+    user_id = start_usage_attribution(query.conversationId, query.userId, x_user_id)
+    budget_error = await token_budget_exceeded(user_id)
+    if budget_error:
+        raise HTTPException(status_code=429, detail=budget_error, headers=token_budget_headers())
     try:
         logger.info(f"Generating response for conversation ID: {query.conversationId} (Type: {query.request_type})")
         logger.info(f"User query: {query.userQuery[:50]}...")
@@ -501,127 +662,55 @@ async def generate_response(
                 logger.warning(f"Invalid historyLimit value provided: {query.historyLimit}. Using default {history_limit}.")
                 pass
         
-        # Create the LLM instance
-        llm = ChatOpenAI(
-            model_name="gpt-4o-mini",
-            temperature=temperature,
-            openai_api_key=os.getenv('OPENAI_API_KEY')
-        )
-        
-        # Define system prompts
-        initial_query_prompt = """You are EVA, an empathetic and helpful Ethical AI assistant.
-        Your goal is to help users navigate complex ethical dilemmas in technology projects.
-        Provide thoughtful, nuanced guidance based on established ethical frameworks and principles.
-        Focus on helping the user understand implications, consider different perspectives, and make informed decisions.
-
-        Keep your responses clear, concise, and easy to read. Use markdown for formatting where appropriate.
-        Adopt a supportive and conversational tone.
-
-        For initial guidance on an ethical dilemma (and NOT for feedback summaries, email drafts, or rehearsal setups), if offering a practice session is appropriate, ALWAYS conclude by asking the *exact question*: "Would you like to practice how to approach this situation?" and then, clearly separated (e.g., on a new line), include the text '[Yes, practice]'. This should be the very end of your initial guidance response when a practice session is offered.
-
-        After providing your guidance, always ask the *exact question* "Would you like to practice how to approach this situation?" and then, clearly separated (e.g., on a new line if possible), include the text '[Yes, practice]'.
-"""
-
-        post_feedback_prompt = """You are EVA, an empathetic and helpful Ethical AI assistant.
-The user has just completed a practice scenario and is asking for feedback on their performance or score.
-Analyze their query and provide constructive, specific feedback on their ethical reasoning and decision-making demonstrated in the scenario they describe.
-Acknowledge their score if mentioned.
-
-Your feedback MUST be structured *exactly* as follows, using these *exact literal headings* on their own lines, with no additional sections:
-
-1.  `**Introductory Paragraph:**` [1-2 sentences acknowledging the user's practice session.]
-
-2.  `**Summary of Feedback:**` [Concise overall summary of performance and score, if mentioned.]
-
-3.  `**Detailed Feedback:**`
-
-    Under this heading, provide EXACTLY these four sections in order. Each section MUST start with its heading on its own separate line with NO leading bullets or markdown characters:
-
-    `Strengths`
-    [Provide bullet points analyzing decisions that were strengths. Example: - Decision X: [Explanation]]
-
-    `Areas for Improvement`
-    [Provide bullet points analyzing decisions that could be improved. Example: - Decision Y: [Explanation]]
-
-    `Reasoning Process`
-    [Overall analysis of the user's ethical reasoning pattern and thought processes. This section should ONLY focus on analyzing HOW they made decisions, not what to do in the future.]
-
-    `Practical Advice for the Future`
-    [General advice and specific recommendations for future similar situations. This section should ONLY focus on actionable guidance for future scenarios.]
-
-4.  `**Concluding Action Prompt:**`
-    End with the *exact text*: "Do you feel ready to discuss this with your manager, or would you like to practice again? [Yes, help draft email] [No, practice again]"
-
-**CRITICAL:** The headings `**Introductory Paragraph:**`, `**Summary of Feedback:**`, `**Detailed Feedback:**`, `Strengths`, `Areas for Improvement`, `Reasoning Process`, `Practical Advice for the Future`, and `**Concluding Action Prompt:**` MUST appear exactly as written, each on its own line where specified. Do not add extra formatting or deviate.
-**CRITICAL FORMATTING RULES:**
-- Each of the four sections under "Detailed Feedback" (Strengths, Areas for Improvement, Reasoning Process, Practical Advice for the Future) MUST be on their own separate lines
-- "Reasoning Process" content must be COMPLETELY SEPARATE from "Practical Advice for the Future" content
-- "Reasoning Process" = analysis of their past decision-making patterns
-- "Practical Advice for the Future" = recommendations for future scenarios
-- Do not mix these two sections or put future advice in the reasoning section
-"""
-        
-        if query.request_type == "post_feedback":
-            system_message = post_feedback_prompt
-            logger.info("Using post-feedback prompt.")
-        else: 
-            system_message = initial_query_prompt
-            logger.info("Using initial query prompt.")
+        system_message = select_generate_response_prompt(query.request_type)
         
         # Retrieve conversation history if enabled
-        conversation_context = ""
-        if include_history:
-            conversation_context = conversation_memory.format_for_prompt(query.conversationId, history_limit)
-            if conversation_context:
-                logger.info(f"Retrieved conversation history for {query.conversationId} with limit {history_limit}")
-                # Don't append to system message - create a separate message for history
-            else:
-                logger.info(f"No conversation history found for {query.conversationId}")
-        else:
-            logger.info(f"Skipping conversation history for {query.conversationId} as includeHistory=False")
+        conversation_context = await get_conversation_context(query.conversationId, include_history, history_limit,
+                                                              query.historyMode, query.historyTokenBudget)
+        
+        # First-turn queries without history are answered from the semantic cache when possible
+        cache_namespace = None
+        if not conversation_context and query.request_type != "post_feedback":
+            cache_namespace = response_cache_namespace(system_message)
         
         response_content = ""
         try:
-            # Create messages array with system prompt first
-            messages = [SystemMessage(content=system_message)]
-            
-            # Add conversation history as a SEPARATE message between system and user
-            if conversation_context:
-                # Use a separate system message specifically for history
-                history_message = SystemMessage(content=f"""
-===== IMPORTANT CONVERSATION HISTORY =====
-The following is your conversation history with this user.
-You MUST reference relevant details from this history in your response.
-You MUST acknowledge information they've previously shared.
-
-{conversation_context}
-
-===== END OF CONVERSATION HISTORY =====
-""")
-                messages.append(history_message)
-                logger.info(f"Added conversation history as separate message for {query.conversationId}")
-            
-            # Add the user query as the final message
-            messages.append(HumanMessage(content=query.userQuery))
-            
-            # Get the response
-            llm = ChatOpenAI(
-                temperature=temperature,
-                model_name="gpt-4o-mini",
-                openai_api_key=os.getenv('OPENAI_API_KEY')
-            )
-            
-            # Call the LLM with ainvoke since this is an async route
-            ai_response = await llm.ainvoke(messages)
-            ai_response_content = ai_response.content
-            logger.info(f"Generated AI response for conv {query.conversationId} using relevant prompt.")
+            cached_response, query_vector = await lookup_cached_response(cache_namespace, query.userQuery)
+            if cached_response is not None:
+                ai_response_content = cached_response
+                logger.info(f"Served AI response for conv {query.conversationId} from semantic cache.")
+            else:
+                messages = build_llm_messages(system_message, conversation_context, query.userQuery, query.conversationId)
+                
+                # Get the response
+                route = model_router.route(system_message.name)
+                llm = ChatOpenAI(
+                    **route.llm_kwargs(temperature),
+                    openai_api_key=os.getenv('OPENAI_API_KEY')
+                )
+                
+                # Call the LLM with ainvoke since this is an async route
+                async with llm_governor.slot(llm_priority(system_message), user_id):
+                    with track_llm_call(), model_router.timed(system_message.name, route.model):
+                        async with usage_tracker.atrack(system_message.name):
+                            fallback = cached_fallback_answer(system_message, query.userQuery, query.request_type, conversation_context)
+                            ai_response = await llm_resilience.ainvoke(
+                                llm, messages, cached_answer=fallback,
+                                deadline=route.timeout)
+                ai_response_content = ai_response.content
+                logger.info(f"Generated AI response for conv {query.conversationId} using relevant prompt.")
+                if query_vector is not None and ai_response_content:
+                    await response_cache.store(cache_namespace, query.userQuery, ai_response_content, query_vector)
             
-            conversation_memory.save_exchange(
-                query.conversationId,
-                query.userQuery,
-                ai_response_content
-            )
+            with track_stage("memory_save"):
+                await conversation_memory.asave_exchange(
+                    query.conversationId,
+                    query.userQuery,
+                    ai_response_content
+                )
             
+        except AdmissionRejected:
+            raise
         except Exception as e:
             logger.error(f"Error generating AI response for conv {query.conversationId}: {str(e)}")
             logger.error(traceback.format_exc())
@@ -641,17 +730,15 @@ You MUST acknowledge information they've previously shared.
         )
         
         if ai_response_content and "I apologize" not in ai_response_content:
-            logger.info(f"Adding background task generate_artifacts_only for conv {query.conversationId}")
-            background_tasks.add_task(
-                generate_artifacts_only, 
-                query.conversationId,
-                query.userQuery
-            )
+            logger.info(f"Queueing artifact generation for conv {query.conversationId}")
+            await enqueue_artifact_generation(query.conversationId, query.userQuery)
         else:
              logger.warning(f"Skipping artifact generation task due to LLM error or empty response for conv {query.conversationId}")
         
         return response_dto
             
+    except AdmissionRejected:
+        raise
     except Exception as e:
         logger.error(f"Error generating response: {str(e)}")
         logger.error(traceback.format_exc())
@@ -669,33 +756,171 @@ You MUST acknowledge information they've previously shared.
             practiceScore=None
         )
 
-# Renamed and simplified background task - ONLY generates artifacts
-async def generate_artifacts_only(conversation_id: str, user_query: str):
-    """Background task to generate and save RAG artifacts ONLY."""
-    logger.info(f"[Background Task START] generate_artifacts_only for conv {conversation_id}")
+@app.post("/generate-response/stream",
+    tags=["Conversation"],
+    summary="Process ethical query (streaming)",
+    description="Processes an ethical query and streams the guidance as Server-Sent Events"
+)
+async def generate_response_stream(
+    query: Query,
+    agent: LangChainAgent = Depends(get_agent),
+    x_user_id: Optional[str] = Header(default=None)
+):
+    """Streaming variant of /generate-response.
+
+    Emits a `start` event with the message id, one `token` event per generated chunk
+    and a final `done` event with the full content. Memory is saved and artifact
+    generation scheduled once the stream completes.
+    """
+    logger.info(f"Streaming response for conversation ID: {query.conversationId} (Type: {query.request_type})")
+    temperature = query.temperature if query.temperature is not None and 0 <= query.temperature <= 1 else 0.7
+    include_history = query.includeHistory if query.includeHistory is not None else True
+    history_limit = query.historyLimit if query.historyLimit and query.historyLimit > 0 else 20
+    message_id = str(uuid.uuid4())
+
+    # Checked before the stream starts so the client gets a real 429 rather than an error event
+    user_id = start_usage_attribution(query.conversationId, query.userId, x_user_id)
+    budget_error = await token_budget_exceeded(user_id)
+    if budget_error:
+        raise HTTPException(status_code=429, detail=budget_error, headers=token_budget_headers())
+
+    system_message = select_generate_response_prompt(query.request_type)
+    llm_governor.check(llm_priority(system_message), user_id)
+    conversation_context = await get_conversation_context(query.conversationId, include_history, history_limit,
+                                                          query.historyMode, query.historyTokenBudget)
+    messages = build_llm_messages(system_message, conversation_context, query.userQuery, query.conversationId)
+    route = model_router.route(system_message.name)
+    llm = ChatOpenAI(
+        **route.llm_kwargs(temperature),
+        openai_api_key=os.getenv('OPENAI_API_KEY'),
+        streaming=True
+    )
+
+    async def event_stream():
+        yield format_sse("start", {"id": message_id, "conversationId": query.conversationId})
+        chunks = []
+        started = time.perf_counter()
+        try:
+            async with llm_governor.slot(llm_priority(system_message)):
+                with track_llm_call():
+                    fallback = cached_fallback_answer(system_message, query.userQuery, query.request_type,
+                                                      conversation_context)
+                    # Closed explicitly so an abandoned stream also closes the upstream LLM request
+                    async with aclosing(llm_resilience.astream(llm, messages, cached_answer=fallback,
+                                                               deadline=route.timeout)) as tokens:
+                        async for chunk in tokens:
+                            if chunk.content:
+                                chunks.append(chunk.content)
+                                yield format_sse("token", {"id": message_id, "content": chunk.content})
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client disconnected mid-stream: skip the history save and artifact job for this turn
+            logger.info(f"Stream for conv {query.conversationId} cancelled by client after {len(chunks)} chunks")
+            record_cancellation("stream")
+            raise
+        except Exception as e:
+            logger.error(f"Error streaming AI response for conv {query.conversationId}: {str(e)}")
+            logger.error(traceback.format_exc())
+            yield format_sse("error", {"id": message_id, "content": f"Error: Failed to generate AI response due to: {str(e)}"})
+            return
+
+        ai_response_content = "".join(chunks)
+        model_router.observe(system_message.name, route.model, time.perf_counter() - started)
+        await record_streamed_usage(system_message, messages, ai_response_content, route.model, started)
+        if not ai_response_content:
+            # Nothing to save or build artifacts from; the turn is reported as failed
+            logger.error(f"Stream for conv {query.conversationId} ended without content")
+            yield format_sse("error", {"id": message_id, "content": "Error: The model returned an empty response."})
+            return
+        with track_stage("memory_save"):
+            await conversation_memory.asave_exchange(query.conversationId, query.userQuery, ai_response_content)
+        if "I apologize" not in ai_response_content:
+            await enqueue_artifact_generation(query.conversationId, query.userQuery)
+
+        yield format_sse("done", ConversationContentResponseDTO(
+            id=message_id,
+            conversationId=query.conversationId,
+            userQuery=query.userQuery,
+            agentResponse=ai_response_content,
+            createdAt=datetime.utcnow().isoformat(),
+            inPracticeMode=False,
+            practiceScore=None
+        ).dict())
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+async def enqueue_artifact_generation(conversation_id: str, user_query: str, turn: Optional[str] = None) -> bool:
+    """Queue artifact generation for a conversation turn. Repeats of the same turn are deduplicated.
+
+    `turn` identifies the turn; by default it is the timestamp of the last saved exchange, so
+    callers enqueue after saving. Asking the same question again later is a new turn.
+    """
+    if turn is None:
+        turn = await conversation_turn(conversation_id)
+    dedup_key = f"{conversation_id}:{turn}:{hashlib.sha256(user_query.encode()).hexdigest()[:16]}"
+    return await artifact_jobs.submit(
+        "artifacts",
+        {"conversation_id": conversation_id, "user_query": user_query, "user_id": get_usage_context()[1]},
+        dedup_key
+    )
+
+def start_artifact_prefetch(agent: LangChainAgent, user_query: str) -> Optional[asyncio.Task]:
+    """Start retrieving artifact chunks for a turn so it overlaps with answer generation.
+
+    Retrieval depends only on the query. Besides providing artifact ids for the response,
+    it warms the embedding cache, so the queued artifact job does not embed the query again.
+    """
+    if not ARTIFACT_PREFETCH or getattr(agent, 'vectorstore', None) is None:
+        return None
+
+    def log_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Artifact prefetch failed: {str(task.exception())}")
+
+    task = asyncio.create_task(agent.aretrieve_artifact_docs_by_type(user_query))
+    artifact_prefetch_tasks.add(task)
+    task.add_done_callback(artifact_prefetch_tasks.discard)
+    task.add_done_callback(log_failure)
+    return task
+
+async def await_artifact_prefetch(task: Optional[asyncio.Task], timeout: float = ARTIFACT_PREFETCH_WAIT) -> Optional[Dict[str, List]]:
+    """Chunks found by an artifact prefetch, or None if retrieval failed or is not done within `timeout`."""
+    if task is None:
+        return None
+    try:
+        # Shielded so a timeout here leaves the prefetch running to warm the caches
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+    except asyncio.TimeoutError:
+        logger.info(f"Artifact prefetch not finished within {timeout}s; omitting artifacts")
+        return None
+    except Exception:
+        return None
+
+async def prefetched_artifact_ids(task: Optional[asyncio.Task], timeout: float = ARTIFACT_PREFETCH_WAIT) -> Optional[Dict[str, List[str]]]:
+    """Ids of the prefetched guideline and case study chunks, or None if retrieval is not done within `timeout`."""
+    docs_by_type = await await_artifact_prefetch(task, timeout)
+    if docs_by_type is None:
+        return None
+    return {
+        "guidelines": [LangChainAgent.artifact_id(doc) for doc, _ in docs_by_type.get("guideline", [])],
+        "caseStudies": [LangChainAgent.artifact_id(doc) for doc, _ in docs_by_type.get("case_study", [])]
+    }
+
+# Job handler for the artifact queue - ONLY generates artifacts
+async def generate_artifacts_only(conversation_id: str, user_query: str, user_id: Optional[str] = None):
+    """Generate and save RAG artifacts ONLY. Raises if they could not be saved, so the job is retried."""
+    logger.info(f"[Artifact Job START] generate_artifacts_only for conv {conversation_id}")
+    set_usage_context(conversation_id, user_id)
     try:
         # Get the authorization token (still needed for saving artifacts)
         auth_header = os.getenv("CURRENT_AUTH_TOKEN")
         if not auth_header:
-             logger.warning("[Background Task] No auth token found in env for artifact saving.")
-             # Decide if we should proceed without auth? For now, we might return.
-             # return 
-            
-        # Generate and save RAG artifacts
-        try:
-            logger.info(f"[Background Task] Calling generate_and_save_artifacts for conv {conversation_id}")
-            agent = get_agent() # Get a fresh agent instance
-            await generate_and_save_artifacts(agent, user_query, conversation_id, auth_header)
-            logger.info(f"[Background Task] Finished generate_and_save_artifacts call for conv {conversation_id}")
-        except Exception as e:
-            logger.error(f"[Background Task ERROR] Could not generate or save RAG artifacts for conv {conversation_id}: {str(e)}")
-            logger.error(traceback.format_exc())
+             logger.warning("[Artifact Job] No auth token found in env for artifact saving.")
             
-    except Exception as e:
-        logger.error(f"[Background Task FATAL] Error in generate_artifacts_only for conv {conversation_id}: {str(e)}")
-        logger.error(traceback.format_exc())
+        agent = await get_agent() # Shared runtime, fresh session
+        if not await generate_and_save_artifacts(agent, user_query, conversation_id, auth_header):
+            raise RuntimeError(f"Artifacts for conv {conversation_id} were not saved")
     finally:
-         logger.info(f"[Background Task END] generate_artifacts_only for conv {conversation_id}")
+         logger.info(f"[Artifact Job END] generate_artifacts_only for conv {conversation_id}")
 
 @app.post("/practice-mode",
     response_model=ConversationContentResponseDTO,
@@ -821,11 +1046,110 @@ async def submit_practice_feedback(
             success=True
         )
 
+def fallback_guidelines() -> List[Dict[str, Any]]:
+    return [{
+        "id": str(uuid.uuid4()),
+        "title": "Data Minimization",
+        "description": "Only collect the minimum amount of data necessary for your application to function properly.",
+        "source": "General Ethical Principles",
+        "relevance": 0.95,
+        "category": "Privacy"
+    }]
+
+def fallback_case_studies() -> List[Dict[str, Any]]:
+    return [{
+        "id": str(uuid.uuid4()),
+        "title": "Cambridge Analytica Data Scandal",
+        "summary": "Cambridge Analytica collected personal data from millions of Facebook users without consent for political targeting.",
+        "outcome": "Resulted in major regulatory changes and heightened awareness about data privacy.",
+        "source": "Data Privacy Case Studies",
+        "relevance": 0.9
+    }]
+
+def guideline_item_from_doc(doc, score: float) -> Dict[str, Any]:
+    """Format a retrieved guideline chunk for the relevance endpoints."""
+    return {
+        "id": str(uuid.uuid4()),
+        "title": doc.metadata.get('title', 'Ethical Guideline'),
+        "description": doc.page_content,
+        "source": doc.metadata.get('source', doc.metadata.get('filename', 'Unknown Source')),
+        "relevance": float(1.0 - min(score / 2.0, 0.9)),  # Convert distance to relevance score
+        "category": doc.metadata.get('category', 'Ethics')
+    }
+
+def case_study_item_from_doc(doc, score: float) -> Dict[str, Any]:
+    """Format a retrieved case study chunk for the relevance endpoints."""
+    # Extract outcome from metadata or content if available
+    content = doc.page_content
+    outcome = doc.metadata.get('outcome', 'No specific outcome recorded')
+    if "Outcome:" in content:
+        content_parts = content.split("Outcome:")
+        summary = content_parts[0].strip()
+        outcome = content_parts[1].strip()
+    else:
+        summary = content
+    return {
+        "id": str(uuid.uuid4()),
+        "title": doc.metadata.get('title', 'Case Study'),
+        "summary": summary,
+        "outcome": outcome,
+        "source": doc.metadata.get('source', doc.metadata.get('filename', 'Unknown Source')),
+        "relevance": float(1.0 - min(score / 2.0, 0.9))  # Convert distance to relevance score
+    }
+
+async def find_relevant_artifacts(context: ConversationContext, agent: LangChainAgent) -> Dict[str, List[Dict[str, Any]]]:
+    """Guidelines and case studies relevant to a conversation, from one embedding and one index scan.
+
+    Falls back to a generic guideline/case study when there is no vector store,
+    the search fails, or a type has no matching chunks.
+    """
+    # Extract conversation text for context
+    conversation_text = ""
+    for message in context.messages:
+        role = message.get("role", "")
+        content = message.get("content", "")
+        if content:
+            conversation_text += f"{role}: {content}\n"
+
+    # Use the agent's vector store capabilities but without storing state
+    guidelines, case_studies = [], []
+    if not hasattr(agent, 'vectorstore') or agent.vectorstore is None:
+        logger.warning("No vector store available for artifact search")
+    else:
+        try:
+            docs_by_type = await agent.aretrieve_artifact_docs_by_type(conversation_text)
+            guidelines = [guideline_item_from_doc(doc, score) for doc, score in docs_by_type["guideline"]]
+            case_studies = [case_study_item_from_doc(doc, score) for doc, score in docs_by_type["case_study"]]
+        except Exception as search_error:
+            logger.error(f"Error searching vector store: {str(search_error)}")
+
+    return {
+        "guidelines": guidelines or fallback_guidelines(),
+        "caseStudies": case_studies or fallback_case_studies()
+    }
+
+@app.post("/artifacts/relevant",
+    response_model=RelevantArtifactsResponse,
+    tags=["Knowledge Base"],
+    summary="Get relevant guidelines and case studies",
+    description="Retrieves ethical guidelines and case studies relevant to the current conversation in a single search"
+)
+async def get_relevant_artifacts(
+    context: ConversationContext,
+    agent: LangChainAgent = Depends(get_agent)
+) -> RelevantArtifactsResponse:
+    """Get relevant guidelines and case studies using the vectorstore without storing conversation state."""
+    try:
+        return RelevantArtifactsResponse(**await find_relevant_artifacts(context, agent))
+    except Exception as e:
+        logger.error(f"Error retrieving artifacts: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/guidelines/relevant",
     response_model=GuidelinesResponse,
     tags=["Knowledge Base"],
     summary="Get relevant ethical guidelines",
-    description="Retrieves ethical guidelines relevant to the current conversation"
+    description="Retrieves ethical guidelines relevant to the current conversation (the guidelines of /artifacts/relevant)"
 )
 async def get_relevant_guidelines(
     context: ConversationContext,
@@ -833,77 +1157,8 @@ async def get_relevant_guidelines(
 ) -> GuidelinesResponse:
     """Get relevant ethical guidelines using the vectorstore without storing conversation state."""
     try:
-        # Extract conversation text for context
-        conversation_text = ""
-        for message in context.messages:
-            role = message.get("role", "")
-            content = message.get("content", "")
-            if content:
-                conversation_text += f"{role}: {content}\n"
-        
-        # Use the agent's vector store capabilities but without storing state
-        # This retrieves guidelines from FAISS but doesn't change the agent's conversation state
-        try:
-            # Check if a vectorstore is available
-            if not hasattr(agent, 'vectorstore') or agent.vectorstore is None:
-                logger.warning("No vector store available for guidelines search")
-                # Return fallback guidelines if no vectorstore
-                return GuidelinesResponse(guidelines=[
-                    {
-                        "id": str(uuid.uuid4()),
-                        "title": "Data Minimization",
-                        "description": "Only collect the minimum amount of data necessary for your application to function properly.",
-                        "source": "General Ethical Principles",
-                        "relevance": 0.95,
-                        "category": "Privacy"
-                    }
-                ])
-                
-            # Use the vectorstore but in a stateless way
-            # Search for similar documents with the conversation text
-            search_results = agent.vectorstore.similarity_search_with_score(conversation_text, k=5)
-            
-            # Format the search results as guidelines
-            guidelines = []
-            for doc, score in search_results:
-                # Only include documents of type 'guideline'
-                if doc.metadata.get('type') == 'guideline' or 'guideline' in doc.metadata.get('source', '').lower():
-                    guideline = {
-                        "id": str(uuid.uuid4()),
-                        "title": doc.metadata.get('title', 'Ethical Guideline'),
-                        "description": doc.page_content,
-                        "source": doc.metadata.get('source', 'Unknown Source'),
-                        "relevance": float(1.0 - min(score / 2.0, 0.9)),  # Convert distance to relevance score
-                        "category": doc.metadata.get('category', 'Ethics')
-                    }
-                    guidelines.append(guideline)
-            
-            # If no guidelines found, provide a fallback
-            if not guidelines:
-                guidelines = [{
-                    "id": str(uuid.uuid4()),
-                    "title": "Data Minimization",
-                    "description": "Only collect the minimum amount of data necessary for your application to function properly.",
-                    "source": "General Ethical Principles",
-                    "relevance": 0.95,
-                    "category": "Privacy"
-                }]
-                
-            return GuidelinesResponse(guidelines=guidelines)
-            
-        except Exception as search_error:
-            logger.error(f"Error searching vector store: {str(search_error)}")
-            # Return fallback guidelines
-            return GuidelinesResponse(guidelines=[
-                {
-                    "id": str(uuid.uuid4()),
-                    "title": "Data Minimization",
-                    "description": "Only collect the minimum amount of data necessary for your application to function properly.",
-                    "source": "General Ethical Principles",
-                    "relevance": 0.95,
-                    "category": "Privacy"
-                }
-            ])
+        artifacts = await find_relevant_artifacts(context, agent)
+        return GuidelinesResponse(guidelines=artifacts["guidelines"])
     except Exception as e:
         logger.error(f"Error retrieving guidelines: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -912,7 +1167,7 @@ async def get_relevant_guidelines(
     response_model=CaseStudiesResponse,
     tags=["Knowledge Base"],
     summary="Get relevant case studies",
-    description="Retrieves case studies relevant to the current conversation"
+    description="Retrieves case studies relevant to the current conversation (the case studies of /artifacts/relevant)"
 )
 async def get_relevant_case_studies(
     context: ConversationContext,
@@ -920,89 +1175,178 @@ async def get_relevant_case_studies(
 ) -> CaseStudiesResponse:
     """Get relevant case studies using the vectorstore without storing conversation state."""
     try:
-        # Extract conversation text for context
-        conversation_text = ""
-        for message in context.messages:
-            role = message.get("role", "")
-            content = message.get("content", "")
-            if content:
-                conversation_text += f"{role}: {content}\n"
-        
-        # Use the agent's vector store capabilities but without storing state
-        try:
-            # Check if a vectorstore is available
-            if not hasattr(agent, 'vectorstore') or agent.vectorstore is None:
-                logger.warning("No vector store available for case studies search")
-                # Return fallback case studies if no vectorstore
-                return CaseStudiesResponse(caseStudies=[
-                    {
-                        "id": str(uuid.uuid4()),
-                        "title": "Cambridge Analytica Data Scandal",
-                        "summary": "Cambridge Analytica collected personal data from millions of Facebook users without consent for political targeting.",
-                        "outcome": "Resulted in major regulatory changes and heightened awareness about data privacy.",
-                        "source": "Data Privacy Case Studies",
-                        "relevance": 0.9
-                    }
-                ])
-                
-            # Use the vectorstore but in a stateless way
-            search_results = agent.vectorstore.similarity_search_with_score(conversation_text, k=5)
-            
-            # Format the search results as case studies
-            case_studies = []
-            for doc, score in search_results:
-                # Only include documents of type 'case_study'
-                if doc.metadata.get('type') == 'case_study' or 'case' in doc.metadata.get('source', '').lower():
-                    # Extract outcome from metadata or content if available
-                    content = doc.page_content
-                    outcome = doc.metadata.get('outcome', 'No specific outcome recorded')
-                    if "Outcome:" in content:
-                        content_parts = content.split("Outcome:")
-                        summary = content_parts[0].strip()
-                        outcome = content_parts[1].strip()
-                    else:
-                        summary = content
-                    
-                    case_study = {
-                        "id": str(uuid.uuid4()),
-                        "title": doc.metadata.get('title', 'Case Study'),
-                        "summary": summary,
-                        "outcome": outcome,
-                        "source": doc.metadata.get('source', 'Unknown Source'),
-                        "relevance": float(1.0 - min(score / 2.0, 0.9))  # Convert distance to relevance score
-                    }
-                    case_studies.append(case_study)
-            
-            # If no case studies found, provide a fallback
-            if not case_studies:
-                case_studies = [{
-                    "id": str(uuid.uuid4()),
-                    "title": "Cambridge Analytica Data Scandal",
-                    "summary": "Cambridge Analytica collected personal data from millions of Facebook users without consent for political targeting.",
-                    "outcome": "Resulted in major regulatory changes and heightened awareness about data privacy.",
-                    "source": "Data Privacy Case Studies",
-                    "relevance": 0.9
-                }]
-                
-            return CaseStudiesResponse(caseStudies=case_studies)
-            
-        except Exception as search_error:
-            logger.error(f"Error searching vector store: {str(search_error)}")
-            # Return fallback case studies
-            return CaseStudiesResponse(caseStudies=[
-                {
-                    "id": str(uuid.uuid4()),
-                    "title": "Cambridge Analytica Data Scandal",
-                    "summary": "Cambridge Analytica collected personal data from millions of Facebook users without consent for political targeting.",
-                    "outcome": "Resulted in major regulatory changes and heightened awareness about data privacy.",
-                    "source": "Data Privacy Case Studies",
-                    "relevance": 0.9
-                }
-            ])
+        artifacts = await find_relevant_artifacts(context, agent)
+        return CaseStudiesResponse(caseStudies=artifacts["caseStudies"])
     except Exception as e:
         logger.error(f"Error retrieving case studies: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/v1/cache/semantic/stats",
+    response_model=Dict[str, Any],
+    tags=["Monitoring"],
+    summary="Semantic cache statistics",
+    description="Hit rate, lookup latency, similarity threshold and entry counts of the semantic response cache"
+)
+async def semantic_cache_stats():
+    """Return semantic response cache metrics."""
+    return response_cache.stats()
+
+@app.get("/api/v1/cache/artifacts/stats",
+    response_model=Dict[str, Any],
+    tags=["Monitoring"],
+    summary="Artifact cache statistics",
+    description="Hit/miss counters of the synthesized artifact cache"
+)
+async def artifact_cache_stats():
+    """Return synthesized artifact cache metrics."""
+    return artifact_cache.stats()
+
+@app.get("/api/v1/cache/embeddings/stats",
+    response_model=Dict[str, Any],
+    tags=["Monitoring"],
+    summary="Embedding cache statistics",
+    description="In-process and Redis hit counters of the query/document embedding cache"
+)
+async def embedding_cache_stats():
+    """Return embedding cache metrics."""
+    return embedding_cache.stats()
+
+@app.get("/api/v1/cache/idempotency/stats",
+    response_model=Dict[str, Any],
+    tags=["Monitoring"],
+    summary="Idempotent message statistics",
+    description="How many chat turns were executed, coalesced with an in-flight duplicate or replayed"
+)
+async def idempotency_stats():
+    """Return single-flight coalescing metrics."""
+    return message_coalescer.stats()
+
+@app.get("/api/v1/cache/history/stats",
+    response_model=Dict[str, Any],
+    tags=["Monitoring"],
+    summary="Conversation history L1 cache statistics",
+    description="Hit rate, size and cross-worker invalidations of this worker's in-process history cache"
+)
+async def history_cache_stats():
+    """Return L1 conversation history cache metrics."""
+    return history_cache.stats()
+
+@app.get("/api/v1/llm/admission/stats",
+    response_model=Dict[str, Any],
+    tags=["Monitoring"],
+    summary="LLM admission control statistics",
+    description="Slots in use, queue depth per priority class and rejection counters"
+)
+async def llm_admission_stats():
+    """Return LLM governor metrics."""
+    return llm_governor.stats()
+
+@app.get("/api/v1/llm/resilience/stats",
+    response_model=Dict[str, Any],
+    tags=["Monitoring"],
+    summary="LLM resilience statistics",
+    description="Circuit breaker state, observed latency percentiles and hedge rate per model"
+)
+async def llm_resilience_stats():
+    """Return LLM resilience metrics."""
+    return llm_resilience.stats()
+
+@app.get("/api/v1/llm/routes",
+    response_model=Dict[str, Any],
+    tags=["Monitoring"],
+    summary="Model routing policy",
+    description="Model, max output tokens and timeout per request type, with observed latency per type and model"
+)
+async def llm_routes():
+    """Return the model routing policy and observed latencies."""
+    return model_router.stats()
+
+@app.post("/api/v1/llm/routes/reload",
+    response_model=Dict[str, Any],
+    tags=["Monitoring"],
+    summary="Reload the model routing policy",
+    description="Re-reads the routes file; an invalid file is rejected and the current routes stay in place",
+    dependencies=[Depends(require_admin)],
+)
+async def reload_llm_routes():
+    """Reload the model routing policy from its file."""
+    if not model_router.reload():
+        raise HTTPException(status_code=400, detail=f"Invalid model routes file {model_router.path}; kept the current routes")
+    return model_router.stats()
+
+@app.get("/api/v1/usage/types",
+    dependencies=[Depends(require_admin)],
+    response_model=Dict[str, Any],
+    tags=["Monitoring"],
+    summary="Usage per request type",
+    description="Calls, tokens, cost and latency per prompt path for a UTC day (default today)"
+)
+async def usage_by_request_type(date: Optional[str] = None):
+    """Return the usage rollups of every request type seen on a day."""
+    day = date or usage_day()
+    return {"date": day, "requestTypes": await usage_tracker.request_type_rollups(day)}
+
+@app.get("/api/v1/usage/users",
+    dependencies=[Depends(require_admin)],
+    response_model=Dict[str, Any],
+    tags=["Monitoring"],
+    summary="Usage per user",
+    description="Calls, tokens, cost and latency per user for a UTC day (default today)"
+)
+async def usage_by_user(date: Optional[str] = None):
+    """Return the usage rollups of every user seen on a day."""
+    day = date or usage_day()
+    return {"date": day, "users": await usage_tracker.user_rollups(day)}
+
+@app.get("/api/v1/usage/users/{user_id}",
+    dependencies=[Depends(require_admin)],
+    response_model=Dict[str, Any],
+    tags=["Monitoring"],
+    summary="Usage of one user",
+    description="A user's usage for a UTC day (default today) with their daily token budget"
+)
+async def usage_for_user(user_id: str, date: Optional[str] = None):
+    """Return a user's usage rollup and remaining budget."""
+    return await usage_tracker.user_rollup(user_id, date)
+
+@app.put("/api/v1/usage/users/{user_id}/budget",
+    dependencies=[Depends(require_admin)],
+    response_model=Dict[str, Any],
+    tags=["Monitoring"],
+    summary="Set a user's daily token budget",
+    description="Overrides USAGE_USER_DAILY_TOKEN_BUDGET for one user; null restores the default"
+)
+async def set_user_token_budget(user_id: str, request: TokenBudgetRequest):
+    """Override a user's daily token budget."""
+    if request.dailyTokens is not None and request.dailyTokens < 0:
+        raise HTTPException(status_code=400, detail="dailyTokens must be >= 0")
+    try:
+        await usage_tracker.set_budget(user_id, request.dailyTokens)
+    except Exception as e:
+        logger.error(f"Error setting token budget for {user_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"userId": user_id, "dailyTokenBudget": await usage_tracker.get_budget(user_id)}
+
+@app.get("/api/v1/usage/conversations/{conversation_id}",
+    dependencies=[Depends(require_admin)],
+    response_model=Dict[str, Any],
+    tags=["Monitoring"],
+    summary="Usage of one conversation",
+    description="Calls, tokens, cost and latency accumulated by a conversation"
+)
+async def usage_for_conversation(conversation_id: str):
+    """Return a conversation's usage rollup."""
+    return {"conversationId": conversation_id, **await usage_tracker.conversation_rollup(conversation_id)}
+
+@app.get("/metrics",
+    tags=["Monitoring"],
+    summary="Prometheus metrics",
+    description="Request counts and latency per route, per-stage timings, Redis/backend error counts, queue depth and in-flight LLM calls"
+)
+async def metrics():
+    """Return all metrics in the Prometheus text exposition format."""
+    return PlainTextResponse(await metrics_registry.render(), media_type=metrics_registry.CONTENT_TYPE)
+
 @app.get("/health",
     response_model=Dict[str, str],
     tags=["Monitoring"],
@@ -1035,7 +1379,7 @@ async def get_conversations(request: Request):
             headers["Authorization"] = auth_header
         
         # Make a request to the backend API
-        response = requests.get(
+        response = await get_backend_client().get(
             f"{BACKEND_BASE_URL}/api/v1/conversation",
             headers=headers
         )
@@ -1060,6 +1404,8 @@ async def get_conversations(request: Request):
 )
 async def get_conversation_messages(conversation_id: str, request: Request):
     """Get messages for a conversation with consistent format for the frontend"""
+    # Opening a conversation usually precedes a message: warm the history cache meanwhile
+    conversation_memory.prefetch(conversation_id)
     try:
         # Extract the authorization header from the incoming request
         auth_header = request.headers.get("Authorization")
@@ -1076,15 +1422,10 @@ async def get_conversation_messages(conversation_id: str, request: Request):
         
         try:
             # Make a request to the backend API
-            response = await asyncio.wait_for(
-                asyncio.to_thread(
-                    lambda: requests.get(
-                        f"{BACKEND_BASE_URL}/api/v1/conversation/message/{conversation_id}",
-                        headers=headers,
-                        timeout=5
-                    )
-                ),
-                timeout=8
+            response = await get_backend_client().get(
+                f"{BACKEND_BASE_URL}/api/v1/conversation/message/{conversation_id}",
+                headers=headers,
+                timeout=5
             )
             
             if response.status_code == 200:
@@ -1161,7 +1502,7 @@ async def get_conversation_messages(conversation_id: str, request: Request):
                 # Return empty array instead of error
                 return []
                 
-        except asyncio.TimeoutError:
+        except (asyncio.TimeoutError, httpx.TimeoutException):
             logger.error(f"Timeout getting messages from backend for conversation {conversation_id}")
             return []
         except Exception as e:
@@ -1243,16 +1584,11 @@ async def create_conversation(
                     headers["Authorization"] = auth_header
                 
                 # Make a request to the backend API with timeout
-                response = await asyncio.wait_for(
-                    asyncio.to_thread(
-                        lambda: requests.post(
-                            f"{BACKEND_BASE_URL}/api/v1/conversation",
-                            json=backend_request,
-                            headers=headers,
-                            timeout=5  # 5 second timeout for the HTTP request
-                        )
-                    ),
-                    timeout=8  # 8 second overall timeout
+                response = await get_backend_client().post(
+                    f"{BACKEND_BASE_URL}/api/v1/conversation",
+                    json=backend_request,
+                    headers=headers,
+                    timeout=5  # 5 second timeout for the HTTP request
                 )
                 
                 # Check if the request was successful
@@ -1263,7 +1599,7 @@ async def create_conversation(
                 else:
                     logger.error(f"Backend API error creating conversation: {response.status_code} - {response.text}")
                     return None
-            except asyncio.TimeoutError:
+            except (asyncio.TimeoutError, httpx.TimeoutException):
                 logger.error("Timeout creating conversation in backend")
                 return None
             except Exception as e:
@@ -1276,6 +1612,7 @@ async def create_conversation(
             
             # If backend conversation was created successfully, use that
             if backend_conversation:
+                conversation_memory.prefetch(backend_conversation.get("conversationId", local_conversation_id))
                 return {
                     "conversationId": backend_conversation.get("conversationId", local_conversation_id),
                     "userId": backend_conversation.get("userId", user_id),
@@ -1288,6 +1625,7 @@ async def create_conversation(
             else:
                 # Fall back to a local conversation if backend fails
                 logger.info(f"Using local conversation with ID: {local_conversation_id} and manager type: {manager_type}")
+                conversation_memory.prefetch(local_conversation_id)
                 return {
                     "conversationId": local_conversation_id,
                     "userId": user_id,
@@ -1346,12 +1684,12 @@ async def send_to_backend(conversation_id: str, message_id: str, content: str, r
         "Accept": "application/json"
     }
     try:
-        async with httpx.AsyncClient() as client:
-            logger.info(f"Sending {role} message to NEW backend save endpoint: {endpoint} for conv {conversation_id}")
-            response = await client.post(endpoint, json=payload, headers=headers, timeout=10.0)
-            response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
-            logger.info(f"Successfully sent {role} message to backend save endpoint for conv {conversation_id}. Status: {response.status_code}")
-            return True
+        logger.info(f"Sending {role} message to NEW backend save endpoint: {endpoint} for conv {conversation_id}")
+        with track_stage("backend_post"):
+            response = await get_backend_client().post(endpoint, json=payload, headers=headers, timeout=10.0)
+        response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
+        logger.info(f"Successfully sent {role} message to backend save endpoint for conv {conversation_id}. Status: {response.status_code}")
+        return True
     except httpx.RequestError as exc:
         logger.error(f"HTTP RequestError sending {role} message to backend save endpoint {endpoint} for conv {conversation_id}: {exc}")
     except httpx.HTTPStatusError as exc:
@@ -1366,9 +1704,9 @@ async def send_to_backend(conversation_id: str, message_id: str, content: str, r
     summary="Send a message and get AI response",
     description="Generates AI response and schedules artifact generation. Does NOT save messages."
 )
+@cancel_on_disconnect
 async def send_message(
     request: Request,
-    background_tasks: BackgroundTasks,
     agent: LangChainAgent = Depends(get_agent)
 ):
     """
@@ -1389,6 +1727,8 @@ async def send_message(
     request_type = body.get("request_type", "initial_query") # Default to initial_query
     include_history = body.get("includeHistory", True)  # Default to True
     history_limit = body.get("historyLimit", 20)  # Default to 20 turns of history
+    include_artifact_ids = body.get("includeArtifactIds", False)  # Attach prefetched artifact ids to the response
+    user_id = start_usage_attribution(conversation_id, body.get("userId"), request.headers.get("X-User-Id"))
 
     logger.info(f"History parameters: includeHistory={include_history}, historyLimit={history_limit}")
 
@@ -1414,318 +1754,503 @@ async def send_message(
         )
 
     logger.info(f"Processing message for conv {conversation_id}. Type: {request_type}. Query: '{user_query[:50]}...'")
-    
-    try:
-        # --- Define System Prompts used by this endpoint ---
-        default_system_prompt = """You are EVA, an ethical AI assistant designed to guide technology professionals through ethical dilemmas in their projects. You operate under the EVA framework, utilizing RAG-based (Retrieval-Augmented Generation) methods to leverage an internal knowledge base, enhancing your responses' accuracy and relevance.
 
-Your Role
-    • Advisor: Engage users in friendly, supportive conversations to help navigate ethical challenges in technology projects.
-    • Trainer: Offer simulated practice scenarios with realistic feedback to help users improve ethical decision-making skills.
-    • Evaluator: Provide detailed, actionable feedback and ethical scoring on user performance in practice scenarios.
-
-Communication Style
-    • Be supportive, friendly, and conversational.
-    • Provide clear, concise guidance integrated seamlessly into conversation.
-    • Avoid technical jargon, formal headings, and overly structured language.
-    • Always address the user in the second person and yourself in the first person.
-    • Responses should be brief but insightful, expanding detail only upon user request.
-
-Interaction Workflow
-    • Understand and clarify the user's ethical dilemma or scenario clearly.
-    • Discuss the ethical implications, including privacy, data protection, transparency, consent, and compliance.
-    • Suggest practical approaches or solutions, balancing ethical considerations and business needs.
-    • Proactively offer simulated practice sessions when appropriate:
-    • "Would you like to practice how to approach this situation? [Yes, practice]"
-
-Tools and Techniques
-    • Artifact Session (RAG-based): Generate responses and feedback utilizing an internal knowledge base.
-    • Scenario Simulation: Facilitate simulated interactions, where users practice addressing ethical challenges.
-    • Performance Evaluation: Provide detailed scoring and actionable feedback to users post-simulation.
+    async def generate_reply() -> Tuple[Any, bool]:
+        """Run the turn once. Returns the response and whether it may be replayed to duplicates."""
+        budget_error = await token_budget_exceeded(user_id)
+        if budget_error:
+            return JSONResponse(
+                status_code=429,
+                headers=token_budget_headers(),
+                content={
+                    "messages": [{
+                        "id": assistant_message_id,
+                        "conversationId": conversation_id,
+                        "role": "assistant",
+                        "content": f"Error: {budget_error}",
+                        "createdAt": current_time,
+                        "isLoading": False
+                    }]
+                }
+            ), False
 
-Response Guidelines
-    • When the user initiates a scenario, start by acknowledging their situation empathetically.
-    • Clearly articulate ethical concerns raised by the scenario, guiding users to reflect deeply.
-    • When users complete practice scenarios:
-    • Provide specific, detailed feedback on their ethical reasoning and decision-making process.
-    • Highlight areas of strength clearly.
-    • Suggest improvements and alternative actions tactfully.
-    • Enable smooth transition back to regular conversation after scenario practices.
-    • After providing feedback, ask: "Do you feel ready to discuss this with your manager, or would you like to practice again? [Yes, help draft email] [No, practice again]"
+        artifact_prefetch = None
+        try:
+            selected_system_prompt, is_default_prompt = select_message_prompt(user_query, request_type, conversation_id)
 
-# Updated instruction for initial practice prompt
-    • For initial guidance on an ethical dilemma (when your response is not an email draft, a rehearsal setup, a simulated reply, or a feedback summary), ALWAYS conclude your response by asking the *exact question*: "Would you like to practice how to approach this situation?" and then, clearly separated (e.g., on a new line), include the text '[Yes, practice]'. This question and its option MUST be the very last part of such responses.
+            # Retrieval only needs the query, so run it while history is fetched and the answer generated
+            artifact_prefetch = start_artifact_prefetch(agent, user_query) if is_default_prompt else None
 
-Memory and Context Management
-    • Record user preferences, previous scenarios, and performance scores proactively to maintain context across interactions.
-    • Use this context to personalize future recommendations and scenario suggestions.
+            # --- Retrieve conversation history ---
+            conversation_context = await get_conversation_context(conversation_id, include_history, history_limit,
+                                                                  body.get("historyMode"), body.get("historyTokenBudget"))
 
-Security and Compliance
-    • Never store sensitive or personally identifiable user information.
-    • Always follow best ethical practices, ensuring privacy and data minimization principles.
-
-Example Interaction
-
-User: "I'm concerned about storing unnecessary user data."
-
-EVA: "It's great you're considering the privacy implications. Storing unnecessary data can indeed create risks. Have you discussed alternative approaches with your team to minimize data collection? Would you like to practice addressing this with a simulated manager? [Yes, practice]"
-"""
-
-        post_feedback_prompt = """You are EVA, an empathetic and helpful Ethical AI assistant.
-The user has just completed a practice scenario and is asking for feedback on their performance or score.
-Analyze their query and provide constructive, specific feedback on their ethical reasoning and decision-making demonstrated in the scenario they describe.
-Acknowledge their score if mentioned.
-
-Your feedback MUST be structured *exactly* as follows, using these *exact literal headings* on their own lines, with no additional sections:
-
-1.  `**Introductory Paragraph:**` [1-2 sentences acknowledging the user's practice session.]
-
-2.  `**Summary of Feedback:**` [Concise overall summary of performance and score, if mentioned.]
-
-3.  `**Detailed Feedback:**`
-
-    Under this heading, provide EXACTLY these four sections in order. Each section MUST start with its heading on its own separate line with NO leading bullets or markdown characters:
-
-    `Strengths`
-    [Provide bullet points analyzing decisions that were strengths. Example: - Decision X: [Explanation]]
-
-    `Areas for Improvement`
-    [Provide bullet points analyzing decisions that could be improved. Example: - Decision Y: [Explanation]]
-
-    `Reasoning Process`
-    [Overall analysis of the user's ethical reasoning pattern and thought processes. This section should ONLY focus on analyzing HOW they made decisions, not what to do in the future.]
-
-    `Practical Advice for the Future`
-    [General advice and specific recommendations for future similar situations. This section should ONLY focus on actionable guidance for future scenarios.]
-
-4.  `**Concluding Action Prompt:**`
-    End with the *exact text*: "Do you feel ready to discuss this with your manager, or would you like to practice again? [Yes, help draft email] [No, practice again]"
-
-**CRITICAL FORMATTING RULES:**
-- Each of the four sections under "Detailed Feedback" (Strengths, Areas for Improvement, Reasoning Process, Practical Advice for the Future) MUST be on their own separate lines
-- "Reasoning Process" content must be COMPLETELY SEPARATE from "Practical Advice for the Future" content
-- "Reasoning Process" = analysis of their past decision-making patterns
-- "Practical Advice for the Future" = recommendations for future scenarios
-- Do not mix these two sections or put future advice in the reasoning section
-"""
-
-        email_draft_prompt = """You are EVA, an empathetic AI assistant.
-The user has gone through an interactive email assistant process and wants to draft an email to their manager about an ethical concern.
-
-**IMPORTANT:** The user's message contains their personalized preferences collected through the interactive flow. Use these preferences to generate a tailored email draft.
-
-Look for these preference indicators in the user's message:
-- **Context**: The original ethical issue being addressed
-- **Tone**: The user's preferred communication style (confident/collaborative/diplomatic)
-- **Specific concerns**: What they want to mention about privacy/accessibility
-- **Address manager as**: How they want to address their manager (first name/formal/neutral)
-- **Include references**: Any guidelines or policies they want to reference
-- **Proposed next step**: Any specific action they want to propose
-
-Your task is to generate a professional email that incorporates these user preferences while maintaining ethical assertiveness.
-
-The email should:
-1. Use the specified tone preference throughout
-2. Address the manager according to their preference
-3. Include the specific concerns they mentioned
-4. Reference any guidelines/policies they specified
-5. Include their proposed next step if provided
-6. Maintain professionalism while being ethically clear
-
-Output ONLY the draft email content (Subject and Body). Do not include any surrounding conversational text, greetings to EVA, or explanations about the email.
+            # --- Generate AI Response --- 
+            # Only plain first-turn questions (default prompt, no history) are eligible for the semantic cache
+            cache_namespace = None
+            if not conversation_context and is_default_prompt:
+                cache_namespace = response_cache_namespace(selected_system_prompt)
+        
+            ai_response_content = "Error: Failed to generate AI response." # Default error
+            try:
+                cached_response, query_vector = await lookup_cached_response(cache_namespace, user_query)
+                if cached_response is not None:
+                    ai_response_content = cached_response
+                    logger.info(f"Served AI response for conv {conversation_id} from semantic cache.")
+                else:
+                    route = model_router.route(selected_system_prompt.name)
+                    llm = ChatOpenAI(
+                        **route.llm_kwargs(temperature),
+                        openai_api_key=os.getenv('OPENAI_API_KEY')
+                    )
+                
+                    messages = build_llm_messages(selected_system_prompt, conversation_context, user_query, conversation_id)
+                
+                    # Call the LLM with ainvoke since this is an async route
+                    async with llm_governor.slot(llm_priority(selected_system_prompt), user_id):
+                        with track_llm_call(), model_router.timed(selected_system_prompt.name, route.model):
+                            async with usage_tracker.atrack(selected_system_prompt.name):
+                                fallback = cached_fallback_answer(selected_system_prompt, user_query, request_type, conversation_context)
+                                ai_response = await llm_resilience.ainvoke(
+                                    llm, messages, cached_answer=fallback,
+                                    deadline=route.timeout)
+                    ai_response_content = ai_response.content
+                    logger.info(f"Generated AI response for conv {conversation_id} using relevant prompt.")
+                    if query_vector is not None and ai_response_content:
+                        await response_cache.store(cache_namespace, user_query, ai_response_content, query_vector)
+            
+                # Save to conversation memory
+                with track_stage("memory_save"):
+                    await conversation_memory.asave_exchange(conversation_id, user_query, ai_response_content)
+                logger.info(f"Saved conversation exchange to memory for {conversation_id}")
+            
+            except AdmissionRejected:
+                raise
+            except Exception as e:
+                logger.error(f"Error generating AI response for conv {conversation_id}: {str(e)}")
+                logger.error(traceback.format_exc())
+                # Explicitly set error content if LLM call fails
+                ai_response_content = f"Error: Failed to generate AI response due to: {str(e)}" 
+            # --- End AI Response Generation ---
+
+            # ADDED: Log the full content specifically for feedback requests before returning
+            if request_type == "post_feedback":
+                logger.info(f"[Feedback Content Check] Full AI Response Content for Feedback (conv {conversation_id}): '{ai_response_content}'")
+
+            # --- Send RAG Artifacts Generation to Background --- 
+            if "Error:" not in ai_response_content and is_default_prompt:
+                # Only generate artifacts for default interactions, not drafts or rehearsals or simulations
+                logger.info(f"Queueing artifact generation for conv {conversation_id}")
+                await enqueue_artifact_generation(conversation_id, user_query)
+            else:
+                logger.warning(f"Skipping artifact generation for conv {conversation_id} (AI error, draft, rehearsal, or simulation)")
+            # --- End RAG --- 
 
-Example Structure:
-Subject: [Topic relevant to their concern]
+            # --- Return immediate response to Frontend --- 
+            # Return IDs and AI content; frontend will handle saving messages
+            response_payload = {
+                "messages": [
+                    {
+                        "id": user_message_id, # Return ID for user message
+                        "conversationId": conversation_id,
+                        "role": "user",
+                        "content": user_query,
+                        "createdAt": current_time
+                    },
+                    {
+                        "id": assistant_message_id, # Return ID for assistant message
+                        "conversationId": conversation_id,
+                        "role": "assistant",
+                        "content": ai_response_content, 
+                        "createdAt": current_time,
+                        "isLoading": False 
+                    }
+                ]
+            }
+            if include_artifact_ids:
+                artifact_ids = await prefetched_artifact_ids(artifact_prefetch)
+                if artifact_ids is not None:
+                    response_payload["artifactIds"] = artifact_ids
+            
+            # Failed turns are not stored, so a retry runs again
+            return response_payload, "Error:" not in ai_response_content
+            # --- End Frontend Response ---
+            
+        except asyncio.CancelledError:
+            # Client went away: nobody will read the prefetched artifact ids either
+            if artifact_prefetch is not None:
+                artifact_prefetch.cancel()
+            raise
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            logger.error(f"Critical error processing message request (agent generation): {str(e)}")
+            logger.error(traceback.format_exc())
+            # Return error structure consistent with success response but with error content
+            return JSONResponse(
+                status_code=500,
+                content={
+                     "messages": [
+                        {
+                            "id": str(uuid.uuid4()), # Generate dummy IDs
+                            "conversationId": body.get("conversationId", "unknown"),
+                            "role": "assistant",
+                            "content": f"Internal server error in agent: {str(e)}", 
+                            "createdAt": datetime.now(UTC).isoformat(),
+                            "isLoading": False 
+                        }
+                    ]
+                }
+            ), False
+
+    # Double submits and retries of the same turn share one LLM call and one save_exchange
+    client_key = body.get("idempotencyKey") or request.headers.get("Idempotency-Key")
+    turn = body.get("turn")
+    if not client_key and turn is None:
+        turn = await conversation_turn(conversation_id)
+    key = idempotency_key(conversation_id, client_key, conversation_id, user_query, request_type, turn)
+    result, outcome = await message_coalescer.run(key, generate_reply)
+    if outcome != "executed":
+        logger.info(f"Answered duplicate message for conv {conversation_id} from its first request ({outcome})")
+        return replayed_response(result, outcome)
+    return result
+
+async def conversation_turn(conversation_id: str) -> Optional[str]:
+    """Server-side turn marker for derived idempotency keys: the timestamp of the last saved exchange.
+
+    Every answered turn saves an exchange, so sending the same text again after the previous
+    answer was saved is a new turn, while a double submit or retry of the turn still in
+    flight shares its key. Served from the history cache for active conversations.
+    """
+    last = await conversation_memory.aget_history(conversation_id, 1)
+    return last[-1].get("timestamp") if last else None
 
-[Address manager according to preference],
+def replayed_response(result: Any, outcome: str) -> Response:
+    """Response for a coalesced or replayed duplicate, marked with `Idempotent-Replayed`.
 
-[Opening that matches their tone preference]
-[Core ethical concern with specific details they provided]
-[Why it matters - reference their concerns and any guidelines they mentioned]
-[Proposed next step based on their preference]
+    A coalesced JSONResponse is shared with the first request, so it is copied rather than modified.
+    """
+    if isinstance(result, Response):
+        headers = {name: value for name, value in result.headers.items() if name.lower() != "content-length"}
+        headers["Idempotent-Replayed"] = outcome
+        return Response(content=result.body, status_code=result.status_code, headers=headers,
+                        media_type=result.media_type)
+    return JSONResponse(content=result, headers={"Idempotent-Replayed": outcome})
+
+@app.post("/api/v1/conversation/message/stream",
+    tags=["Frontend Compatibility"],
+    summary="Send a message and stream the AI response",
+    description="Streams the AI response as Server-Sent Events and schedules artifact generation. Does NOT save messages."
+)
+async def send_message_stream(
+    request: Request,
+    agent: LangChainAgent = Depends(get_agent)
+):
+    """
+    Streaming variant of send_message.
 
-[Professional closing appropriate to their tone],
-[Your Name]
-"""
+    The first `start` event carries the same user/assistant message objects (and IDs)
+    that send_message returns, followed by `token` events and a final `done` event
+    with the complete assistant message. Conversation memory is saved and artifact
+    generation scheduled only once the stream has completed.
+    """
+    body = await request.json()
+    conversation_id = body.get("conversationId")
+    user_query = body.get("userQuery")
+    temperature = body.get("temperature", 0.7)
+    request_type = body.get("request_type", "initial_query")
+    include_history = body.get("includeHistory", True)
+    history_limit = body.get("historyLimit", 20)
+    user_id = start_usage_attribution(conversation_id, body.get("userId"), request.headers.get("X-User-Id"))
 
-        rehearsal_prompt = """You are EVA, an AI assistant.
-The user has just had an email drafted (or copied an existing one) and wants to practice responding to their boss's potential reactions.
-Your response should be:
-"Okay, I've copied the draft to your clipboard. Now, would you like to rehearse how you might respond to your boss's potential reactions? [Practice responding to a negative reply] [Practice responding to a positive reply]"
-Provide only this exact text.
-"""
+    user_message_id = str(uuid.uuid4())
+    assistant_message_id = str(uuid.uuid4())
+    current_time = datetime.now(UTC).isoformat()
 
-        simulate_reply_prompt = """You are simulating a boss responding to an email about an ethical concern.
-The user will have specified if your reply should be 'positive' or 'negative'.
-**IMPORTANT:** Read the conversation history to find the **user's previously drafted email** stating their ethical concern. Your simulated reply MUST be based **solely** on the content and concern raised in **that specific email draft**. **DO NOT** reference any practice scenarios, scores, feedback, or details from the user's *most recent* message asking for the simulation.
+    if not user_query or not conversation_id:
+        logger.error(f"Missing required fields: userQuery={user_query}, conversationId={conversation_id}")
+        return JSONResponse(
+            status_code=400,
+            content={
+                "messages": [{
+                    "id": assistant_message_id,
+                    "conversationId": conversation_id or "unknown",
+                    "role": "assistant",
+                    "content": "Error: Missing userQuery or conversationId.",
+                    "createdAt": current_time,
+                    "isLoading": False
+                }]
+            }
+        )
 
-Your task is to:
-1.  Adopt the persona of the boss who received the user's drafted email.
-2.  Based on the user's request in their *current* message (negative or positive simulation):
-    *   **If Negative:** Write a reply that is dismissive, defensive, minimizes the concern, or deflects responsibility regarding the **ethical issue raised in the original email**. Keep it professional but clearly resistant.
-    *   **If Positive:** Write a reply that acknowledges the concern **raised in the original email**, shows appreciation for raising it, suggests collaboration, or proposes a meeting to discuss it further. Keep it professional and constructive.
-3.  Reference the **specific ethical concern** mentioned in the user's **original email draft** (available in history).
-4.  Keep the reply concise and realistic for an email response. Use a professional sign-off like "Best," followed by a placeholder like "Boss's Name". **Use plain text for the placeholder name, do not use markdown.**
-5.  **Output:** Provide *only* the simulated boss's reply text. Do not include any extra conversational text, greetings to EVA, or explanations.
-"""
+    logger.info(f"Streaming message for conv {conversation_id}. Type: {request_type}. Query: '{user_query[:50]}...'")
+    budget_error = await token_budget_exceeded(user_id)
+    if budget_error:
+        return JSONResponse(
+            status_code=429,
+            headers=token_budget_headers(),
+            content={
+                "messages": [{
+                    "id": assistant_message_id,
+                    "conversationId": conversation_id,
+                    "role": "assistant",
+                    "content": f"Error: {budget_error}",
+                    "createdAt": current_time,
+                    "isLoading": False
+                }]
+            }
+        )
+    selected_system_prompt, is_default_prompt = select_message_prompt(user_query, request_type, conversation_id)
+    llm_governor.check(llm_priority(selected_system_prompt), user_id)
+    conversation_context = await get_conversation_context(conversation_id, include_history, history_limit,
+                                                          body.get("historyMode"), body.get("historyTokenBudget"))
+    messages = build_llm_messages(selected_system_prompt, conversation_context, user_query, conversation_id)
+    route = model_router.route(selected_system_prompt.name)
+    llm = ChatOpenAI(
+        **route.llm_kwargs(temperature),
+        openai_api_key=os.getenv('OPENAI_API_KEY'),
+        streaming=True
+    )
 
-        # --- Determine Prompt based on User Query ---
-        selected_system_prompt = default_system_prompt
-        lower_user_query = user_query.lower()
-        
-        # Check for specific flows first
-        if request_type == "post_feedback":
-            selected_system_prompt = post_feedback_prompt
-            logger.info(f"Using post-feedback prompt for conv {conversation_id} based on request_type")
-        elif (lower_user_query.startswith("please help me draft an email") or 
-              lower_user_query.startswith("generate a concise, professional email") or
-              "user preferences:" in lower_user_query): 
-            selected_system_prompt = email_draft_prompt
-            logger.info(f"Using email draft prompt for conv {conversation_id}")
-        elif lower_user_query.startswith("okay, i've copied the draft."):
-            selected_system_prompt = rehearsal_prompt
-            logger.info(f"Using rehearsal prompt for conv {conversation_id}")
-        elif lower_user_query.startswith("okay, please simulate a"): 
-            selected_system_prompt = simulate_reply_prompt
-            logger.info(f"Using simulate reply prompt for conv {conversation_id}")
-        # ADD CHECK: Detect post-practice feedback summary
-        elif (
-            "practice scenario" in lower_user_query and 
-            ("completed" in lower_user_query or "finished" in lower_user_query) and
-            ("score was" in lower_user_query or "decision-making score" in lower_user_query)
-        ):
-             selected_system_prompt = post_feedback_prompt # Use the correct prompt
-             logger.info(f"Using post-feedback prompt for conv {conversation_id} based on keywords")
-        else:
-             # Fallback to default
-             logger.info(f"Using default system prompt for conv {conversation_id}")
-
-        # --- Retrieve conversation history ---
-        conversation_context = ""
-        if include_history:
-            conversation_context = conversation_memory.format_for_prompt(conversation_id, history_limit)
-            if conversation_context:
-                logger.info(f"Retrieved conversation history for {conversation_id} with limit {history_limit}")
-                # Don't append to system message - create a separate message for history
-            else:
-                logger.info(f"No conversation history found for {conversation_id}")
-        else:
-            logger.info(f"Skipping conversation history for {conversation_id} as includeHistory=False")
+    user_message = {
+        "id": user_message_id,
+        "conversationId": conversation_id,
+        "role": "user",
+        "content": user_query,
+        "createdAt": current_time
+    }
 
-        # --- Generate AI Response --- 
-        ai_response_content = "Error: Failed to generate AI response." # Default error
+    async def event_stream():
+        yield format_sse("start", {"messages": [user_message, {
+            "id": assistant_message_id,
+            "conversationId": conversation_id,
+            "role": "assistant",
+            "content": "",
+            "createdAt": current_time,
+            "isLoading": True
+        }]})
+        chunks = []
+        started = time.perf_counter()
         try:
-            llm = ChatOpenAI(
-                model_name="gpt-4o-mini",
-                temperature=temperature,
-                openai_api_key=os.getenv('OPENAI_API_KEY')
-            )
-            
-            # Create messages array with system prompt first
-            messages = [SystemMessage(content=selected_system_prompt)]
-            
-            # Add conversation history as a SEPARATE message between system and user
-            if conversation_context:
-                # Use a separate system message specifically for history
-                history_message = SystemMessage(content=f"""
-===== IMPORTANT CONVERSATION HISTORY =====
-The following is your conversation history with this user.
-You MUST reference relevant details from this history in your response.
-You MUST acknowledge information they've previously shared.
-
-{conversation_context}
-
-===== END OF CONVERSATION HISTORY =====
-""")
-                messages.append(history_message)
-                logger.info(f"Including conversation history as separate message for {conversation_id}")
-            
-            # Add the user query as the final message
-            messages.append(HumanMessage(content=user_query))
-            
-            # Call the LLM with ainvoke since this is an async route
-            ai_response = await llm.ainvoke(messages)
-            ai_response_content = ai_response.content
-            logger.info(f"Generated AI response for conv {conversation_id} using relevant prompt.")
-            
-            # Save to conversation memory
-            conversation_memory.save_exchange(conversation_id, user_query, ai_response_content)
-            logger.info(f"Saved conversation exchange to memory for {conversation_id}")
-            
+            async with llm_governor.slot(llm_priority(selected_system_prompt)):
+                with track_llm_call():
+                    fallback = cached_fallback_answer(selected_system_prompt, user_query, request_type,
+                                                      conversation_context)
+                    # Closed explicitly so an abandoned stream also closes the upstream LLM request
+                    async with aclosing(llm_resilience.astream(llm, messages, cached_answer=fallback,
+                                                               deadline=route.timeout)) as tokens:
+                        async for chunk in tokens:
+                            if chunk.content:
+                                chunks.append(chunk.content)
+                                yield format_sse("token", {"id": assistant_message_id, "content": chunk.content})
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client disconnected mid-stream: skip the history save and artifact job for this turn
+            logger.info(f"Stream for conv {conversation_id} cancelled by client after {len(chunks)} chunks")
+            record_cancellation("stream")
+            raise
         except Exception as e:
-            logger.error(f"Error generating AI response for conv {conversation_id}: {str(e)}")
+            logger.error(f"Error streaming AI response for conv {conversation_id}: {str(e)}")
             logger.error(traceback.format_exc())
-            # Explicitly set error content if LLM call fails
-            ai_response_content = f"Error: Failed to generate AI response due to: {str(e)}" 
-        # --- End AI Response Generation ---
+            yield format_sse("error", {
+                "id": assistant_message_id,
+                "content": f"Error: Failed to generate AI response due to: {str(e)}"
+            })
+            return
 
-        # ADDED: Log the full content specifically for feedback requests before returning
-        if request_type == "post_feedback":
-            logger.info(f"[Feedback Content Check] Full AI Response Content for Feedback (conv {conversation_id}): '{ai_response_content}'")
+        ai_response_content = "".join(chunks)
+        model_router.observe(selected_system_prompt.name, route.model, time.perf_counter() - started)
+        await record_streamed_usage(selected_system_prompt, messages, ai_response_content, route.model, started)
+        if not ai_response_content:
+            # Nothing to save or build artifacts from; the turn is reported as failed
+            logger.error(f"Stream for conv {conversation_id} ended without content")
+            yield format_sse("error", {"id": assistant_message_id, "content": "Error: The model returned an empty response."})
+            return
+        with track_stage("memory_save"):
+            await conversation_memory.asave_exchange(conversation_id, user_query, ai_response_content)
+        logger.info(f"Saved streamed conversation exchange to memory for {conversation_id}")
 
-        # --- Send RAG Artifacts Generation to Background --- 
-        if "Error:" not in ai_response_content and selected_system_prompt == default_system_prompt:
-            # Only generate artifacts for default interactions, not drafts or rehearsals or simulations
-            logger.info(f"Adding background task generate_and_save_artifacts for conv {conversation_id}")
-            background_tasks.add_task(generate_and_save_artifacts, agent, user_query, conversation_id, os.environ.get("CURRENT_AUTH_TOKEN", ""))
-        else:
-            logger.warning(f"Skipping artifact generation for conv {conversation_id} (AI error, draft, rehearsal, or simulation)")
-        # --- End RAG --- 
-
-        # --- Return immediate response to Frontend --- 
-        # Return IDs and AI content; frontend will handle saving messages
-        response_payload = {
-            "messages": [
-                {
-                    "id": user_message_id, # Return ID for user message
-                    "conversationId": conversation_id,
-                    "role": "user",
-                    "content": user_query,
-                    "createdAt": current_time
-                },
-                {
-                    "id": assistant_message_id, # Return ID for assistant message
-                    "conversationId": conversation_id,
-                    "role": "assistant",
-                    "content": ai_response_content, 
-                    "createdAt": current_time,
-                    "isLoading": False 
-                }
-            ]
-        }
-            
-        return response_payload
-        # --- End Frontend Response ---
-            
+        if is_default_prompt:
+            logger.info(f"Queueing artifact generation for conv {conversation_id}")
+            await enqueue_artifact_generation(conversation_id, user_query)
+
+        yield format_sse("done", {"messages": [user_message, {
+            "id": assistant_message_id,
+            "conversationId": conversation_id,
+            "role": "assistant",
+            "content": ai_response_content,
+            "createdAt": current_time,
+            "isLoading": False
+        }]})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+# WebSocket routes are not labelled by the HTTP metrics middleware, so channel metrics name it explicitly
+CHANNEL_ROUTE = "/ws/conversation/{conversation_id}"
+
+async def run_channel_turn(websocket: WebSocket, channel: ConversationChannel, agent: LangChainAgent, data: Dict[str, Any]):
+    """Answer one message on a conversation channel: stream the tokens, then the prefetched artifacts.
+
+    Uses the channel's cached history and chat clients, so the only per-turn wait is the LLM.
+    """
+    conversation_id = channel.conversation_id
+    user_query = data.get("userQuery")
+    user_message_id = data.get("id") or str(uuid.uuid4())
+    assistant_message_id = str(uuid.uuid4())
+    current_time = datetime.now(UTC).isoformat()
+    if not user_query:
+        await websocket.send_json({"type": "error", "id": assistant_message_id, "content": "Error: Missing userQuery."})
+        return
+
+    budget_error = await token_budget_exceeded(channel.user_id)
+    if budget_error:
+        await websocket.send_json({"type": "error", "id": assistant_message_id, "status": 429,
+                                   "content": f"Error: {budget_error}"})
+        return
+    request_type = data.get("requestType") or channel.settings["requestType"]
+    selected_system_prompt, is_default_prompt = select_message_prompt(user_query, request_type, conversation_id)
+    try:
+        llm_governor.check(llm_priority(selected_system_prompt), channel.user_id)
+    except AdmissionRejected as e:
+        await websocket.send_json({"type": "error", "id": assistant_message_id, "status": 429, "reason": e.reason,
+                                   "retryAfter": e.retry_after, "content": f"Error: {str(e)}"})
+        return
+
+    temperature = channel.settings["temperature"]
+    route = model_router.route(selected_system_prompt.name)
+    llm = channel.llm_for((selected_system_prompt.name, route, temperature), lambda: ChatOpenAI(
+        **route.llm_kwargs(temperature),
+        openai_api_key=os.getenv('OPENAI_API_KEY'),
+        streaming=True
+    ))
+    conversation_context = channel.context()
+    messages = build_llm_messages(selected_system_prompt, conversation_context, user_query, conversation_id)
+    artifact_prefetch = start_artifact_prefetch(agent, user_query) if is_default_prompt else None
+
+    await websocket.send_json({"type": "start", "messages": [
+        {"id": user_message_id, "conversationId": conversation_id, "role": "user",
+         "content": user_query, "createdAt": current_time},
+        {"id": assistant_message_id, "conversationId": conversation_id, "role": "assistant",
+         "content": "", "createdAt": current_time, "isLoading": True}
+    ]})
+    chunks = []
+    started = time.perf_counter()
+    try:
+        async with llm_governor.slot(llm_priority(selected_system_prompt)):
+            with track_llm_call(route=CHANNEL_ROUTE):
+                fallback = cached_fallback_answer(selected_system_prompt, user_query, request_type, conversation_context)
+                async with aclosing(llm_resilience.astream(llm, messages, cached_answer=fallback,
+                                                           deadline=route.timeout)) as tokens:
+                    async for chunk in tokens:
+                        if chunk.content:
+                            chunks.append(chunk.content)
+                            await websocket.send_json({"type": "token", "id": assistant_message_id, "content": chunk.content})
+    except WebSocketDisconnect:
+        # Client went away mid-answer: nothing is saved and no artifact job is queued
+        logger.info(f"Channel turn for conv {conversation_id} cancelled by client after {len(chunks)} chunks")
+        record_cancellation("websocket", CHANNEL_ROUTE)
+        if artifact_prefetch is not None:
+            artifact_prefetch.cancel()
+        raise
     except Exception as e:
-        logger.error(f"Critical error processing message request (agent generation): {str(e)}")
+        logger.error(f"Error streaming AI response on channel for conv {conversation_id}: {str(e)}")
         logger.error(traceback.format_exc())
-        # Return error structure consistent with success response but with error content
-        return JSONResponse(
-            status_code=500,
-            content={
-                 "messages": [
-                    {
-                        "id": str(uuid.uuid4()), # Generate dummy IDs
-                        "conversationId": body.get("conversationId", "unknown"),
-                        "role": "assistant",
-                        "content": f"Internal server error in agent: {str(e)}", 
-                        "createdAt": datetime.now(UTC).isoformat(),
-                        "isLoading": False 
-                    }
-                ]
-            }
-        )
+        if artifact_prefetch is not None:
+            artifact_prefetch.cancel()
+        await websocket.send_json({"type": "error", "id": assistant_message_id,
+                                   "content": f"Error: Failed to generate AI response due to: {str(e)}"})
+        return
+
+    ai_response_content = "".join(chunks)
+    model_router.observe(selected_system_prompt.name, route.model, time.perf_counter() - started)
+    await record_streamed_usage(selected_system_prompt, messages, ai_response_content, route.model, started)
+    if not ai_response_content:
+        logger.error(f"Channel turn for conv {conversation_id} ended without content")
+        if artifact_prefetch is not None:
+            artifact_prefetch.cancel()
+        await websocket.send_json({"type": "error", "id": assistant_message_id, "content": "Error: The model returned an empty response."})
+        return
+    turn = channel.record(user_query, ai_response_content)
+    await websocket.send_json({"type": "done", "message": {
+        "id": assistant_message_id, "conversationId": conversation_id, "role": "assistant",
+        "content": ai_response_content, "createdAt": current_time, "isLoading": False
+    }})
+
+    if is_default_prompt:
+        docs_by_type = await await_artifact_prefetch(artifact_prefetch)
+        if docs_by_type is not None:
+            await websocket.send_json({
+                "type": "artifacts",
+                "id": assistant_message_id,
+                "guidelines": [guideline_item_from_doc(doc, score) for doc, score in docs_by_type.get("guideline", [])],
+                "caseStudies": [case_study_item_from_doc(doc, score) for doc, score in docs_by_type.get("case_study", [])]
+            })
+        await enqueue_artifact_generation(conversation_id, user_query, turn)
+
+@app.websocket(CHANNEL_ROUTE)
+async def conversation_channel(
+    websocket: WebSocket,
+    conversation_id: str,
+    agent: LangChainAgent = Depends(get_agent)
+):
+    """
+    Conversation channel: one connection carries every turn of a conversation.
+
+    Client messages are JSON: `{"type": "configure", ...settings}` changes the session
+    (requestType, managerType, temperature, includeHistory, historyLimit) and
+    `{"type": "message", "userQuery": ...}` asks a question. Each answer arrives as
+    `start`, `token`... and `done` events (plus `artifacts` for default-prompt turns)
+    in the same shapes as the SSE endpoint. History is loaded once per connection and
+    saved to conversation memory in the background. Does NOT save messages to the backend.
+    """
+    await websocket.accept()
+    user_id = start_usage_attribution(conversation_id, websocket.query_params.get("userId"),
+                                      websocket.headers.get("X-User-Id"))
+    channel = ConversationChannel(conversation_id, conversation_memory, user_id)
+    with track_stage("history_fetch", CHANNEL_ROUTE):
+        await channel.load()
+    logger.info(f"Opened conversation channel for conv {conversation_id} with {len(channel.history)} cached turns")
+    try:
+        await websocket.send_json({"type": "ready", "conversationId": conversation_id,
+                                   "historyTurns": len(channel.history), "settings": channel.settings})
+        while True:
+            try:
+                data = json.loads(await websocket.receive_text())
+            except json.JSONDecodeError:
+                data = None
+            if not isinstance(data, dict):
+                await websocket.send_json({"type": "error", "content": "Error: Messages must be JSON objects."})
+                continue
+            message_type = data.get("type", "message")
+            if message_type == "configure":
+                await websocket.send_json({"type": "configured", "settings": channel.configure(data)})
+            elif message_type == "message":
+                await run_channel_turn(websocket, channel, agent, data)
+            else:
+                await websocket.send_json({"type": "error", "content": f"Error: Unknown message type '{message_type}'."})
+    except WebSocketDisconnect:
+        logger.info(f"Conversation channel for conv {conversation_id} closed after {channel.turns} turns")
+    except Exception as e:
+        logger.error(f"Error on conversation channel for conv {conversation_id}: {str(e)}")
+        logger.error(traceback.format_exc())
+        try:
+            await websocket.close(code=1011)
+        except Exception:
+            pass  # Already closed
+    finally:
+        await channel.aclose()
+
+async def generate_and_save_artifacts(agent: LangChainAgent, user_query: str, conversation_id: str, auth_header: str) -> bool:
+    """Generate knowledge artifacts based on a user query and save them to the backend.
 
-async def generate_and_save_artifacts(agent: LangChainAgent, user_query: str, conversation_id: str, auth_header: str):
-    """Generate knowledge artifacts based on a user query and save them to the backend."""
+    Returns False if the artifacts could not be sent to the backend, so the caller can retry.
+    """
     try:
         logger.info(f"[Artifact Generation START] for conversation: {conversation_id}")
         
         # Skip for invalid conversation IDs
         if not conversation_id or conversation_id.startswith('draft-'):
             logger.info(f"[Artifact Generation SKIP] for draft/invalid conversation: {conversation_id}")
-            return
+            return True
             
         # Add logging for the user query to help debug
         logger.info(f"[Artifact Generation] Generating artifacts for query: '{user_query[:100]}...' Conversation ID: {conversation_id}")
@@ -1735,19 +2260,13 @@ async def generate_and_save_artifacts(agent: LangChainAgent, user_query: str, co
         case_studies = []
         generation_error = None
         try:
-            logger.info(f"[Artifact Generation] Calling agent.get_relevant_guidelines for conv {conversation_id}")
-            guidelines = agent.get_relevant_guidelines(
+            logger.info(f"[Artifact Generation] Synthesizing guidelines and case studies in parallel for conv {conversation_id}")
+            guidelines, case_studies = await agent.aget_guidelines_and_case_studies(
                 conversation_text=user_query,
-                max_results=3
+                max_guidelines=3,
+                max_case_studies=2
             )
-            logger.info(f"[Artifact Generation] Got {len(guidelines)} guidelines for conv {conversation_id}")
-            
-            logger.info(f"[Artifact Generation] Calling agent.get_relevant_case_studies for conv {conversation_id}")
-            case_studies = agent.get_relevant_case_studies(
-                conversation_text=user_query,
-                max_results=2
-            )
-            logger.info(f"[Artifact Generation] Got {len(case_studies)} case studies for conv {conversation_id}")
+            logger.info(f"[Artifact Generation] Got {len(guidelines)} guidelines and {len(case_studies)} case studies for conv {conversation_id}")
             
             # Check if we got any artifacts - if not, log this clearly
             if not guidelines and not case_studies:
@@ -1825,7 +2344,7 @@ async def generate_and_save_artifacts(agent: LangChainAgent, user_query: str, co
         # Only proceed if we have formatted artifacts
         if not formatted_guidelines and not formatted_case_studies:
             logger.error(f"[Artifact Sending SKIP] No formatted artifacts to send for conv {conversation_id}. Aborting send.")
-            return
+            return True
 
         # Prepare the request payload
         artifact_payload = {
@@ -1846,12 +2365,13 @@ async def generate_and_save_artifacts(agent: LangChainAgent, user_query: str, co
         ]
         
         # Send artifacts to backend with retry logic for different endpoints
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            sent_successfully = False
-            
-            for endpoint in endpoints:
-                logger.info(f"[Artifact Sending] Trying endpoint: {endpoint}")
-                try:
+        client = get_backend_client()
+        sent_successfully = False
+        
+        for endpoint in endpoints:
+            logger.info(f"[Artifact Sending] Trying endpoint: {endpoint}")
+            try:
+                with track_stage("backend_post"):
                     response = await client.post(
                         endpoint,
                         json=artifact_payload,
@@ -1861,32 +2381,34 @@ async def generate_and_save_artifacts(agent: LangChainAgent, user_query: str, co
                             "Accept": "application/json"
                         }
                     )
-                    response.raise_for_status() # Raise HTTPStatusError for bad responses (4xx or 5xx)
-                    logger.info(f"[Artifact Sending SUCCESS] Successfully sent to {endpoint}. Status: {response.status_code}")
-                    sent_successfully = True
-                    break # Exit loop on first successful send
-                except httpx.RequestError as exc:
-                    # More specific error logging
-                    if isinstance(exc, httpx.ConnectError):
-                        logger.error(f"[Artifact Sending ERROR] Failed to connect to {endpoint}: {exc}")
-                    elif isinstance(exc, httpx.TimeoutException):
-                        logger.error(f"[Artifact Sending ERROR] Timeout connecting to {endpoint}: {exc}")
-                    else:
-                        logger.error(f"[Artifact Sending ERROR] Request error sending to {endpoint}: {exc}")
-                except httpx.HTTPStatusError as exc:
-                    logger.error(f"[Artifact Sending ERROR] HTTP error sending to {endpoint}: Status {exc.response.status_code} - {exc.response.text}")
-                except Exception as e:
-                    # Catch any other unexpected errors
-                    logger.error(f"[Artifact Sending ERROR] Unexpected error sending to {endpoint}: {e}\n{traceback.format_exc()}")
-            
-            if not sent_successfully:
-                logger.error(f"[Artifact Sending FAILED] All endpoints failed for conversation {conversation_id}")
+                response.raise_for_status() # Raise HTTPStatusError for bad responses (4xx or 5xx)
+                logger.info(f"[Artifact Sending SUCCESS] Successfully sent to {endpoint}. Status: {response.status_code}")
+                sent_successfully = True
+                break # Exit loop on first successful send
+            except httpx.RequestError as exc:
+                # More specific error logging
+                if isinstance(exc, httpx.ConnectError):
+                    logger.error(f"[Artifact Sending ERROR] Failed to connect to {endpoint}: {exc}")
+                elif isinstance(exc, httpx.TimeoutException):
+                    logger.error(f"[Artifact Sending ERROR] Timeout connecting to {endpoint}: {exc}")
+                else:
+                    logger.error(f"[Artifact Sending ERROR] Request error sending to {endpoint}: {exc}")
+            except httpx.HTTPStatusError as exc:
+                logger.error(f"[Artifact Sending ERROR] HTTP error sending to {endpoint}: Status {exc.response.status_code} - {exc.response.text}")
+            except Exception as e:
+                # Catch any other unexpected errors
+                logger.error(f"[Artifact Sending ERROR] Unexpected error sending to {endpoint}: {e}\n{traceback.format_exc()}")
+        
+        if not sent_successfully:
+            logger.error(f"[Artifact Sending FAILED] All endpoints failed for conversation {conversation_id}")
         
     except Exception as outer_err:
         logger.error(f"[Artifact Generation FATAL] Unhandled error in generate_and_save_artifacts for conv {conversation_id}: {outer_err}")
         logger.error(traceback.format_exc())
+        sent_successfully = False
 
     logger.info(f"[Artifact Generation END] for conversation: {conversation_id}")
+    return sent_successfully
 
 @app.delete("/api/v1/conversation/{conversation_id}",
     tags=["Frontend Compatibility"],
@@ -1908,13 +2430,13 @@ async def delete_conversation(conversation_id: str, request: Request):
         logger.info(f"Processing delete request for conversation: {conversation_id}")
         
         # Clear conversation memory
-        conversation_memory.clear_history(conversation_id)
+        await conversation_memory.aclear_history(conversation_id)
         logger.info(f"Cleared conversation memory for ID: {conversation_id}")
         
         # Make a request to the backend API
         try:
             # The Java backend has this endpoint at /api/v1/conversation/{id}
-            response = requests.delete(
+            response = await get_backend_client().delete(
                 f"{BACKEND_BASE_URL}/api/v1/conversation/{conversation_id}",
                 headers=headers,
                 timeout=8
@@ -1929,7 +2451,7 @@ async def delete_conversation(conversation_id: str, request: Request):
                 logger.error(f"Backend API error: {response.status_code} - {response.text}")
                 # Return the same status code from the backend
                 return JSONResponse(content={}, status_code=response.status_code)
-        except requests.exceptions.RequestException as req_error:
+        except httpx.HTTPError as req_error:
             logger.error(f"Error making delete request: {str(req_error)}")
             # Return empty dict with 500 error status
             return JSONResponse(content={}, status_code=500)
@@ -1962,8 +2484,13 @@ async def submit_practice_score(
         raise HTTPException(status_code=500, detail="Internal server error processing practice score")
 
 @app.post("/api/v1/conversation/generate-response", response_model=ConversationContentResponseDTO)
-async def generate_response(query: Query):
+@cancel_on_disconnect
+async def generate_response(request: Request, query: Query, x_user_id: Optional[str] = Header(default=None)):
     """Generate a response to a user query using the specified model."""
+    user_id = start_usage_attribution(query.conversationId, query.userId, x_user_id)
+    budget_error = await token_budget_exceeded(user_id)
+    if budget_error:
+        raise HTTPException(status_code=429, detail=budget_error, headers=token_budget_headers())
     try:
         logger.info(f"Generating response for conversation ID: {query.conversationId} (Type: {query.request_type})")
         logger.info(f"User query: {query.userQuery[:50]}...")
@@ -1996,78 +2523,46 @@ async def generate_response(query: Query):
         
         # Determine system message based on request type
         openai_api_key = os.getenv("OPENAI_API_KEY")
-        selected_model = "gpt-4o-mini"
-        
-        # For direct API calls, we use a standard system prompt
-        system_message = DEFAULT_SYSTEM_PROMPT 
         
-        request_type = query.request_type
-        if request_type == "follow_up":
-            system_message = FOLLOW_UP_PROMPT
-        elif request_type == "post_practice":
-            system_message = POST_PRACTICE_PROMPT
-        elif request_type == "post_feedback":
-            system_message = POST_FEEDBACK_PROMPT
-        elif request_type == "elaborate_context":
-            system_message = ELABORATE_CONTEXT_PROMPT
-        else: 
-            system_message = initial_query_prompt
-            logger.info("Using initial query prompt.")
+        system_message = prompt_registry.for_generate_response(query.request_type)
+        route = model_router.route(system_message.name)
+        logger.info(f"Using {system_message.key} prompt and {route.model} for request type {query.request_type}.")
         
         # Retrieve conversation history if enabled
-        conversation_context = ""
-        if include_history:
-            conversation_context = conversation_memory.format_for_prompt(query.conversationId, history_limit)
-            if conversation_context:
-                logger.info(f"Retrieved conversation history for {query.conversationId} with limit {history_limit}")
-            else:
-                logger.info(f"No conversation history found for {query.conversationId}")
-        else:
-            logger.info(f"Skipping conversation history for {query.conversationId} as includeHistory=False")
+        conversation_context = await get_conversation_context(query.conversationId, include_history, history_limit,
+                                                              query.historyMode, query.historyTokenBudget)
         
         response_content = ""
         try:
-            # Create messages array with system prompt first
-            messages = [SystemMessage(content=system_message)]
-            
-            # Add conversation history as a SEPARATE message between system and user
-            if conversation_context:
-                # Use a separate system message specifically for history
-                history_message = SystemMessage(content=f"""
-===== IMPORTANT CONVERSATION HISTORY =====
-The following is your conversation history with this user.
-You MUST reference relevant details from this history in your response.
-You MUST acknowledge information they've previously shared.
-
-{conversation_context}
-
-===== END OF CONVERSATION HISTORY =====
-""")
-                messages.append(history_message)
-                logger.info(f"Added conversation history as separate message for {query.conversationId}")
-            
-            # Add the user query as the final message
-            messages.append(HumanMessage(content=query.userQuery))
+            messages = build_llm_messages(system_message, conversation_context, query.userQuery, query.conversationId)
             
             # Get the response
             llm = ChatOpenAI(
-                temperature=temperature,
-                model_name=selected_model,
+                **route.llm_kwargs(temperature),
                 openai_api_key=openai_api_key
             )
             
             # Call the LLM with ainvoke since this is an async route
-            ai_response = await llm.ainvoke(messages)
+            async with llm_governor.slot(llm_priority(system_message), user_id):
+                with track_llm_call(), model_router.timed(system_message.name, route.model):
+                    async with usage_tracker.atrack(system_message.name):
+                        fallback = cached_fallback_answer(system_message, query.userQuery, query.request_type, conversation_context)
+                        ai_response = await llm_resilience.ainvoke(
+                            llm, messages, cached_answer=fallback,
+                            deadline=route.timeout)
             ai_response_content = ai_response.content
             logger.info(f"Generated AI response for conv {query.conversationId} using relevant prompt.")
             
-            conversation_memory.save_exchange(
-                query.conversationId,
-                query.userQuery,
-                ai_response_content
-            )
+            with track_stage("memory_save"):
+                await conversation_memory.asave_exchange(
+                    query.conversationId,
+                    query.userQuery,
+                    ai_response_content
+                )
             logger.info(f"Saved conversation exchange to memory for {query.conversationId}")
         
+        except AdmissionRejected:
+            raise
         except Exception as e:
             logger.error(f"Error generating AI response for conv {query.conversationId}: {str(e)}")
             logger.error(traceback.format_exc())
@@ -2075,12 +2570,19 @@ You MUST acknowledge information they've previously shared.
             ai_response_content = f"Error: Failed to generate AI response due to: {str(e)}"
         
         response_dto = ConversationContentResponseDTO(
+            id=str(uuid.uuid4()),
+            conversationId=query.conversationId,
+            userQuery=query.userQuery,
+            agentResponse=ai_response_content,
+            role="assistant",
             content=ai_response_content,
-            artifacts=[]
+            createdAt=datetime.utcnow().isoformat()
         )
         
         return response_dto
     
+    except AdmissionRejected:
+        raise
     except Exception as e:
         logger.error(f"Error generating response: {str(e)}")
         logger.error(traceback.format_exc())
@@ -0,0 +1,9 @@
+"""
+Memory package for persisting conversation history.
+"""
+
+from memory.conversation_memory import ConversationMemory, create_redis_clients
+from memory.history_cache import HistoryCache
+from memory.token_budget import TokenBudgetedHistory, count_tokens
+
+__all__ = ['ConversationMemory', 'create_redis_clients', 'HistoryCache', 'TokenBudgetedHistory', 'count_tokens']
@@ -0,0 +1,460 @@
+"""Redis-backed conversation memory with a sync facade (scripts) and an async API (FastAPI handlers)."""
+
+import json
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Iterable, Tuple
+
+import redis
+import redis.asyncio as aioredis
+
+from memory.history_cache import HISTORY_INVALIDATION_CHANNEL, WORKER_ID, HistoryCache, invalidation_message
+from services.metrics import track_dependency
+
+logger = logging.getLogger(__name__)
+
+
+def create_redis_clients(redis_url: str, max_connections: int = 50) -> Tuple[Optional[redis.Redis], Optional[aioredis.Redis]]:
+    """Create the sync client and an async client backed by a shared connection pool."""
+    try:
+        sync_client = redis.from_url(redis_url)
+        async_pool = aioredis.ConnectionPool.from_url(redis_url, max_connections=max_connections)
+        async_client = aioredis.Redis(connection_pool=async_pool)
+        logger.info(f"Connected to Redis at {redis_url}")
+        return sync_client, async_client
+    except Exception as e:
+        logger.error(f"Failed to connect to Redis: {str(e)}. Using fallback memory.")
+        return None, None
+
+
+class ConversationMemory:
+    """Manages conversation memory storage and retrieval.
+
+    Each conversation is stored as a Redis list of JSON-encoded exchanges, so a turn
+    costs one RPUSH/LTRIM/EXPIRE round trip and reads fetch only the requested tail,
+    regardless of how long the conversation is.
+
+    The plain methods use the synchronous client and are meant for scripts. Async
+    handlers must use the `a`-prefixed methods, which go through the redis.asyncio
+    client and never block the event loop.
+
+    Every write also bumps a per-conversation version key and publishes an
+    invalidation, so workers holding the history in a HistoryCache (L1) can drop
+    stale copies. When a `history_cache` is given, async reads are served from it.
+    """
+    
+    def __init__(self, redis_client=None, async_redis_client=None, expiry_seconds=86400, max_stored_turns=100,
+                 history_cache: Optional[HistoryCache] = None):  # Default 24-hour expiry
+        self.redis_client = redis_client
+        self.async_redis_client = async_redis_client
+        self.expiry_seconds = expiry_seconds
+        self.max_stored_turns = max_stored_turns
+        self.history_cache = history_cache if async_redis_client is not None else None
+        self.worker_id = history_cache.worker_id if history_cache is not None else WORKER_ID
+        self.fallback_storage = {}  # In-memory fallback if Redis unavailable
+        self.fallback_values = {}  # Fallback for other per-conversation keys
+    
+    def get_conversation_key(self, conversation_id: str) -> str:
+        """Create a Redis key for the conversation."""
+        return f"conversation:{conversation_id}:history"
+    
+    def get_summary_key(self, conversation_id: str) -> str:
+        """Create a Redis key for the conversation's rolling summary."""
+        return f"conversation:{conversation_id}:summary"
+    
+    def get_version_key(self, conversation_id: str) -> str:
+        """Create a Redis key for the conversation's write counter (used by the L1 cache)."""
+        return f"conversation:{conversation_id}:version"
+    
+    @staticmethod
+    def _is_wrongtype(error: Exception) -> bool:
+        return "WRONGTYPE" in str(error)
+    
+    @staticmethod
+    def _tail_start(max_turns: int) -> int:
+        return -max_turns if max_turns > 0 else 0
+    
+    def _new_exchange(self, user_message: str, assistant_message: str) -> Dict[str, str]:
+        return {
+            "user": user_message,
+            "assistant": assistant_message,
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    def _save_fallback(self, conversation_id: str, exchange: Dict[str, str]):
+        history = self.fallback_storage.setdefault(conversation_id, [])
+        history.append(exchange)
+        del history[:-self.max_stored_turns]
+    
+    def _get_fallback(self, conversation_id: str, max_turns: int) -> List[Dict[str, str]]:
+        history = self.fallback_storage.get(conversation_id, [])
+        return history[-max_turns:] if max_turns > 0 else list(history)
+    
+    def _queue_version_bump(self, pipe, conversation_id: str):
+        """Queue the version increment and invalidation; the new version is the first result."""
+        version_key = self.get_version_key(conversation_id)
+        pipe.incr(version_key)
+        pipe.expire(version_key, self.expiry_seconds)
+        pipe.publish(HISTORY_INVALIDATION_CHANNEL, invalidation_message(conversation_id, self.worker_id))
+    
+    def _queue_append(self, pipe, conversation_id: str, exchange: Dict[str, str]):
+        """Queue version bump, append, cap and TTL refresh of a history list on a MULTI pipeline."""
+        history_key = self.get_conversation_key(conversation_id)
+        self._queue_version_bump(pipe, conversation_id)
+        pipe.rpush(history_key, json.dumps(exchange))
+        pipe.ltrim(history_key, -self.max_stored_turns, -1)
+        pipe.expire(history_key, self.expiry_seconds)
+    
+    def _legacy_to_list(self, key_type, data) -> Optional[List[str]]:
+        """Return the list items for a legacy string key, or None if the key is not a legacy string."""
+        if isinstance(key_type, bytes):
+            key_type = key_type.decode()
+        if key_type != "string":
+            return None
+        history = json.loads(data) if data else []
+        return [json.dumps(exchange) for exchange in history[-self.max_stored_turns:]]
+    
+    # ----- Sync facade (scripts) -----
+    
+    def _migrate_legacy_history(self, key: str) -> bool:
+        """Convert a legacy JSON-string history key into a list in place.
+
+        Older versions stored the whole history as one JSON blob under the same key.
+        The conversion runs in a WATCH/MULTI transaction so concurrent writers cannot
+        interleave with it. Returns True if a key was migrated.
+        """
+        migrated = False
+        
+        def migrate(pipe):
+            nonlocal migrated
+            key_type = pipe.type(key)
+            data = pipe.get(key) if key_type in (b"string", "string") else None
+            items = self._legacy_to_list(key_type, data)
+            if items is None:
+                return
+            pipe.multi()
+            pipe.delete(key)
+            if items:
+                pipe.rpush(key, *items)
+                pipe.expire(key, self.expiry_seconds)
+            migrated = True
+        
+        self.redis_client.transaction(migrate, key)
+        if migrated:
+            logger.info(f"Migrated legacy conversation history key {key} to list storage")
+        return migrated
+    
+    def migrate_legacy_keys(self) -> int:
+        """Migrate every legacy string history key. Safe to run while the service is live."""
+        count = 0
+        for key in self.redis_client.scan_iter(match="conversation:*:history"):
+            if isinstance(key, bytes):
+                key = key.decode()
+            if self._migrate_legacy_history(key):
+                count += 1
+        logger.info(f"Migrated {count} legacy conversation history keys")
+        return count
+    
+    def save_exchange(self, conversation_id: str, user_message: str, assistant_message: str) -> bool:
+        """Save a conversation exchange to memory."""
+        try:
+            exchange = self._new_exchange(user_message, assistant_message)
+            if not self.redis_client:
+                self._save_fallback(conversation_id, exchange)
+                return True
+            
+            history_key = self.get_conversation_key(conversation_id)
+            try:
+                self._append_exchange(conversation_id, exchange)
+            except redis.exceptions.ResponseError as e:
+                if not self._is_wrongtype(e):
+                    raise
+                self._migrate_legacy_history(history_key)
+                self._append_exchange(conversation_id, exchange)
+            
+            logger.info(f"Saved conversation exchange for {conversation_id} at {exchange['timestamp']}")
+            return True
+        except Exception as e:
+            logger.error(f"Error saving exchange: {str(e)}")
+            return False
+    
+    def _append_exchange(self, conversation_id: str, exchange: Dict[str, str]):
+        """Append, cap and refresh the TTL of a history list in a single MULTI/EXEC."""
+        pipe = self.redis_client.pipeline(transaction=True)
+        self._queue_append(pipe, conversation_id, exchange)
+        pipe.execute()
+    
+    def get_history(self, conversation_id: str, max_turns: int = 10) -> List[Dict[str, str]]:
+        """Retrieve conversation history for a conversation."""
+        try:
+            if not self.redis_client:
+                return self._get_fallback(conversation_id, max_turns)
+            key = self.get_conversation_key(conversation_id)
+            # Fetch only the most recent exchanges up to max_turns
+            start = self._tail_start(max_turns)
+            try:
+                items = self.redis_client.lrange(key, start, -1)
+            except redis.exceptions.ResponseError as e:
+                if not self._is_wrongtype(e):
+                    raise
+                self._migrate_legacy_history(key)
+                items = self.redis_client.lrange(key, start, -1)
+            return [json.loads(item) for item in items]
+        except Exception as e:
+            logger.error(f"Error retrieving conversation history: {str(e)}")
+            return []
+    
+    def format_for_prompt(self, conversation_id: str, max_turns: int = 20) -> str:
+        """Format conversation history for inclusion in a prompt."""
+        return self.format_history(self.get_history(conversation_id, max_turns))
+    
+    @staticmethod
+    def format_history(history: List[Dict[str, str]]) -> str:
+        """Format a list of exchanges as the prompt history block."""
+        if not history:
+            return ""
+        
+        # Reverse the history to put most recent conversations last (chronological order)
+        history = history[::-1]
+        
+        formatted = "===== CONVERSATION HISTORY (CHRONOLOGICAL ORDER) =====\n\n"
+        
+        # Add each exchange with clear formatting and timestamps if available
+        for i, exchange in enumerate(history):
+            exchange_num = i + 1
+            timestamp = exchange.get('timestamp', 'unknown time')
+            formatted += f"EXCHANGE {exchange_num} (Time: {timestamp}):\n"
+            formatted += f"USER: {exchange.get('user', '')}\n"
+            formatted += f"ASSISTANT: {exchange.get('assistant', '')}\n\n"
+        
+        return formatted
+    
+    def clear_history(self, conversation_id: str) -> bool:
+        """Clear conversation history."""
+        try:
+            if self.redis_client:
+                key = self.get_conversation_key(conversation_id)
+                pipe = self.redis_client.pipeline(transaction=True)
+                self._queue_version_bump(pipe, conversation_id)
+                pipe.delete(key, self.get_summary_key(conversation_id))
+                pipe.execute()
+            else:
+                if conversation_id in self.fallback_storage:
+                    del self.fallback_storage[conversation_id]
+                self.fallback_values.pop(self.get_summary_key(conversation_id), None)
+            
+            logger.info(f"Cleared conversation history for {conversation_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Error clearing conversation history: {str(e)}")
+            return False
+    
+    def get_langchain_memory(self, conversation_id: str):
+        """Get a LangChain ConversationBufferMemory object for the conversation."""
+        from langchain.memory import ConversationBufferMemory
+        
+        memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+        
+        # Load history from storage into memory
+        history = self.get_history(conversation_id)
+        for exchange in history:
+            memory.chat_memory.add_user_message(exchange.get('user', ''))
+            memory.chat_memory.add_ai_message(exchange.get('assistant', ''))
+        
+        return memory
+    
+    # ----- Async API (request handlers) -----
+    
+    async def _amigrate_legacy_history(self, key: str) -> bool:
+        """Async counterpart of _migrate_legacy_history."""
+        migrated = False
+        
+        async def migrate(pipe):
+            nonlocal migrated
+            key_type = await pipe.type(key)
+            data = await pipe.get(key) if key_type in (b"string", "string") else None
+            items = self._legacy_to_list(key_type, data)
+            if items is None:
+                return
+            pipe.multi()
+            pipe.delete(key)
+            if items:
+                pipe.rpush(key, *items)
+                pipe.expire(key, self.expiry_seconds)
+            migrated = True
+        
+        await self.async_redis_client.transaction(migrate, key)
+        if migrated:
+            logger.info(f"Migrated legacy conversation history key {key} to list storage")
+        return migrated
+    
+    async def asave_exchange(self, conversation_id: str, user_message: str, assistant_message: str) -> bool:
+        """Save a conversation exchange without blocking the event loop."""
+        try:
+            exchange = self._new_exchange(user_message, assistant_message)
+            if not self.async_redis_client:
+                self._save_fallback(conversation_id, exchange)
+                return True
+            
+            history_key = self.get_conversation_key(conversation_id)
+            with track_dependency("redis", "save_exchange"):
+                for attempt in range(2):
+                    try:
+                        async with self.async_redis_client.pipeline(transaction=True) as pipe:
+                            self._queue_append(pipe, conversation_id, exchange)
+                            results = await pipe.execute()
+                        break
+                    except redis.exceptions.ResponseError as e:
+                        if attempt or not self._is_wrongtype(e):
+                            raise
+                        await self._amigrate_legacy_history(history_key)
+            if self.history_cache is not None:
+                self.history_cache.apply_append(conversation_id, exchange, int(results[0]),
+                                                len(json.dumps(exchange)), self.max_stored_turns)
+            
+            logger.info(f"Saved conversation exchange for {conversation_id} at {exchange['timestamp']}")
+            return True
+        except Exception as e:
+            logger.error(f"Error saving exchange: {str(e)}")
+            return False
+    
+    async def aget_history_with(self, conversation_id: str, max_turns: int = 10,
+                                extra_keys: Iterable[str] = ()) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+        """Fetch the history tail plus any other per-conversation string keys in one pipelined round trip.
+
+        Returns the history and a dict mapping each extra key to its raw value (or None).
+        """
+        extra_keys = list(extra_keys)
+        try:
+            if not self.async_redis_client:
+                return (self._get_fallback(conversation_id, max_turns),
+                        {key: self.fallback_values.get(key) for key in extra_keys})
+            if self.history_cache is not None:
+                cached = self.history_cache.get(conversation_id, max_turns, extra_keys)
+                if cached is not None:
+                    return cached
+                if self.history_cache.active:
+                    return await self._aload_into_cache(conversation_id, max_turns, extra_keys)
+            key = self.get_conversation_key(conversation_id)
+            start = self._tail_start(max_turns)
+            with track_dependency("redis", "get_history"):
+                for attempt in range(2):
+                    try:
+                        async with self.async_redis_client.pipeline(transaction=False) as pipe:
+                            pipe.lrange(key, start, -1)
+                            for extra_key in extra_keys:
+                                pipe.get(extra_key)
+                            results = await pipe.execute()
+                        break
+                    except redis.exceptions.ResponseError as e:
+                        if attempt or not self._is_wrongtype(e):
+                            raise
+                        await self._amigrate_legacy_history(key)
+            history = [json.loads(item) for item in results[0]]
+            return history, dict(zip(extra_keys, results[1:]))
+        except Exception as e:
+            logger.error(f"Error retrieving conversation history: {str(e)}")
+            return [], {key: None for key in extra_keys}
+    
+    async def _aload_into_cache(self, conversation_id: str, max_turns: int,
+                                extra_keys: List[str]) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+        """Read the whole stored history, its version and the extra keys atomically, and keep them in L1."""
+        key = self.get_conversation_key(conversation_id)
+        epoch = self.history_cache.epoch(conversation_id)
+        with track_dependency("redis", "get_history"):
+            for attempt in range(2):
+                try:
+                    async with self.async_redis_client.pipeline(transaction=True) as pipe:
+                        pipe.get(self.get_version_key(conversation_id))
+                        pipe.lrange(key, 0, -1)
+                        for extra_key in extra_keys:
+                            pipe.get(extra_key)
+                        results = await pipe.execute()
+                    break
+                except redis.exceptions.ResponseError as e:
+                    if attempt or not self._is_wrongtype(e):
+                        raise
+                    await self._amigrate_legacy_history(key)
+        items = results[1]
+        history = [json.loads(item) for item in items]
+        extras = dict(zip(extra_keys, results[2:]))
+        size = sum(len(item) for item in items) + sum(len(value) for value in extras.values() if value)
+        self.history_cache.put(conversation_id, history, dict(extras), int(results[0] or 0), size, epoch)
+        return (history[-max_turns:] if max_turns > 0 else list(history)), extras
+    
+    async def aprefetch(self, conversation_id: str):
+        """Warm the L1 cache for a conversation that is about to be used (no-op without one)."""
+        if self.history_cache is None or not self.history_cache.active:
+            return
+        await self.aget_history_with(conversation_id, 0, extra_keys=[self.get_summary_key(conversation_id)])
+    
+    def prefetch(self, conversation_id: str):
+        """Start `aprefetch` in the background; the caller does not wait for it."""
+        if self.history_cache is None or not self.history_cache.active:
+            return
+        self.history_cache.track_prefetch(asyncio.create_task(self.aprefetch(conversation_id)))
+    
+    async def aget_history(self, conversation_id: str, max_turns: int = 10) -> List[Dict[str, str]]:
+        """Retrieve conversation history without blocking the event loop."""
+        history, _ = await self.aget_history_with(conversation_id, max_turns)
+        return history
+    
+    async def aformat_for_prompt(self, conversation_id: str, max_turns: int = 20) -> str:
+        """Async counterpart of format_for_prompt."""
+        return self.format_history(await self.aget_history(conversation_id, max_turns))
+    
+    async def aclear_history(self, conversation_id: str) -> bool:
+        """Clear conversation history without blocking the event loop."""
+        try:
+            if self.async_redis_client:
+                with track_dependency("redis", "clear_history"):
+                    async with self.async_redis_client.pipeline(transaction=True) as pipe:
+                        self._queue_version_bump(pipe, conversation_id)
+                        pipe.delete(self.get_conversation_key(conversation_id), self.get_summary_key(conversation_id))
+                        await pipe.execute()
+                if self.history_cache is not None:
+                    self.history_cache.invalidate(conversation_id)
+            else:
+                self.fallback_storage.pop(conversation_id, None)
+                self.fallback_values.pop(self.get_summary_key(conversation_id), None)
+            
+            logger.info(f"Cleared conversation history for {conversation_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Error clearing conversation history: {str(e)}")
+            return False
+    
+    async def aset_value(self, key: str, value: str, conversation_id: Optional[str] = None) -> bool:
+        """Store another per-conversation value with the same expiry as the history.
+
+        Pass `conversation_id` for values that are read together with the history
+        (like the summary), so cached copies of it are kept coherent.
+        """
+        try:
+            if self.async_redis_client and conversation_id is not None:
+                with track_dependency("redis", "set_value"):
+                    async with self.async_redis_client.pipeline(transaction=True) as pipe:
+                        self._queue_version_bump(pipe, conversation_id)
+                        pipe.set(key, value, ex=self.expiry_seconds)
+                        results = await pipe.execute()
+                if self.history_cache is not None:
+                    # Cached as Redis returns it, so hits and misses look the same to callers
+                    raw = value.encode("utf-8") if isinstance(value, str) else value
+                    self.history_cache.apply_value(conversation_id, key, raw, int(results[0]))
+            elif self.async_redis_client:
+                with track_dependency("redis", "set_value"):
+                    await self.async_redis_client.set(key, value, ex=self.expiry_seconds)
+            else:
+                self.fallback_values[key] = value
+            return True
+        except Exception as e:
+            logger.error(f"Error storing {key}: {str(e)}")
+            return False
+    
+    async def aclose(self):
+        """Release the async connection pool."""
+        if self.async_redis_client is not None:
+            close = getattr(self.async_redis_client, "aclose", None) or self.async_redis_client.close
+            await close()
+            await self.async_redis_client.connection_pool.disconnect()
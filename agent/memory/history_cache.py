@@ -0,0 +1,271 @@
+"""In-process L1 cache of conversation histories in front of Redis, kept coherent across workers via pub/sub."""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from services.metrics import registry as metrics_registry
+
+logger = logging.getLogger(__name__)
+
+HISTORY_L1_ENABLED = os.getenv("HISTORY_L1_ENABLED", "true").lower() == "true"
+HISTORY_L1_MAX_CONVERSATIONS = int(os.getenv("HISTORY_L1_MAX_CONVERSATIONS", "1000"))
+HISTORY_L1_MAX_BYTES = int(os.getenv("HISTORY_L1_MAX_BYTES", str(32 * 1024 * 1024)))
+# Safety net for missed invalidations: entries are re-read from Redis at least this often
+HISTORY_L1_TTL = float(os.getenv("HISTORY_L1_TTL", "300"))
+HISTORY_L1_RESUBSCRIBE_INTERVAL = 1.0
+HISTORY_L1_RESUBSCRIBE_MAX_INTERVAL = 30.0
+
+# Every history write publishes "<worker id>|<conversation id>" here
+HISTORY_INVALIDATION_CHANNEL = "conversation:history:invalidations"
+
+# Identifies this process in invalidation messages, so it can skip its own writes
+WORKER_ID = uuid.uuid4().hex[:12]
+
+HISTORY_L1_REQUESTS = metrics_registry.counter(
+    "eva_history_l1_requests_total", "Conversation history reads by L1 result (hit, miss, bypass).", ("result",))
+HISTORY_L1_INVALIDATIONS = metrics_registry.counter(
+    "eva_history_l1_invalidations_total", "L1 history entries dropped because another worker wrote the conversation.")
+
+
+def invalidation_message(conversation_id: str, worker_id: str = WORKER_ID) -> str:
+    return f"{worker_id}|{conversation_id}"
+
+
+class HistoryEntry:
+    """Full stored history of one conversation, plus other per-conversation values read with it."""
+
+    __slots__ = ("items", "values", "version", "size", "expires_at")
+
+    def __init__(self, items: List[Dict[str, str]], values: Dict[str, Any], version: int, size: int, expires_at: float):
+        self.items = items
+        self.values = values
+        self.version = version
+        self.size = size
+        self.expires_at = expires_at
+
+
+class HistoryCache:
+    """Bounded LRU of conversation histories held in this worker.
+
+    Entries hold the whole stored list (ConversationMemory caps it), so any tail
+    length can be served from memory. They are capped by count and by approximate
+    size in bytes, and expire after `ttl` seconds.
+
+    Coherence:
+    - Every write increments `conversation:{id}:version` and publishes an
+      invalidation in the same MULTI/EXEC (see ConversationMemory).
+    - This worker's own writes update the entry in place when the returned version
+      is exactly one ahead of the cached one; otherwise the entry is dropped.
+    - Invalidations from other workers drop the entry. An epoch per conversation
+      stops a read that raced with an invalidation from storing stale data.
+    - The cache is only used while the invalidation subscription is live. It is
+      emptied whenever the subscription is (re)established, since messages may
+      have been missed in between.
+    """
+
+    def __init__(self, redis_client=None, max_conversations: int = HISTORY_L1_MAX_CONVERSATIONS,
+                 max_bytes: int = HISTORY_L1_MAX_BYTES, ttl: float = HISTORY_L1_TTL,
+                 enabled: bool = HISTORY_L1_ENABLED, worker_id: str = WORKER_ID):
+        self.redis = redis_client
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled and redis_client is not None
+        self.worker_id = worker_id
+        self._entries: "OrderedDict[str, HistoryEntry]" = OrderedDict()
+        self._bytes = 0
+        self._epochs: "OrderedDict[str, int]" = OrderedDict()
+        self._subscribed = False
+        self._listener: Optional[asyncio.Task] = None
+        self._prefetches: set = set()
+        self._stats = {"hits": 0, "misses": 0, "bypassed": 0, "invalidations": 0, "evictions": 0}
+
+    @property
+    def active(self) -> bool:
+        return self.enabled and self._subscribed
+
+    # ----- Entries -----
+
+    def _drop(self, conversation_id: str):
+        entry = self._entries.pop(conversation_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _bump_epoch(self, conversation_id: str):
+        self._epochs[conversation_id] = self._epochs.get(conversation_id, 0) + 1
+        self._epochs.move_to_end(conversation_id)
+        while len(self._epochs) > self.max_conversations * 4:
+            self._epochs.popitem(last=False)
+
+    def epoch(self, conversation_id: str) -> int:
+        """Snapshot to pass to `put`, taken before reading from Redis."""
+        return self._epochs.get(conversation_id, 0)
+
+    def _enforce_limits(self):
+        while self._entries and (len(self._entries) > self.max_conversations or self._bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self._stats["evictions"] += 1
+
+    def get(self, conversation_id: str, max_turns: int,
+            extra_keys: Iterable[str] = ()) -> Optional[Tuple[List[Dict[str, str]], Dict[str, Any]]]:
+        """Return (history tail, extra values) from memory, or None on a miss."""
+        if not self.active:
+            self._stats["bypassed"] += 1
+            HISTORY_L1_REQUESTS.inc(result="bypass")
+            return None
+        entry = self._entries.get(conversation_id)
+        extra_keys = list(extra_keys)
+        if (entry is None or entry.expires_at <= time.monotonic()
+                or any(key not in entry.values for key in extra_keys)):
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._drop(conversation_id)
+            self._stats["misses"] += 1
+            HISTORY_L1_REQUESTS.inc(result="miss")
+            return None
+        self._entries.move_to_end(conversation_id)
+        self._stats["hits"] += 1
+        HISTORY_L1_REQUESTS.inc(result="hit")
+        items = entry.items[-max_turns:] if max_turns > 0 else entry.items
+        return list(items), {key: entry.values[key] for key in extra_keys}
+
+    def put(self, conversation_id: str, items: List[Dict[str, str]], values: Dict[str, Any], version: int,
+            size: int, epoch: int):
+        """Store a history read from Redis, unless the conversation was invalidated since `epoch`."""
+        if not self.active or self.epoch(conversation_id) != epoch:
+            return
+        if size > self.max_bytes:
+            return
+        current = self._entries.get(conversation_id)
+        if current is not None and current.version == version:
+            values = {**current.values, **values}
+        self._drop(conversation_id)
+        self._entries[conversation_id] = HistoryEntry(items, values, version, size, time.monotonic() + self.ttl)
+        self._bytes += size
+        self._enforce_limits()
+
+    def apply_append(self, conversation_id: str, exchange: Dict[str, str], new_version: int, size: int,
+                     max_items: int):
+        """Reflect this worker's own append, or drop the entry if another write came in between."""
+        self._bump_epoch(conversation_id)
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return
+        if entry.version != new_version - 1:
+            self._drop(conversation_id)
+            return
+        entry.items.append(exchange)
+        entry.size += size
+        self._bytes += size
+        if len(entry.items) > max_items:
+            del entry.items[:-max_items]  # Size is approximate after trimming; the TTL refill corrects it
+        entry.version = new_version
+        self._entries.move_to_end(conversation_id)
+        self._enforce_limits()
+
+    def apply_value(self, conversation_id: str, key: str, value: Any, new_version: int):
+        """Reflect this worker's own write of another per-conversation value."""
+        self._bump_epoch(conversation_id)
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return
+        if entry.version != new_version - 1:
+            self._drop(conversation_id)
+            return
+        entry.values[key] = value
+        entry.version = new_version
+
+    def invalidate(self, conversation_id: str):
+        self._bump_epoch(conversation_id)
+        self._drop(conversation_id)
+
+    def clear(self):
+        self._entries.clear()
+        self._epochs.clear()
+        self._bytes = 0
+
+    # ----- Invalidation subscription -----
+
+    def handle_invalidation(self, data: Any):
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", errors="replace")
+        worker_id, _, conversation_id = str(data).partition("|")
+        if not conversation_id or worker_id == self.worker_id:
+            return  # Own writes are applied locally
+        self._bump_epoch(conversation_id)
+        if conversation_id in self._entries:
+            self._drop(conversation_id)
+            self._stats["invalidations"] += 1
+            HISTORY_L1_INVALIDATIONS.inc()
+
+    async def _listen(self):
+        delay = HISTORY_L1_RESUBSCRIBE_INTERVAL
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.redis.pubsub()
+                await pubsub.subscribe(HISTORY_INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "subscribe":
+                        # Anything cached before now may have missed invalidations
+                        self.clear()
+                        self._subscribed = True
+                        delay = HISTORY_L1_RESUBSCRIBE_INTERVAL
+                        logger.info(f"History L1 cache subscribed to invalidations (worker {self.worker_id})")
+                    elif message["type"] == "message":
+                        self.handle_invalidation(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"History L1 invalidation subscription failed: {str(e)}. Bypassing L1 until it recovers.")
+            finally:
+                self._subscribed = False
+                if pubsub is not None:
+                    try:
+                        close = getattr(pubsub, "aclose", None) or pubsub.close
+                        await close()
+                    except Exception:
+                        pass
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, HISTORY_L1_RESUBSCRIBE_MAX_INTERVAL)
+
+    async def start(self):
+        """Start listening for invalidations; the cache serves reads once subscribed."""
+        if self.enabled and self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        for task in list(self._prefetches):
+            task.cancel()
+        self.clear()
+
+    def track_prefetch(self, task: asyncio.Task):
+        """Keep a strong reference to a background prefetch until it finishes."""
+        self._prefetches.add(task)
+        task.add_done_callback(self._prefetches.discard)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "active": self.active,
+            "worker_id": self.worker_id,
+            "conversations": len(self._entries),
+            "max_conversations": self.max_conversations,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hit_rate": self._stats["hits"] / lookups if lookups else 0.0
+        }
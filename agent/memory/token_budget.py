@@ -0,0 +1,202 @@
+"""Token-budgeted conversation history with a rolling summary of older turns."""
+
+import json
+import asyncio
+import logging
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import tiktoken
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from memory.conversation_memory import ConversationMemory
+from services.governor import get_llm_governor
+from services.metrics import track_llm_call
+from services.model_routing import get_model_router
+from services.resilience import get_llm_resilience
+from services.usage import get_usage_tracker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENCODING = "cl100k_base"
+CHARS_PER_TOKEN = 4  # Rough estimate used only when no tiktoken encoding can be loaded
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a software professional and an ethics assistant.
+Update the existing summary with the new exchanges. Keep the user's situation, decisions, practice scenarios,
+feedback received and any open questions. Drop pleasantries and repetition. Write plain prose, at most {max_words} words."""
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: Optional[str] = None):
+    """Return the tiktoken encoding for a model, falling back to cl100k_base for unknown models.
+
+    Returns None if the encoding files cannot be loaded (e.g. no network on first use).
+    """
+    try:
+        if model_name:
+            try:
+                return tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                logger.debug(f"No tiktoken encoding registered for {model_name}, using {DEFAULT_ENCODING}")
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        logger.error(f"Could not load tiktoken encoding: {str(e)}. Estimating token counts from length.")
+        return None
+
+
+def count_tokens(text: str, model_name: Optional[str] = None) -> int:
+    """Count the tokens in a string for the given model."""
+    if not text:
+        return 0
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model_name: Optional[str] = None) -> str:
+    """Cut a string down to at most max_tokens tokens."""
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+class TokenBudgetedHistory:
+    """Formats conversation history to fit a token budget.
+
+    The most recent exchanges are kept verbatim, newest first, until the budget is
+    used up. Everything older is represented by a rolling summary stored under
+    `conversation:{id}:summary` next to the history list. The summary records the
+    timestamp of the newest exchange it covers; once at least `min_stale_turns`
+    folded exchanges are newer than that, a background task folds them into the
+    summary. Requests never wait for the summarizer, so the prompt size stays
+    roughly constant however long the conversation gets.
+    """
+
+    def __init__(self, memory: ConversationMemory, llm_provider: Callable[[], Any],
+                 token_budget: int = 1500, summary_token_limit: int = 300,
+                 min_stale_turns: int = 2, model_name: Optional[str] = None):
+        """
+        Args:
+            memory: Conversation store holding the history and the summary.
+            llm_provider: Callable returning the chat model used for summaries.
+            token_budget: Default number of tokens for summary plus verbatim turns.
+            summary_token_limit: Maximum size of the stored summary.
+            min_stale_turns: Number of unsummarized folded turns that triggers a refresh.
+            model_name: Model whose tokenizer is used for counting.
+        """
+        self.memory = memory
+        self.llm_provider = llm_provider
+        self.token_budget = token_budget
+        self.summary_token_limit = summary_token_limit
+        self.min_stale_turns = min_stale_turns
+        self.model_name = model_name
+        self._refresh_tasks: Dict[str, asyncio.Task] = {}
+
+    def _exchange_tokens(self, exchange: Dict[str, str]) -> int:
+        return count_tokens(f"USER: {exchange.get('user', '')}\nASSISTANT: {exchange.get('assistant', '')}\n\n",
+                            self.model_name) + 12  # Per-exchange header
+
+    def _load_summary(self, raw: Optional[Any]) -> Dict[str, Any]:
+        if not raw:
+            return {}
+        try:
+            return json.loads(raw)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Ignoring unreadable conversation summary: {str(e)}")
+            return {}
+
+    def split_history(self, history: List[Dict[str, str]], budget: int) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+        """Split oldest-first history into (folded, verbatim) so the verbatim tail fits the budget."""
+        used = 0
+        split = len(history)
+        while split > 0:
+            cost = self._exchange_tokens(history[split - 1])
+            if used + cost > budget:
+                break
+            used += cost
+            split -= 1
+        return history[:split], history[split:]
+
+    async def aformat_for_prompt(self, conversation_id: str, token_budget: Optional[int] = None) -> str:
+        """Return the summary block plus as many recent exchanges as fit in the budget."""
+        budget = token_budget or self.token_budget
+        summary_key = self.memory.get_summary_key(conversation_id)
+        history, extras = await self.memory.aget_history_with(conversation_id, 0, extra_keys=[summary_key])
+        summary = self._load_summary(extras.get(summary_key))
+
+        summary_text = summary.get("summary", "")
+        summary_tokens = summary.get("tokens", count_tokens(summary_text, self.model_name))
+        folded, verbatim = self.split_history(history, max(budget - summary_tokens, 0))
+
+        covered_until = summary.get("covered_until", "")
+        stale = [exchange for exchange in folded if exchange.get("timestamp", "") > covered_until]
+        if len(stale) >= self.min_stale_turns:
+            self.schedule_refresh(conversation_id, summary, stale)
+
+        logger.info(f"History for {conversation_id}: {len(verbatim)} verbatim turns, "
+                    f"{len(folded)} folded ({len(stale)} not yet summarized), summary {summary_tokens} tokens")
+
+        formatted = ""
+        if folded and summary_text:
+            formatted += f"===== SUMMARY OF EARLIER CONVERSATION =====\n\n{summary_text}\n\n"
+        return formatted + self.memory.format_history(verbatim)
+
+    def schedule_refresh(self, conversation_id: str, summary: Dict[str, Any], stale: List[Dict[str, str]]):
+        """Start a background summary refresh unless one is already running for the conversation."""
+        task = self._refresh_tasks.get(conversation_id)
+        if task and not task.done():
+            return
+        task = asyncio.create_task(self.refresh_summary(conversation_id, summary, stale))
+        self._refresh_tasks[conversation_id] = task
+        task.add_done_callback(lambda t: self._refresh_tasks.pop(conversation_id, None)
+                               if self._refresh_tasks.get(conversation_id) is t else None)
+
+    async def refresh_summary(self, conversation_id: str, summary: Dict[str, Any],
+                              stale: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+        """Fold the stale exchanges into the stored summary."""
+        try:
+            transcript = "\n\n".join(f"USER: {e.get('user', '')}\nASSISTANT: {e.get('assistant', '')}" for e in stale)
+            messages = [
+                SystemMessage(content=SUMMARY_PROMPT.format(max_words=int(self.summary_token_limit * 0.7))),
+                HumanMessage(content=f"EXISTING SUMMARY:\n{summary.get('summary') or '(none)'}\n\nNEW EXCHANGES:\n{transcript}")
+            ]
+            router = get_model_router()
+            route = router.route("conversation_summary")
+            llm = router.configure(self.llm_provider(), "conversation_summary")
+            async with get_llm_governor().slot("offline"):
+                with track_llm_call("conversation_summary"), router.timed("conversation_summary", route.model):
+                    async with get_usage_tracker().atrack("conversation_summary"):
+                        response = await get_llm_resilience().arun(
+                            route.model, lambda: llm.ainvoke(messages), deadline=route.timeout, hedge=False)
+            text = truncate_to_tokens(response.content.strip(), self.summary_token_limit, self.model_name)
+            updated = {
+                "summary": text,
+                "tokens": count_tokens(text, self.model_name),
+                "covered_until": max(e.get("timestamp", "") for e in stale),
+                "updated_at": datetime.now().isoformat()
+            }
+            await self.memory.aset_value(self.memory.get_summary_key(conversation_id), json.dumps(updated),
+                                         conversation_id=conversation_id)
+            logger.info(f"Refreshed conversation summary for {conversation_id} with {len(stale)} exchanges")
+            return updated
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error refreshing conversation summary for {conversation_id}: {str(e)}")
+            return None
+
+    async def aclose(self, timeout: float = 5.0):
+        """Give running summary refreshes a chance to finish, then cancel the rest."""
+        tasks = [task for task in self._refresh_tasks.values() if not task.done()]
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,7 @@
+"""
+Prompts package holding the versioned system prompts.
+"""
+
+from prompts.registry import Prompt, PromptRegistry, get_prompt_registry
+
+__all__ = ['Prompt', 'PromptRegistry', 'get_prompt_registry']
@@ -0,0 +1,129 @@
+"""Versioned system prompts loaded once at startup, and cache-friendly message assembly."""
+
+import hashlib
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from memory.token_budget import count_tokens
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = Path(__file__).parent / "templates"
+
+# Provider-side prompt caching only applies to prompts with at least this many identical leading tokens
+MIN_CACHEABLE_PREFIX_TOKENS = 1024
+
+HISTORY_HEADER = """
+===== IMPORTANT CONVERSATION HISTORY =====
+The following is your conversation history with this user.
+You MUST reference relevant details from this history in your response.
+You MUST acknowledge information they've previously shared.
+
+"""
+
+HISTORY_FOOTER = """
+
+===== END OF CONVERSATION HISTORY =====
+"""
+
+# Prompt used for each request_type of /api/v1/conversation/generate-response. Request types
+# without a dedicated prompt reuse the closest existing one; anything else gets initial_query.
+GENERATE_RESPONSE_PROMPTS = {
+    "follow_up": "default_system",
+    "elaborate_context": "default_system",
+    "post_practice": "post_feedback",
+    "post_feedback": "post_feedback",
+}
+
+
+@dataclass(frozen=True)
+class Prompt:
+    """A system prompt with its content version and token count."""
+    name: str
+    text: str
+    version: str
+    token_count: int
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@{self.version}"
+
+
+class PromptRegistry:
+    """Holds every system prompt, read from `prompts/templates/<name>.txt`.
+
+    Prompts are read once and never rebuilt per request, so the system message
+    sent to the provider is byte-identical for every call that uses it. The
+    version is a short hash of the text, which lets caches keyed on a prompt
+    (such as the semantic response cache) invalidate themselves when it changes.
+    """
+
+    def __init__(self, template_dir: Path = TEMPLATE_DIR, model_name: Optional[str] = "gpt-4o-mini"):
+        self.template_dir = Path(template_dir)
+        self.model_name = model_name
+        self.history_header_tokens = count_tokens(HISTORY_HEADER, model_name)
+        self._prompts: Dict[str, Prompt] = {}
+        self.load()
+
+    def load(self):
+        """(Re)read all templates from disk."""
+        prompts = {}
+        for path in sorted(self.template_dir.glob("*.txt")):
+            text = path.read_text(encoding="utf-8")
+            prompts[path.stem] = Prompt(
+                name=path.stem,
+                text=text,
+                version=hashlib.sha256(text.encode("utf-8")).hexdigest()[:12],
+                token_count=count_tokens(text, self.model_name)
+            )
+        self._prompts = prompts
+        logger.info("Loaded prompts: " + ", ".join(f"{p.key} ({p.token_count} tokens)" for p in prompts.values()))
+
+    def get(self, name: str) -> Prompt:
+        try:
+            return self._prompts[name]
+        except KeyError:
+            raise KeyError(f"Unknown prompt '{name}'. Available: {', '.join(sorted(self._prompts))}")
+
+    def names(self) -> List[str]:
+        return sorted(self._prompts)
+
+    def for_generate_response(self, request_type: Optional[str]) -> Prompt:
+        """Prompt for a request_type of /api/v1/conversation/generate-response."""
+        return self.get(GENERATE_RESPONSE_PROMPTS.get(request_type, "initial_query"))
+
+    def build_messages(self, prompt: Prompt, conversation_context: str, user_query: str) -> List:
+        """Assemble system prompt, history (as a separate system message) and user query.
+
+        The static system prompt always comes first and the history block starts with
+        a fixed header, so everything up to the history itself is a stable prefix.
+        """
+        messages = [SystemMessage(content=prompt.text)]
+        if conversation_context:
+            messages.append(SystemMessage(content=f"{HISTORY_HEADER}{conversation_context}{HISTORY_FOOTER}"))
+        messages.append(HumanMessage(content=user_query))
+        return messages
+
+    def log_prompt_tokens(self, prompt: Prompt, messages: List, label: str = "") -> Dict[str, int]:
+        """Log total prompt tokens and the length of the cache-eligible static prefix."""
+        total = sum(count_tokens(message.content, self.model_name) for message in messages)
+        prefix = prompt.token_count + (self.history_header_tokens if len(messages) > 2 else 0)
+        cacheable = prefix >= MIN_CACHEABLE_PREFIX_TOKENS
+        logger.info(f"Prompt {prompt.key}{' for ' + label if label else ''}: {total} prompt tokens, "
+                    f"{prefix} static prefix tokens ({'cache-eligible' if cacheable else 'below caching minimum'})")
+        return {"prompt_tokens": total, "prefix_tokens": prefix}
+
+
+_registry: Optional[PromptRegistry] = None
+
+
+def get_prompt_registry() -> PromptRegistry:
+    """Return the process-wide registry, loading it on first use."""
+    global _registry
+    if _registry is None:
+        _registry = PromptRegistry()
+    return _registry
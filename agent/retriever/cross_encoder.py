@@ -5,6 +5,8 @@ import os
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 
+from services.embedding_cache import CachedEmbeddings
+
 logger = logging.getLogger(__name__)
 
 class ReRanker:
@@ -17,10 +19,11 @@ class ReRanker:
             if cache_dir:
                 os.makedirs(cache_dir, exist_ok=True)
                 
-            self.model = OpenAIEmbeddings(
+            # Results re-ranked again (and repeated queries) reuse cached embeddings
+            self.model = CachedEmbeddings(OpenAIEmbeddings(
                 model=model_name,
                 cache_folder=cache_dir if cache_dir else None
-            )
+            ), model_name=model_name)
             logger.info(f"Initialized OpenAI re-ranker model: {model_name}")
             
         except Exception as e:
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 import os
 import sys
+import asyncio
+import argparse
 import logging
 from pathlib import Path
 import PyPDF2
@@ -29,6 +31,11 @@ from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+# The combined index re-embeds the per-category chunks; the embedding cache serves those from memory
+from services.embedding_cache import CachedEmbeddings
+from services.usage import UsageTracker, get_usage_tracker, set_usage_tracker
+from memory.conversation_memory import create_redis_clients
+
 # Define paths
 DATA_RAW_DIR = Path(project_root) / "data" / "raw"
 DATA_PROCESSED_DIR = Path(project_root) / "data" / "processed"
@@ -164,6 +171,15 @@ def create_chunks(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     logger.info(f"Created a total of {len(chunks)} chunks")
     return chunks
 
+def presynthesize_chunk_cards(chunks: List[Dict[str, Any]], model_name: str = "gpt-4o-mini", concurrency: int = 8) -> int:
+    """Pre-synthesize a guideline/case study card for each chunk and store it in the chunk metadata."""
+    from langchain_openai import ChatOpenAI
+    from agents.artifact_synthesis import presynthesize_cards
+
+    llm = ChatOpenAI(model_name=model_name, temperature=0, openai_api_key=openai_api_key)
+    with get_usage_tracker().track("presynthesis"):
+        return asyncio.run(presynthesize_cards(chunks, llm, model_name, concurrency=concurrency))
+
 def create_faiss_index(chunks: List[Dict[str, Any]], category: str):
     """Create a FAISS index for a category."""
     logger.info(f"Creating FAISS index for category: {category}")
@@ -174,7 +190,7 @@ def create_faiss_index(chunks: List[Dict[str, Any]], category: str):
         metadatas = [chunk["metadata"] for chunk in chunks]
         
         # Initialize embeddings with API key
-        embeddings = OpenAIEmbeddings(api_key=openai_api_key)
+        embeddings = CachedEmbeddings(OpenAIEmbeddings(api_key=openai_api_key))
         
         # Create FAISS index
         index_dir = DATA_PROCESSED_DIR / category
@@ -217,7 +233,7 @@ def create_combined_index(all_chunks: List[Dict[str, Any]]):
         metadatas = [chunk["metadata"] for chunk in all_chunks]
         
         # Initialize embeddings with API key
-        embeddings = OpenAIEmbeddings(api_key=openai_api_key)
+        embeddings = CachedEmbeddings(OpenAIEmbeddings(api_key=openai_api_key))
         
         # Create FAISS index
         index_dir = DATA_PROCESSED_DIR / "combined"
@@ -251,9 +267,23 @@ def create_combined_index(all_chunks: List[Dict[str, Any]]):
         logger.error(f"Error creating combined FAISS index: {str(e)}")
         return False
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Process the knowledge base PDFs into FAISS indexes")
+    parser.add_argument("--presynthesize-cards", action="store_true",
+                        default=os.getenv("PRESYNTHESIZE_CARDS", "false").lower() == "true",
+                        help="Synthesize a card for every guideline/case study chunk and store it in the index metadata")
+    parser.add_argument("--synthesis-model", default="gpt-4o-mini", help="Model used to pre-synthesize cards")
+    parser.add_argument("--synthesis-concurrency", type=int, default=8, help="Concurrent synthesis calls")
+    return parser.parse_args()
+
 def main():
     """Process all categories and create FAISS indexes."""
+    args = parse_args()
     logger.info("Starting knowledge base processing")
+
+    # Embedding and card synthesis spend lands in the same usage rollups as the API's
+    redis_client, _ = create_redis_clients(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    set_usage_tracker(UsageTracker(redis_client))
     
     all_chunks = []
     
@@ -268,6 +298,8 @@ def main():
         
         # Create chunks from the documents
         chunks = create_chunks(documents)
+        if args.presynthesize_cards:
+            presynthesize_chunk_cards(chunks, args.synthesis_model, args.synthesis_concurrency)
         all_chunks.extend(chunks)
         
         # Create FAISS index for the category
@@ -0,0 +1,14 @@
+"""
+Services package containing shared infrastructure used by the API layer.
+"""
+
+from services.backend_client import get_backend_client, close_backend_client
+from services.semantic_cache import SemanticResponseCache
+from services.job_queue import Job, JobWorkerPool, create_job_queue
+from services.embedding_cache import CachedEmbeddings, EmbeddingCache
+from services.governor import AdmissionRejected, LLMGovernor
+from services.resilience import LLMResilience, LLMUnavailable
+
+__all__ = ['get_backend_client', 'close_backend_client', 'SemanticResponseCache',
+           'Job', 'JobWorkerPool', 'create_job_queue', 'CachedEmbeddings', 'EmbeddingCache',
+           'AdmissionRejected', 'LLMGovernor', 'LLMResilience', 'LLMUnavailable']
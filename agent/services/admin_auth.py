@@ -0,0 +1,27 @@
+"""Shared-secret protection for management endpoints (usage data and budget overrides)."""
+
+import os
+import hmac
+import logging
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Required in the X-Admin-Key header of management requests; when unset those endpoints are disabled
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")
+
+
+def check_admin_key(provided: Optional[str], expected: str = ADMIN_API_KEY):
+    """Raise 403 unless `provided` matches the admin key. Fails closed when no key is configured."""
+    if not expected:
+        raise HTTPException(status_code=403, detail="Management endpoints are disabled: ADMIN_API_KEY is not set")
+    if not provided or not hmac.compare_digest(provided.encode("utf-8"), expected.encode("utf-8")):
+        logger.warning("Rejected management request with a missing or invalid X-Admin-Key")
+        raise HTTPException(status_code=403, detail="Invalid or missing X-Admin-Key")
+
+
+async def require_admin(x_admin_key: Optional[str] = Header(default=None)):
+    """FastAPI dependency for management endpoints."""
+    check_admin_key(x_admin_key)
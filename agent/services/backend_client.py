@@ -0,0 +1,81 @@
+"""Shared, pooled async HTTP client for calls to the Java backend."""
+
+import os
+import logging
+from typing import Optional
+
+import httpx
+
+from services.metrics import record_dependency_error, track_dependency
+
+logger = logging.getLogger(__name__)
+
+# Pool and timeout settings, overridable via environment
+BACKEND_MAX_CONNECTIONS = int(os.getenv("BACKEND_MAX_CONNECTIONS", "100"))
+BACKEND_MAX_KEEPALIVE = int(os.getenv("BACKEND_MAX_KEEPALIVE", "20"))
+BACKEND_KEEPALIVE_EXPIRY = float(os.getenv("BACKEND_KEEPALIVE_EXPIRY", "30"))
+BACKEND_CONNECT_TIMEOUT = float(os.getenv("BACKEND_CONNECT_TIMEOUT", "3"))
+BACKEND_TIMEOUT = float(os.getenv("BACKEND_TIMEOUT", "10"))
+BACKEND_HTTP2 = os.getenv("BACKEND_HTTP2", "false").lower() == "true"
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional 'h2' package (pip install httpx[http2])."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class InstrumentedTransport(httpx.AsyncHTTPTransport):
+    """Pooled transport that counts backend requests and failures (transport errors and 5xx) for /metrics."""
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        with track_dependency("backend", request.method):
+            response = await super().handle_async_request(request)
+        if response.status_code >= 500:
+            record_dependency_error("backend", request.method)
+        return response
+
+
+def create_backend_client() -> httpx.AsyncClient:
+    """Create an AsyncClient with keep-alive pooling and the configured limits."""
+    http2 = BACKEND_HTTP2
+    if http2 and not _http2_available():
+        logger.warning("BACKEND_HTTP2 is enabled but 'h2' is not installed. Falling back to HTTP/1.1.")
+        http2 = False
+
+    client = httpx.AsyncClient(
+        transport=InstrumentedTransport(
+            limits=httpx.Limits(
+                max_connections=BACKEND_MAX_CONNECTIONS,
+                max_keepalive_connections=BACKEND_MAX_KEEPALIVE,
+                keepalive_expiry=BACKEND_KEEPALIVE_EXPIRY
+            ),
+            http2=http2
+        ),
+        timeout=httpx.Timeout(BACKEND_TIMEOUT, connect=BACKEND_CONNECT_TIMEOUT)
+    )
+    logger.info(f"Created backend HTTP client (max_connections={BACKEND_MAX_CONNECTIONS}, "
+                f"keepalive={BACKEND_MAX_KEEPALIVE}, http2={http2})")
+    return client
+
+
+def get_backend_client() -> httpx.AsyncClient:
+    """Return the shared backend client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_backend_client()
+    return _client
+
+
+async def close_backend_client():
+    """Close the shared client and its pooled connections (called on shutdown)."""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        logger.info("Closed backend HTTP client")
+    _client = None
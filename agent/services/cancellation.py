@@ -0,0 +1,77 @@
+"""Stop work for requests whose client has gone away."""
+
+import os
+import asyncio
+import logging
+import functools
+from typing import Any, Awaitable, Callable
+
+from starlette.requests import Request
+
+from services.metrics import current_route, registry as metrics_registry
+
+logger = logging.getLogger(__name__)
+
+CANCEL_ON_DISCONNECT = os.getenv("CANCEL_ON_DISCONNECT", "true").lower() == "true"
+# How often a running handler checks whether its client is still connected
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.25"))
+
+REQUESTS_CANCELLED = metrics_registry.counter(
+    "eva_requests_cancelled_total", "Requests whose work was cancelled because the client disconnected.",
+    ("route", "kind"))
+
+
+class ClientDisconnected(Exception):
+    """The client closed the connection before the response was ready; its work was cancelled."""
+
+
+def record_cancellation(kind: str, route: str = None):
+    """Count an abandoned request. `kind` is "request" (plain response) or "stream" (SSE)."""
+    REQUESTS_CANCELLED.inc(route=route or current_route(), kind=kind)
+
+
+async def run_until_disconnected(request: Request, work: Awaitable[Any],
+                                 poll_interval: float = DISCONNECT_POLL_INTERVAL) -> Any:
+    """Await `work`, cancelling it if the client disconnects first.
+
+    Cancellation reaches whatever the work is awaiting (the LLM request, a Redis
+    write, a job submission), and its context managers run, so admission slots
+    are released. Raises ClientDisconnected after the work has been cancelled.
+    """
+    task = asyncio.ensure_future(work)
+    if not CANCEL_ON_DISCONNECT:
+        return await task
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                break
+    except BaseException:
+        task.cancel()
+        raise
+
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        logger.error(f"Error while cancelling abandoned request {request.url.path}: {str(e)}")
+    record_cancellation("request")
+    raise ClientDisconnected(f"Client disconnected from {request.url.path}")
+
+
+def cancel_on_disconnect(endpoint: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """Decorator for async endpoints taking a `request: Request` parameter: stop the handler
+    when the client disconnects. FastAPI still sees the endpoint's own signature."""
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        request = kwargs.get("request")
+        if request is None:
+            return await endpoint(*args, **kwargs)
+        # Read the body first: a disconnect check would otherwise consume body messages
+        await request.body()
+        return await run_until_disconnected(request, endpoint(*args, **kwargs))
+    return wrapper
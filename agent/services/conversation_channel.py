@@ -0,0 +1,100 @@
+"""Per-connection session state for the WebSocket conversation channel."""
+
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from memory.conversation_memory import ConversationMemory
+
+logger = logging.getLogger(__name__)
+
+# Turns of history kept in memory per connection (the prompt uses the newest `history_limit` of them)
+CHANNEL_HISTORY_TURNS = int(os.getenv("CHANNEL_HISTORY_TURNS", "50"))
+# Seconds to wait for pending history saves when a connection closes
+CHANNEL_FLUSH_TIMEOUT = float(os.getenv("CHANNEL_FLUSH_TIMEOUT", "5"))
+
+# Session settings a client may change with a "configure" message, and their defaults
+CHANNEL_SETTINGS = {
+    "requestType": "initial_query",
+    "managerType": None,
+    "temperature": 0.7,
+    "includeHistory": True,
+    "historyLimit": 20,
+}
+
+
+class ConversationChannel:
+    """State of one conversation for the lifetime of a WebSocket connection.
+
+    History is read from ConversationMemory once, when the connection opens, and
+    then kept here: each completed turn is appended locally and saved to Redis in
+    the background, so later turns build their prompt without a Redis round trip.
+    Chat clients are created once per prompt and route and reused.
+
+    The local history does not see turns written through the HTTP endpoints while
+    the socket is open; clients should use one channel per conversation at a time.
+    """
+
+    def __init__(self, conversation_id: str, memory: ConversationMemory, user_id: Optional[str] = None,
+                 max_turns: int = CHANNEL_HISTORY_TURNS):
+        self.conversation_id = conversation_id
+        self.memory = memory
+        self.user_id = user_id
+        self.max_turns = max_turns
+        self.settings: Dict[str, Any] = dict(CHANNEL_SETTINGS)
+        self.history: List[Dict[str, str]] = []
+        self.turns = 0
+        self._llms: Dict[Tuple, Any] = {}
+        self._pending_saves: Set[asyncio.Task] = set()
+
+    async def load(self):
+        """Read the recent history once for the connection."""
+        self.history = await self.memory.aget_history(self.conversation_id, self.max_turns)
+
+    def configure(self, updates: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply known settings from a client message; unknown keys are ignored."""
+        for key in CHANNEL_SETTINGS:
+            if key in updates and updates[key] is not None:
+                self.settings[key] = updates[key]
+        return dict(self.settings)
+
+    def context(self) -> str:
+        """Prompt history block from the cached turns, respecting includeHistory and historyLimit."""
+        if not self.settings["includeHistory"]:
+            return ""
+        try:
+            limit = int(self.settings["historyLimit"])
+        except (ValueError, TypeError):
+            limit = CHANNEL_SETTINGS["historyLimit"]
+        return ConversationMemory.format_history(self.history[-limit:] if limit > 0 else self.history)
+
+    def llm_for(self, key: Tuple, factory: Callable[[], Any]) -> Any:
+        """Chat client for a (prompt, route, temperature) key, created on first use."""
+        llm = self._llms.get(key)
+        if llm is None:
+            llm = self._llms[key] = factory()
+        return llm
+
+    def record(self, user_message: str, assistant_message: str) -> str:
+        """Add a completed turn locally and save it to ConversationMemory without waiting.
+
+        Returns the turn's timestamp.
+        """
+        timestamp = datetime.now().isoformat()
+        self.history.append({"user": user_message, "assistant": assistant_message, "timestamp": timestamp})
+        del self.history[:-self.max_turns]
+        self.turns += 1
+        task = asyncio.create_task(self.memory.asave_exchange(self.conversation_id, user_message, assistant_message))
+        self._pending_saves.add(task)
+        task.add_done_callback(self._pending_saves.discard)
+        return timestamp
+
+    async def aclose(self, timeout: float = CHANNEL_FLUSH_TIMEOUT):
+        """Wait for background saves so a turn answered just before disconnecting is not lost."""
+        if not self._pending_saves:
+            return
+        _, pending = await asyncio.wait(set(self._pending_saves), timeout=timeout)
+        if pending:
+            logger.error(f"{len(pending)} history saves for conv {self.conversation_id} did not finish within {timeout}s")
@@ -0,0 +1,301 @@
+"""Shared cache of text embeddings: an in-process LRU in front of an optional Redis tier."""
+
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from services.metrics import track_dependency
+from services.usage import UsageTracker, get_usage_tracker
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "5000"))
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", str(7 * 86400)))
+
+
+def embedding_model_name(embeddings: Any) -> str:
+    """Best-effort model identifier of a LangChain embeddings object."""
+    return str(getattr(embeddings, "model", None) or getattr(embeddings, "model_name", None)
+               or type(embeddings).__name__)
+
+
+class EmbeddingCache:
+    """Embeddings keyed by model and a hash of the text.
+
+    L1 is a per-process LRU of float32 vectors. L2 is Redis (`embedding:{model}:{sha}`
+    holding the raw float32 bytes, with a TTL), shared by every worker. Sync callers
+    use the sync Redis client, async callers the asyncio one; either may be None, in
+    which case only L1 is used. Redis errors are logged and treated as misses.
+    """
+
+    def __init__(self, redis_client=None, async_redis_client=None, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+                 ttl_seconds: int = EMBEDDING_CACHE_TTL, enabled: bool = EMBEDDING_CACHE_ENABLED):
+        self.redis = redis_client
+        self.async_redis = async_redis_client
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "stores": 0, "evictions": 0,
+                       "coalesced": 0, "errors": 0}
+
+    @staticmethod
+    def key(model_name: str, text: str) -> str:
+        return f"embedding:{model_name}:{hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]}"
+
+    def _l1_get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self._stats["l1_hits"] += 1
+            return vector
+
+    def _l1_set(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _from_l2(self, keys: List[str], values: List[Optional[bytes]]) -> Dict[str, np.ndarray]:
+        found = {}
+        for key, value in zip(keys, values):
+            if value is not None:
+                vector = np.frombuffer(value, dtype=np.float32)
+                self._l1_set(key, vector)
+                found[key] = vector
+        self._stats["l2_hits"] += len(found)
+        return found
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Cached vectors for the keys that are present (L1, then the sync Redis client)."""
+        if not self.enabled:
+            return {}
+        found = {key: vector for key in keys if (vector := self._l1_get(key)) is not None}
+        missing = [key for key in keys if key not in found]
+        if missing and self.redis is not None:
+            try:
+                with track_dependency("redis", "embedding_cache_get"):
+                    values = self.redis.mget(missing)
+                found.update(self._from_l2(missing, values))
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Error reading embedding cache from Redis: {str(e)}")
+        self._stats["misses"] += len(keys) - len(found)
+        return found
+
+    async def aget_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Async get_many using the asyncio Redis client."""
+        if not self.enabled:
+            return {}
+        found = {key: vector for key in keys if (vector := self._l1_get(key)) is not None}
+        missing = [key for key in keys if key not in found]
+        if missing and self.async_redis is not None:
+            try:
+                with track_dependency("redis", "embedding_cache_get"):
+                    values = await self.async_redis.mget(missing)
+                found.update(self._from_l2(missing, values))
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Error reading embedding cache from Redis: {str(e)}")
+        self._stats["misses"] += len(keys) - len(found)
+        return found
+
+    def set_many(self, vectors: Dict[str, np.ndarray]):
+        if not self.enabled or not vectors:
+            return
+        for key, vector in vectors.items():
+            self._l1_set(key, vector)
+        self._stats["stores"] += len(vectors)
+        if self.redis is not None:
+            try:
+                with track_dependency("redis", "embedding_cache_set"):
+                    pipe = self.redis.pipeline(transaction=False)
+                    for key, vector in vectors.items():
+                        pipe.set(key, vector.tobytes(), ex=self.ttl_seconds)
+                    pipe.execute()
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Error writing embedding cache to Redis: {str(e)}")
+
+    async def aset_many(self, vectors: Dict[str, np.ndarray]):
+        if not self.enabled or not vectors:
+            return
+        for key, vector in vectors.items():
+            self._l1_set(key, vector)
+        self._stats["stores"] += len(vectors)
+        if self.async_redis is not None:
+            try:
+                with track_dependency("redis", "embedding_cache_set"):
+                    async with self.async_redis.pipeline(transaction=False) as pipe:
+                        for key, vector in vectors.items():
+                            pipe.set(key, vector.tobytes(), ex=self.ttl_seconds)
+                        await pipe.execute()
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Error writing embedding cache to Redis: {str(e)}")
+
+    def clear(self):
+        """Drop the in-process tier (Redis entries expire on their own)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self._stats["l1_hits"] + self._stats["l2_hits"]
+        lookups = hits + self._stats["misses"]
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "backend": "memory+redis" if self.async_redis is not None or self.redis is not None else "memory",
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hit_rate": hits / lookups if lookups else 0.0
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """LangChain `Embeddings` that consults an `EmbeddingCache` before the wrapped model.
+
+    Document batches only send the texts that miss to the model. Concurrent async
+    requests for the same query text share a single model call, so a request that
+    fans out into several searches (guidelines and case studies, say) embeds its
+    query once.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: Optional[EmbeddingCache] = None,
+                 model_name: Optional[str] = None):
+        """
+        Args:
+            embeddings: The embeddings model to wrap.
+            cache: Cache to use; defaults to the process-wide cache at call time.
+            model_name: Model part of the cache key; derived from `embeddings` if omitted.
+        """
+        self.embeddings = embeddings
+        self._cache = cache
+        self.model_name = model_name or embedding_model_name(embeddings)
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        return self._cache or get_embedding_cache()
+
+    def __getattr__(self, name: str):
+        # Expose the wrapped model's attributes (model, client, ...) to callers that inspect them
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def _key(self, text: str) -> str:
+        return EmbeddingCache.key(self.model_name, text)
+
+    def _record_usage(self, texts: List[str], latency_seconds: float):
+        # Only texts that reached the model are billed
+        try:
+            get_usage_tracker().record("embedding", UsageTracker.embedding_usage(texts, self.model_name, latency_seconds))
+        except Exception as e:
+            logger.error(f"Error recording embedding usage: {str(e)}")
+
+    async def _arecord_usage(self, texts: List[str], latency_seconds: float):
+        try:
+            await get_usage_tracker().arecord("embedding",
+                                              UsageTracker.embedding_usage(texts, self.model_name, latency_seconds))
+        except Exception as e:
+            logger.error(f"Error recording embedding usage: {str(e)}")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        cache = self.cache
+        keys = [self._key(text) for text in texts]
+        found = cache.get_many(list(dict.fromkeys(keys)))
+        missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in found))
+        if missing:
+            start = time.perf_counter()
+            computed = {self._key(text): np.asarray(vector, dtype=np.float32)
+                        for text, vector in zip(missing, self.embeddings.embed_documents(missing))}
+            self._record_usage(missing, time.perf_counter() - start)
+            cache.set_many(computed)
+            found.update(computed)
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        cache = self.cache
+        key = self._key(text)
+        vector = cache.get_many([key]).get(key)
+        if vector is None:
+            start = time.perf_counter()
+            vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+            self._record_usage([text], time.perf_counter() - start)
+            cache.set_many({key: vector})
+        return vector.tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        cache = self.cache
+        keys = [self._key(text) for text in texts]
+        found = await cache.aget_many(list(dict.fromkeys(keys)))
+        missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in found))
+        if missing:
+            start = time.perf_counter()
+            computed = {self._key(text): np.asarray(vector, dtype=np.float32)
+                        for text, vector in zip(missing, await self.embeddings.aembed_documents(missing))}
+            await self._arecord_usage(missing, time.perf_counter() - start)
+            await cache.aset_many(computed)
+            found.update(computed)
+        return [found[key].tolist() for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            try:
+                vector = await asyncio.shield(pending)
+                self.cache._stats["coalesced"] += 1
+                return vector.tolist()
+            except Exception:
+                pass  # The shared call failed; embed independently below
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            cache = self.cache
+            vector = (await cache.aget_many([key])).get(key)
+            if vector is None:
+                start = time.perf_counter()
+                vector = np.asarray(await self.embeddings.aembed_query(text), dtype=np.float32)
+                await self._arecord_usage([text], time.perf_counter() - start)
+                await cache.aset_many({key: vector})
+            future.set_result(vector)
+            return vector.tolist()
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError("Embedding request was cancelled"))
+            future.exception()  # Mark retrieved so an unawaited failure is not logged
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Return the process-wide embedding cache, creating an in-process-only one on first use."""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+
+def set_embedding_cache(cache: Optional[EmbeddingCache]):
+    """Install (or reset, with None) the process-wide embedding cache."""
+    global _embedding_cache
+    _embedding_cache = cache
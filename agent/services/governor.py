@@ -0,0 +1,288 @@
+"""Admission control for LLM calls: a process-wide concurrency limit with priority classes,
+per-user token buckets and a bounded wait queue."""
+
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from services.metrics import registry as metrics_registry
+
+logger = logging.getLogger(__name__)
+
+LLM_GOVERNOR_ENABLED = os.getenv("LLM_GOVERNOR_ENABLED", "true").lower() == "true"
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+# Longest an interactive call waits for a slot before it is rejected (background classes wait longer)
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+# Per-user token bucket: sustained LLM calls per minute and burst size (0 disables the limit)
+USER_LLM_CALLS_PER_MINUTE = float(os.getenv("USER_LLM_CALLS_PER_MINUTE", "20"))
+USER_LLM_BURST = int(os.getenv("USER_LLM_BURST", "10"))
+
+# Lower value = served first
+PRIORITIES = {
+    "interactive": 0,  # Chat answers a user is waiting for
+    "feedback": 1,     # Practice feedback and scoring
+    "synthesis": 2,    # Artifact card synthesis
+    "offline": 3,      # Background summaries and other jobs nobody waits on
+}
+
+# Queue wait before rejection, as a multiple of LLM_QUEUE_TIMEOUT
+PRIORITY_WAIT_FACTOR = {"interactive": 1, "feedback": 1, "synthesis": 6, "offline": 30}
+
+ADMISSION_REJECTIONS = metrics_registry.counter(
+    "eva_llm_admission_rejections_total", "LLM calls rejected by admission control.", ("priority", "reason"))
+ADMISSION_WAIT = metrics_registry.histogram(
+    "eva_llm_admission_wait_seconds", "Time LLM calls waited for a concurrency slot.", ("priority",))
+
+
+class AdmissionRejected(Exception):
+    """An LLM call was not admitted. `retry_after` is a suggested wait in seconds."""
+
+    def __init__(self, message: str, retry_after: int, reason: str):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate` tokens per second."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: Optional[float] = None) -> float:
+        """Take one token. Returns 0 on success, else the seconds until one is available."""
+        now = now if now is not None else time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class LLMGovernor:
+    """Limits concurrent LLM calls in this process.
+
+    Callers hold a slot for the duration of a call (`async with governor.slot(...)`).
+    When all slots are busy they wait in a queue ordered by priority class, then
+    arrival; a released slot is handed straight to the first waiter, so later
+    arrivals cannot barge past it. The queue is bounded: when it is full, a new
+    call with a higher priority than the worst waiter evicts that waiter, otherwise
+    the new call is rejected. Waiters that time out are rejected as well.
+
+    Calls attributed to a user also take a token from that user's bucket first,
+    so one user cannot monopolise the slots. Rejections raise `AdmissionRejected`
+    immediately with a Retry-After estimate, which the API turns into a 429.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT, user_calls_per_minute: float = USER_LLM_CALLS_PER_MINUTE,
+                 user_burst: int = USER_LLM_BURST, enabled: bool = LLM_GOVERNOR_ENABLED, max_tracked_users: int = 10000):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.user_rate = user_calls_per_minute / 60.0
+        self.user_burst = user_burst
+        self.enabled = enabled
+        self.max_tracked_users = max_tracked_users
+        self.active = 0
+        self._waiters: List[list] = []  # Heap of [priority, sequence, future, priority name]
+        self._queued = 0
+        self._sequence = itertools.count()
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._avg_hold_seconds = 2.0
+        self._stats = {"admitted": 0, "queued": 0, "rate_limited": 0, "queue_full": 0, "evicted": 0, "timed_out": 0}
+
+    def _retry_after(self) -> int:
+        # Time for the current queue to drain at the observed call duration
+        return max(1, math.ceil((self._queued + 1) * self._avg_hold_seconds / max(self.max_concurrency, 1)))
+
+    def _reject(self, priority: str, reason: str, message: str, retry_after: Optional[int] = None):
+        self._stats[reason] += 1
+        ADMISSION_REJECTIONS.inc(priority=priority, reason=reason)
+        raise AdmissionRejected(message, retry_after or self._retry_after(), reason)
+
+    def _take_user_token(self, user_id: str, priority: str):
+        if self.user_rate <= 0:
+            return
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+            while len(self._buckets) > self.max_tracked_users:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(user_id)
+        wait = bucket.take()
+        if wait:
+            self._reject(priority, "rate_limited", f"Too many requests for user {user_id}", math.ceil(wait))
+
+    def _evict_worst_waiter(self, priority_value: int) -> bool:
+        """Reject the lowest-priority (newest) waiter if it ranks below `priority_value`."""
+        live = [entry for entry in self._waiters if not entry[2].done()]
+        if not live:
+            return False
+        worst = max(live, key=lambda entry: (entry[0], entry[1]))
+        if worst[0] <= priority_value:
+            return False
+        self._stats["evicted"] += 1
+        ADMISSION_REJECTIONS.inc(priority=worst[3], reason="evicted")
+        worst[2].set_exception(AdmissionRejected("Evicted from the LLM queue by a higher-priority call",
+                                                 self._retry_after(), "evicted"))
+        self._queued -= 1
+        return True
+
+    def check(self, priority: str = "interactive", user_id: Optional[str] = None):
+        """Fail fast, without waiting, if a call would be rejected right now.
+
+        Takes the user's rate-limit token. Used by streaming endpoints to return a
+        429 before the response starts; the call itself then uses `slot(..., user_id=None)`.
+        """
+        if not self.enabled:
+            return
+        if user_id:
+            self._take_user_token(user_id, priority)
+        if (self.active >= self.max_concurrency and self._queued >= self.max_queue
+                and not any(entry[0] > PRIORITIES[priority] and not entry[2].done() for entry in self._waiters)):
+            self._reject(priority, "queue_full", "LLM queue is full")
+
+    async def acquire(self, priority: str = "interactive", user_id: Optional[str] = None,
+                      timeout: Optional[float] = None):
+        """Wait for a slot. Raises AdmissionRejected if rate limited, the queue is full or the wait times out."""
+        if user_id:
+            self._take_user_token(user_id, priority)
+
+        priority_value = PRIORITIES[priority]
+        if self.active < self.max_concurrency and self._queued == 0:
+            self.active += 1
+            self._stats["admitted"] += 1
+            ADMISSION_WAIT.observe(0.0, priority=priority)
+            return
+
+        if self._queued >= self.max_queue and not self._evict_worst_waiter(priority_value):
+            self._reject(priority, "queue_full", "LLM queue is full")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority_value, next(self._sequence), future, priority])
+        self._queued += 1
+        self._stats["queued"] += 1
+        start = time.perf_counter()
+        wait = timeout if timeout is not None else self.queue_timeout * PRIORITY_WAIT_FACTOR[priority]
+        try:
+            await asyncio.wait_for(asyncio.shield(future), wait)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self._queued -= 1
+                self._reject(priority, "timed_out", f"Waited {wait:.0f}s for an LLM slot")
+            if future.exception() is not None:
+                raise future.exception()  # Evicted just as the wait expired
+            # Otherwise a slot was handed over just as the wait expired
+        except asyncio.CancelledError:
+            if not future.done():
+                future.cancel()
+                self._queued -= 1
+            elif future.exception() is None:
+                self.release()  # Pass on the slot we were handed
+            raise
+        finally:
+            ADMISSION_WAIT.observe(time.perf_counter() - start, priority=priority)
+        self._stats["admitted"] += 1
+
+    def try_acquire(self, priority: str = "interactive") -> bool:
+        """Take a free slot without queueing or rate limiting; False if none is free.
+
+        For optional extra calls (hedges) that must not exceed the concurrency cap.
+        The caller releases the slot when it got one.
+        """
+        if not self.enabled:
+            return True
+        if self.active >= self.max_concurrency or self._queued:
+            return False
+        self.active += 1
+        self._stats["admitted"] += 1
+        ADMISSION_WAIT.observe(0.0, priority=priority)
+        return True
+
+    def release(self, held_seconds: Optional[float] = None):
+        """Free a slot, handing it to the first live waiter."""
+        if not self.enabled:
+            return
+        if held_seconds is not None:
+            self._avg_hold_seconds = 0.9 * self._avg_hold_seconds + 0.1 * held_seconds
+        while self._waiters:
+            _, _, future, _ = heapq.heappop(self._waiters)
+            if future.done():
+                continue  # Timed out, cancelled or evicted; already uncounted
+            self._queued -= 1
+            future.set_result(True)  # The slot moves to the waiter; `active` is unchanged
+            return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: str = "interactive", user_id: Optional[str] = None,
+                   timeout: Optional[float] = None):
+        """Hold a concurrency slot for the duration of the block."""
+        if not self.enabled:
+            yield
+            return
+        await self.acquire(priority, user_id, timeout)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def queue_depths(self) -> Dict[tuple, int]:
+        depths = {(name,): 0 for name in PRIORITIES}
+        for _, _, future, name in self._waiters:
+            if not future.done():
+                depths[(name,)] += 1
+        return depths
+
+    def stats(self) -> Dict:
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "queued": self._queued,
+            "max_queue": self.max_queue,
+            "queue_by_priority": {key[0]: value for key, value in self.queue_depths().items()},
+            "avg_call_seconds": round(self._avg_hold_seconds, 3)
+        }
+
+
+_llm_governor: Optional[LLMGovernor] = None
+
+
+def get_llm_governor() -> LLMGovernor:
+    """Return the process-wide LLM governor, creating one from the environment on first use."""
+    global _llm_governor
+    if _llm_governor is None:
+        _llm_governor = LLMGovernor()
+    return _llm_governor
+
+
+def set_llm_governor(governor: Optional[LLMGovernor]):
+    """Install (or reset, with None) the process-wide LLM governor."""
+    global _llm_governor
+    _llm_governor = governor
+
+
+metrics_registry.gauge("eva_llm_queue_depth", "LLM calls waiting for a concurrency slot.", ("priority",),
+                       callback=lambda: get_llm_governor().queue_depths())
+metrics_registry.gauge("eva_llm_slots_in_use", "LLM concurrency slots currently held.",
+                       callback=lambda: get_llm_governor().active)
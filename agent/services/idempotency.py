@@ -0,0 +1,204 @@
+"""Idempotency keys and single-flight coalescing for requests that must run at most once."""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from services.metrics import registry as metrics_registry, track_dependency
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+# How long a completed result is replayed for the same key
+IDEMPOTENCY_WINDOW = int(os.getenv("IDEMPOTENCY_WINDOW", "300"))
+# Longest a leader may hold a key; followers on other workers wait at most this long
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "120"))
+IDEMPOTENCY_POLL_INTERVAL = 0.1
+
+COALESCED_REQUESTS = metrics_registry.counter(
+    "eva_idempotent_requests_total", "Requests answered by single-flight coalescing, by outcome.",
+    ("outcome",))
+
+
+def idempotency_key(scope: str, client_key: Optional[str] = None, *parts: Any) -> str:
+    """Key of a request: the client-supplied key if any, else a hash of the identifying parts.
+
+    Client keys are scoped (e.g. by conversation) so two clients reusing a key never collide.
+    """
+    material = client_key if client_key else json.dumps(parts, sort_keys=True, default=str)
+    kind = "client" if client_key else "derived"
+    return f"{kind}:{hashlib.sha256(f'{scope}:{material}'.encode('utf-8')).hexdigest()[:32]}"
+
+
+class _LeaderCancelled(Exception):
+    """The execution a duplicate was waiting on was cancelled (e.g. its client disconnected)."""
+
+
+class RequestCoalescer:
+    """Runs a producer at most once per key, sharing its result with duplicates.
+
+    - A duplicate arriving while the first request runs in this process awaits the
+      same future (single flight), so both get one result from one execution.
+    - Across workers, the leader holds `idempotency:{key}:lock` (SET NX with a TTL)
+      and duplicates elsewhere poll for `idempotency:{key}:result`.
+    - A completed result is stored for `window_seconds`; replays in that window get
+      it back without running the producer.
+
+    Only results the producer marks as storable are kept, so failures can be retried.
+    Without Redis (or if it fails) coalescing and replay are per process.
+    """
+
+    def __init__(self, redis_client=None, window_seconds: int = IDEMPOTENCY_WINDOW,
+                 lock_timeout: int = IDEMPOTENCY_LOCK_TIMEOUT, enabled: bool = IDEMPOTENCY_ENABLED):
+        self.redis = redis_client
+        self.window_seconds = window_seconds
+        self.lock_timeout = lock_timeout
+        self.enabled = enabled
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._local_results: Dict[str, Tuple[float, Any]] = {}
+        self._stats = {"executed": 0, "coalesced": 0, "replayed": 0, "errors": 0}
+
+    @staticmethod
+    def result_key(key: str) -> str:
+        return f"idempotency:{key}:result"
+
+    @staticmethod
+    def lock_key(key: str) -> str:
+        return f"idempotency:{key}:lock"
+
+    async def _stored_result(self, key: str) -> Optional[Any]:
+        entry = self._local_results.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                return entry[1]
+            self._local_results.pop(key, None)
+        if self.redis is None:
+            return None
+        try:
+            with track_dependency("redis", "idempotency_get"):
+                value = await self.redis.get(self.result_key(key))
+            return json.loads(value) if value is not None else None
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Error reading idempotent result from Redis: {str(e)}")
+            return None
+
+    async def _store_result(self, key: str, result: Any):
+        now = time.monotonic()
+        self._local_results = {k: v for k, v in self._local_results.items() if v[0] > now}
+        self._local_results[key] = (now + self.window_seconds, result)
+        if self.redis is None:
+            return
+        try:
+            with track_dependency("redis", "idempotency_set"):
+                await self.redis.set(self.result_key(key), json.dumps(result), ex=self.window_seconds)
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Error storing idempotent result in Redis: {str(e)}")
+
+    async def _acquire_lock(self, key: str) -> bool:
+        if self.redis is None:
+            return True
+        try:
+            with track_dependency("redis", "idempotency_lock"):
+                return bool(await self.redis.set(self.lock_key(key), "1", nx=True, ex=self.lock_timeout))
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Error taking idempotency lock in Redis: {str(e)}")
+            return True
+
+    async def _release_lock(self, key: str):
+        if self.redis is None:
+            return
+        try:
+            with track_dependency("redis", "idempotency_unlock"):
+                await self.redis.delete(self.lock_key(key))
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Error releasing idempotency lock in Redis: {str(e)}")
+
+    async def _await_remote_leader(self, key: str) -> Optional[Any]:
+        """Poll for the result of a leader on another worker until it finishes or its lock expires."""
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+            result = await self._stored_result(key)
+            if result is not None:
+                return result
+            try:
+                if not await self.redis.exists(self.lock_key(key)):
+                    return None  # The leader finished without a storable result
+            except Exception as e:
+                logger.error(f"Error checking idempotency lock in Redis: {str(e)}")
+                return None
+        return None
+
+    def _record(self, outcome: str):
+        self._stats[outcome] += 1
+        COALESCED_REQUESTS.inc(outcome=outcome)
+
+    async def run(self, key: str, producer: Callable[[], Awaitable[Tuple[Any, bool]]]) -> Tuple[Any, str]:
+        """Return (result, outcome) for a key, running `producer` only if no one else has or is.
+
+        `producer` returns (result, storable); storable results must be JSON-serialisable.
+        Outcome is "executed", "coalesced" (shared an in-flight execution) or "replayed".
+        """
+        if not self.enabled:
+            result, _ = await producer()
+            return result, "executed"
+
+        stored = await self._stored_result(key)
+        if stored is not None:
+            self._record("replayed")
+            return stored, "replayed"
+
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            try:
+                result = await asyncio.shield(pending)
+            except _LeaderCancelled:
+                # The first request was abandoned; this duplicate still wants an answer, so it takes over
+                return await self.run(key, producer)
+            self._record("coalesced")
+            return result, "coalesced"
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            if not await self._acquire_lock(key):
+                result = await self._await_remote_leader(key)
+                if result is not None:
+                    future.set_result(result)
+                    self._record("coalesced")
+                    return result, "coalesced"
+                await self._acquire_lock(key)  # Leader gone without a result; run it here
+
+            try:
+                result, storable = await producer()
+                if storable:
+                    await self._store_result(key, result)
+            finally:
+                await self._release_lock(key)
+            future.set_result(result)
+            self._record("executed")
+            return result, "executed"
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e if isinstance(e, Exception) else _LeaderCancelled("Request was cancelled"))
+                future.exception()  # Mark retrieved so an unawaited failure is not logged
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "backend": "redis" if self.redis is not None else "memory",
+            "in_flight": len(self._in_flight),
+            "window_seconds": self.window_seconds
+        }
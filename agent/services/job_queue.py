@@ -0,0 +1,324 @@
+"""Bounded background job queue with retries, backed by Redis Streams or an in-memory stand-in."""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from dataclasses import dataclass, field, asdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "redis")  # "redis" or "memory"
+JOB_QUEUE_MAX_LENGTH = int(os.getenv("JOB_QUEUE_MAX_LENGTH", "1000"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_DELAY = float(os.getenv("JOB_RETRY_BASE_DELAY", "2"))
+JOB_DEDUP_TTL = int(os.getenv("JOB_DEDUP_TTL", "3600"))
+JOB_DRAIN_TIMEOUT = float(os.getenv("JOB_DRAIN_TIMEOUT", "20"))
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", "300"))
+
+
+@dataclass
+class Job:
+    """A unit of background work. `dedup_key` identifies the conversation turn it belongs to."""
+    kind: str
+    payload: Dict[str, Any]
+    dedup_key: str
+    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    attempts: int = 0
+    enqueued_at: float = field(default_factory=time.time)
+    receipt: Optional[str] = None  # Backend handle for ack, not serialized
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        data.pop("receipt")
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, raw, receipt: Optional[str] = None) -> "Job":
+        return cls(**json.loads(raw), receipt=receipt)
+
+
+class InMemoryJobQueue:
+    """Process-local queue with the same interface as RedisStreamJobQueue. Jobs are lost on restart."""
+
+    def __init__(self, max_length: int = JOB_QUEUE_MAX_LENGTH, dedup_ttl: int = JOB_DEDUP_TTL):
+        self.max_length = max_length
+        self.dedup_ttl = dedup_ttl
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._dedup: Dict[str, float] = {}
+        self._delayed = 0
+
+    def _is_duplicate(self, dedup_key: str) -> bool:
+        now = time.time()
+        expires = self._dedup.get(dedup_key)
+        if expires and expires > now:
+            return True
+        self._dedup = {key: exp for key, exp in self._dedup.items() if exp > now}
+        self._dedup[dedup_key] = now + self.dedup_ttl
+        return False
+
+    async def enqueue(self, job: Job) -> bool:
+        """Add a job. Returns False if it is a duplicate or the queue is full."""
+        if await self.depth() >= self.max_length:
+            logger.warning(f"Job queue full ({self.max_length}); dropping {job.kind} job {job.dedup_key}")
+            return False
+        if self._is_duplicate(job.dedup_key):
+            logger.info(f"Skipping duplicate {job.kind} job {job.dedup_key}")
+            return False
+        self._queue.put_nowait(job)
+        return True
+
+    async def dequeue(self, consumer: str, timeout: float = 1.0) -> Optional[Job]:
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def ack(self, job: Job):
+        pass
+
+    async def retry(self, job: Job, delay: float):
+        """Requeue a failed job after `delay` seconds."""
+        self._delayed += 1
+
+        def requeue():
+            self._delayed -= 1
+            self._queue.put_nowait(job)
+
+        asyncio.get_running_loop().call_later(delay, requeue)
+
+    async def depth(self) -> int:
+        return self._queue.qsize() + self._delayed
+
+    async def close(self):
+        pass
+
+
+class RedisStreamJobQueue:
+    """Durable queue on a Redis Stream with a consumer group.
+
+    Jobs survive restarts: entries stay in the stream until acknowledged, and
+    entries left pending by a crashed worker are reclaimed after
+    `visibility_timeout` seconds. Failed jobs wait in a sorted set keyed by
+    their due time until they are moved back onto the stream. Dedup keys are
+    SET NX entries with a TTL.
+    """
+
+    def __init__(self, redis_client, name: str, max_length: int = JOB_QUEUE_MAX_LENGTH,
+                 dedup_ttl: int = JOB_DEDUP_TTL, visibility_timeout: int = JOB_VISIBILITY_TIMEOUT):
+        self.redis = redis_client
+        self.stream_key = f"jobs:{name}:stream"
+        self.delayed_key = f"jobs:{name}:delayed"
+        self.dedup_prefix = f"jobs:{name}:dedup:"
+        self.group = f"{name}-workers"
+        self.max_length = max_length
+        self.dedup_ttl = dedup_ttl
+        self.visibility_timeout = visibility_timeout
+        self._group_ready = False
+
+    async def _ensure_group(self):
+        if self._group_ready:
+            return
+        try:
+            await self.redis.xgroup_create(self.stream_key, self.group, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_ready = True
+
+    async def enqueue(self, job: Job) -> bool:
+        """Add a job. Returns False if it is a duplicate or the queue is full."""
+        await self._ensure_group()
+        if await self.depth() >= self.max_length:
+            logger.warning(f"Job queue {self.stream_key} full ({self.max_length}); dropping {job.kind} job {job.dedup_key}")
+            return False
+        if not await self.redis.set(self.dedup_prefix + job.dedup_key, job.id, nx=True, ex=self.dedup_ttl):
+            logger.info(f"Skipping duplicate {job.kind} job {job.dedup_key}")
+            return False
+        await self.redis.xadd(self.stream_key, {"job": job.to_json()})
+        return True
+
+    async def _promote_due(self):
+        """Move retries whose backoff has elapsed back onto the stream."""
+        due = await self.redis.zrangebyscore(self.delayed_key, 0, time.time(), start=0, num=50)
+        for raw in due:
+            if await self.redis.zrem(self.delayed_key, raw):  # Only the worker that removed it re-adds it
+                await self.redis.xadd(self.stream_key, {"job": raw})
+
+    async def _claim_stale(self, consumer: str) -> Optional[Job]:
+        """Take over one entry left pending by a worker that died before acknowledging it."""
+        result = await self.redis.xautoclaim(self.stream_key, self.group, consumer,
+                                             min_idle_time=self.visibility_timeout * 1000, start_id="0-0", count=1)
+        claimed = result[1] if len(result) > 1 else []
+        for entry_id, fields in claimed:
+            if fields:
+                return Job.from_json(fields[b"job"], receipt=entry_id)
+            await self.redis.xack(self.stream_key, self.group, entry_id)  # Entry was deleted meanwhile
+        return None
+
+    async def dequeue(self, consumer: str, timeout: float = 1.0) -> Optional[Job]:
+        await self._ensure_group()
+        await self._promote_due()
+        job = await self._claim_stale(consumer)
+        if job:
+            logger.info(f"Reclaimed stale {job.kind} job {job.dedup_key}")
+            return job
+        response = await self.redis.xreadgroup(self.group, consumer, {self.stream_key: ">"},
+                                               count=1, block=int(timeout * 1000))
+        for _, entries in response or []:
+            for entry_id, fields in entries:
+                return Job.from_json(fields[b"job"], receipt=entry_id)
+        return None
+
+    async def ack(self, job: Job):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.xack(self.stream_key, self.group, job.receipt)
+            pipe.xdel(self.stream_key, job.receipt)
+            await pipe.execute()
+
+    async def retry(self, job: Job, delay: float):
+        """Schedule the job for another attempt and acknowledge the failed delivery."""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(self.delayed_key, {job.to_json(): time.time() + delay})
+            pipe.xack(self.stream_key, self.group, job.receipt)
+            pipe.xdel(self.stream_key, job.receipt)
+            await pipe.execute()
+
+    async def depth(self) -> int:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xlen(self.stream_key)
+            pipe.zcard(self.delayed_key)
+            stream_length, delayed = await pipe.execute()
+        return stream_length + delayed
+
+    async def close(self):
+        pass
+
+
+class JobWorkerPool:
+    """Runs a fixed number of worker coroutines that process jobs from a queue.
+
+    At most `concurrency` jobs run at once regardless of how many are queued. A
+    job whose handler raises is retried with exponential backoff
+    (`base_delay * 2**attempt`) up to `max_attempts`, then dropped with an error.
+    """
+
+    def __init__(self, queue, handlers: Dict[str, Callable[[Job], Awaitable[None]]],
+                 concurrency: int = JOB_WORKERS, max_attempts: int = JOB_MAX_ATTEMPTS,
+                 base_delay: float = JOB_RETRY_BASE_DELAY, name: str = "jobs"):
+        self.queue = queue
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.name = name
+        self._workers: List[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+        self._accepting = True
+        self._in_flight = 0
+        self.stats = {"enqueued": 0, "deduplicated_or_rejected": 0, "succeeded": 0,
+                      "retried": 0, "failed": 0}
+
+    async def submit(self, kind: str, payload: Dict[str, Any], dedup_key: str) -> bool:
+        """Queue a job of a registered kind. Returns False if it was a duplicate or rejected."""
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+        if not self._accepting:
+            logger.warning(f"Job pool {self.name} is shutting down; not accepting {kind} job {dedup_key}")
+            return False
+        try:
+            accepted = await self.queue.enqueue(Job(kind=kind, payload=payload, dedup_key=dedup_key))
+        except Exception as e:
+            logger.error(f"Error enqueuing {kind} job {dedup_key}: {str(e)}")
+            accepted = False
+        self.stats["enqueued" if accepted else "deduplicated_or_rejected"] += 1
+        return accepted
+
+    def start(self):
+        self._stopping.clear()
+        self._accepting = True
+        for i in range(self.concurrency):
+            consumer = f"{self.name}-{os.getpid()}-{i}"
+            self._workers.append(asyncio.create_task(self._run(consumer)))
+        logger.info(f"Started {self.concurrency} {self.name} workers on {type(self.queue).__name__}")
+
+    async def _run(self, consumer: str):
+        while not self._stopping.is_set():
+            try:
+                job = await self.queue.dequeue(consumer, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Worker {consumer} could not read from job queue: {str(e)}")
+                await asyncio.sleep(1.0)
+                continue
+            if job is None:
+                continue
+            self._in_flight += 1
+            try:
+                await self._process(job)
+            finally:
+                self._in_flight -= 1
+
+    async def _process(self, job: Job):
+        job.attempts += 1
+        try:
+            await self.handlers[job.kind](job)
+            await self.queue.ack(job)
+            self.stats["succeeded"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if job.attempts < self.max_attempts:
+                delay = self.base_delay * 2 ** (job.attempts - 1)
+                logger.warning(f"{job.kind} job {job.dedup_key} failed (attempt {job.attempts}/{self.max_attempts}): "
+                               f"{str(e)}. Retrying in {delay:.1f}s")
+                await self.queue.retry(job, delay)
+                self.stats["retried"] += 1
+            else:
+                logger.error(f"{job.kind} job {job.dedup_key} failed permanently after {job.attempts} attempts: {str(e)}")
+                await self.queue.ack(job)
+                self.stats["failed"] += 1
+
+    async def depth(self) -> int:
+        try:
+            return await self.queue.depth()
+        except Exception as e:
+            logger.error(f"Error reading job queue depth: {str(e)}")
+            return -1
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def stop(self, drain_timeout: float = JOB_DRAIN_TIMEOUT):
+        """Stop accepting jobs, let workers drain the queue for up to `drain_timeout` seconds, then cancel them.
+
+        With the Redis backend anything left over stays in the stream for the next start.
+        """
+        self._accepting = False
+        deadline = time.monotonic() + drain_timeout
+        while time.monotonic() < deadline and (self._in_flight or await self.depth() > 0):
+            await asyncio.sleep(0.2)
+        self._stopping.set()
+        while time.monotonic() < deadline and self._in_flight:
+            await asyncio.sleep(0.2)
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await self.queue.close()
+        logger.info(f"Stopped {self.name} workers ({self.stats})")
+
+
+def create_job_queue(name: str, async_redis_client=None, backend: str = JOB_QUEUE_BACKEND):
+    """Redis Streams queue if requested and a client is available, otherwise the in-memory queue."""
+    if backend == "redis" and async_redis_client is not None:
+        return RedisStreamJobQueue(async_redis_client, name)
+    if backend == "redis":
+        logger.warning("Redis is unavailable; using the in-memory job queue (jobs are lost on restart)")
+    return InMemoryJobQueue()
@@ -0,0 +1,319 @@
+"""Lightweight Prometheus-compatible metrics: counters, gauges and histograms rendered in the text format."""
+
+import os
+import time
+import bisect
+import inspect
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Latency buckets (seconds) spanning cache hits through slow LLM calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count per label set."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    async def collect(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                                for key, value in items]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be read from a callback at scrape time.
+
+    A callback may be a plain function or a coroutine function and returns either a
+    number (for unlabelled gauges) or a dict of label-value tuple -> number.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Union[float, Dict, Awaitable]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    async def collect(self) -> List[str]:
+        if self.callback is not None:
+            try:
+                result = self.callback()
+                if inspect.isawaitable(result):
+                    result = await result
+                values = result if isinstance(result, dict) else {(): result}
+                with self._lock:
+                    self._values = {tuple(str(v) for v in (key if isinstance(key, tuple) else (key,))): float(value)
+                                    for key, value in values.items()}
+            except Exception as e:
+                logger.error(f"Error collecting metric {self.name}: {str(e)}")
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                                for key, value in items]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram per label set."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    async def collect(self) -> List[str]:
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items()]
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds metrics and renders them in the Prometheus text exposition format (0.0.4)."""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), callback=None) -> Gauge:
+        gauge = self.register(Gauge(name, documentation, labelnames))
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    async def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(await metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUESTS = registry.counter(
+    "eva_http_requests_total", "HTTP requests by method, route template and status code.",
+    ("method", "route", "status"))
+HTTP_LATENCY = registry.histogram(
+    "eva_http_request_duration_seconds", "HTTP request latency until the response body is complete.",
+    ("method", "route"))
+STAGE_LATENCY = registry.histogram(
+    "eva_stage_duration_seconds", "Latency of processing stages inside request handlers and background jobs.",
+    ("route", "stage"))
+STAGE_ERRORS = registry.counter(
+    "eva_stage_errors_total", "Stages that raised an exception.", ("route", "stage"))
+DEPENDENCY_REQUESTS = registry.counter(
+    "eva_dependency_requests_total", "Calls to external dependencies (redis, backend).", ("dependency", "operation"))
+DEPENDENCY_ERRORS = registry.counter(
+    "eva_dependency_errors_total", "Failed calls to external dependencies (redis, backend).",
+    ("dependency", "operation"))
+LLM_IN_FLIGHT = registry.gauge(
+    "eva_llm_calls_in_flight", "LLM calls currently awaiting a response.", ("route",))
+
+
+# ASGI scope of the request being handled; tasks started by a handler inherit it
+_current_scope: ContextVar[Optional[dict]] = ContextVar("metrics_current_scope", default=None)
+
+
+def current_route() -> str:
+    """Route template of the request in progress, or "background" outside a request."""
+    scope = _current_scope.get()
+    if scope is None:
+        return "background"
+    return getattr(scope.get("route"), "path", None) or "unmatched"
+
+
+@contextmanager
+def track_stage(stage: str, route: Optional[str] = None):
+    """Time a block as one stage of the current route. Works around awaits, since it only reads the clock."""
+    if not METRICS_ENABLED:
+        yield
+        return
+    route = route or current_route()
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(route=route, stage=stage)
+        raise
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - start, route=route, stage=stage)
+
+
+@contextmanager
+def track_llm_call(stage: str = "llm_call", route: Optional[str] = None):
+    """Time an LLM call as a stage and count it as in flight while it runs."""
+    if not METRICS_ENABLED:
+        yield
+        return
+    route = route or current_route()
+    LLM_IN_FLIGHT.inc(route=route)
+    try:
+        with track_stage(stage, route):
+            yield
+    finally:
+        LLM_IN_FLIGHT.dec(route=route)
+
+
+@contextmanager
+def track_dependency(dependency: str, operation: str):
+    """Count a call to an external dependency, and an error if the block raises."""
+    if METRICS_ENABLED:
+        DEPENDENCY_REQUESTS.inc(dependency=dependency, operation=operation)
+    try:
+        yield
+    except Exception:
+        if METRICS_ENABLED:
+            DEPENDENCY_ERRORS.inc(dependency=dependency, operation=operation)
+        raise
+
+
+def record_dependency_error(dependency: str, operation: str):
+    """Count a dependency failure that was detected without an exception (e.g. an HTTP 5xx)."""
+    if METRICS_ENABLED:
+        DEPENDENCY_ERRORS.inc(dependency=dependency, operation=operation)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request counts and latency per route template.
+
+    Uses the matched route's path template (e.g. /api/v1/conversation/{conversation_id})
+    as the label so ids never inflate cardinality; unmatched paths are grouped.
+    Latency runs until the last body chunk is sent, so streamed responses count fully.
+    """
+
+    def __init__(self, app, excluded_paths: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.excluded_paths = set(excluded_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED or scope.get("path") in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+        token = _current_scope.set(scope)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_scope.reset(token)
+            route_path = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope.get("method", "")
+            HTTP_REQUESTS.inc(method=method, route=route_path, status=status["code"])
+            HTTP_LATENCY.observe(time.perf_counter() - start, method=method, route=route_path)
@@ -0,0 +1,192 @@
+"""Per request type model routing: which model, output budget and timeout each kind of LLM call uses."""
+
+import os
+import json
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Deque, Dict, Optional
+
+from services.metrics import registry as metrics_registry
+
+logger = logging.getLogger(__name__)
+
+MODEL_ROUTES_PATH = Path(os.getenv("MODEL_ROUTES_PATH", str(Path(__file__).parent.parent / "config" / "model_routes.json")))
+# Seconds between checks of the routes file for changes (0 only reloads through the API)
+MODEL_ROUTES_RELOAD_INTERVAL = float(os.getenv("MODEL_ROUTES_RELOAD_INTERVAL", "30"))
+
+LATENCY_WINDOW = 500
+
+ROUTE_LATENCY = metrics_registry.histogram(
+    "eva_llm_route_latency_seconds", "LLM call latency per routed request type and model.", ("request_type", "model"))
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    """Model settings for one request type. `temperature` None keeps the caller's temperature."""
+    model: str = "gpt-4o-mini"
+    max_tokens: Optional[int] = None
+    timeout: float = 30.0
+    temperature: Optional[float] = None
+
+    def llm_kwargs(self, temperature: Optional[float] = None) -> Dict[str, Any]:
+        """Keyword arguments for constructing a ChatOpenAI client for this route."""
+        kwargs = {"model_name": self.model, "request_timeout": self.timeout}
+        if self.max_tokens:
+            kwargs["max_tokens"] = self.max_tokens
+        if self.temperature is not None or temperature is not None:
+            kwargs["temperature"] = self.temperature if self.temperature is not None else temperature
+        return kwargs
+
+
+# Used for request types missing from the routes file, and when it cannot be read
+DEFAULT_ROUTES = {
+    "default": ModelRoute(max_tokens=1024, timeout=30),
+    "initial_query": ModelRoute(max_tokens=1024, timeout=30),
+    "default_system": ModelRoute(max_tokens=1024, timeout=30),
+    "post_feedback": ModelRoute(max_tokens=1500, timeout=45),
+    "email_draft": ModelRoute(max_tokens=800, timeout=30),
+    "rehearsal": ModelRoute(max_tokens=300, timeout=15),
+    "simulate_reply": ModelRoute(max_tokens=400, timeout=20),
+    "understanding_mode": ModelRoute(max_tokens=800, timeout=10),
+    "strategy_parsing": ModelRoute(max_tokens=500, timeout=20, temperature=0.0),
+    "synthesis": ModelRoute(max_tokens=400, timeout=60),
+    "conversation_summary": ModelRoute(max_tokens=500, timeout=30),
+}
+
+
+class ModelRouter:
+    """Maps request types (prompt names, plus "synthesis", "strategy_parsing",
+    "understanding_mode" and "conversation_summary" for agent calls) to a ModelRoute.
+
+    The policy is read from a JSON file of `{request_type: {model, max_tokens, timeout,
+    temperature}}`; fields left out fall back to DEFAULT_ROUTES. The file is re-read
+    when it changes (checked at most every `reload_interval` seconds) or on `reload()`.
+    A file that fails to parse leaves the previous policy in place.
+
+    Observed latency is kept per request type and model so the mapping can be tuned.
+    """
+
+    def __init__(self, path: Path = MODEL_ROUTES_PATH, reload_interval: float = MODEL_ROUTES_RELOAD_INTERVAL):
+        self.path = Path(path)
+        self.reload_interval = reload_interval
+        self.generation = 0
+        self._routes: Dict[str, ModelRoute] = dict(DEFAULT_ROUTES)
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._configured: Dict[tuple, Any] = {}
+        self._latencies: Dict[tuple, Deque[float]] = {}
+        self.reload()
+
+    def reload(self) -> bool:
+        """Re-read the routes file. Returns False (keeping the current policy) if it is invalid."""
+        self._checked_at = time.monotonic()
+        if not self.path.exists():
+            if self._mtime is not None:
+                logger.warning(f"Model routes file {self.path} was removed; using default routes")
+            self._routes, self._mtime = dict(DEFAULT_ROUTES), None
+            self._bump()
+            return True
+        try:
+            mtime = self.path.stat().st_mtime
+            with open(self.path, 'r') as f:
+                raw = json.load(f)
+            routes = dict(DEFAULT_ROUTES)
+            for request_type, settings in raw.items():
+                base = DEFAULT_ROUTES.get(request_type, DEFAULT_ROUTES["default"])
+                routes[request_type] = ModelRoute(**{**asdict(base), **settings})
+        except Exception as e:
+            logger.error(f"Error loading model routes from {self.path}: {str(e)}. Keeping the current routes.")
+            return False
+        self._routes, self._mtime = routes, mtime
+        self._bump()
+        logger.info("Loaded model routes: " + ", ".join(
+            f"{name}={route.model}/{route.max_tokens}" for name, route in sorted(routes.items())))
+        return True
+
+    def _bump(self):
+        self.generation += 1
+        self._configured.clear()
+
+    def _maybe_reload(self):
+        if self.reload_interval <= 0 or time.monotonic() - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = time.monotonic()
+        try:
+            mtime = self.path.stat().st_mtime if self.path.exists() else None
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.reload()
+
+    def route(self, request_type: Optional[str]) -> ModelRoute:
+        self._maybe_reload()
+        return self._routes.get(request_type or "default", self._routes["default"])
+
+    def configure(self, llm: Any, request_type: str) -> Any:
+        """Copy of an existing chat model with the route's model, output budget and temperature.
+
+        The timeout is not copied (clients fix it at construction); callers pass
+        `route(...).timeout` as the deadline instead.
+        """
+        route = self.route(request_type)
+        cache_key = (id(llm), request_type)
+        configured = self._configured.get(cache_key)
+        if configured is None or configured[0] is not llm:
+            update = {"model_name": route.model, "max_tokens": route.max_tokens}
+            if route.temperature is not None:
+                update["temperature"] = route.temperature
+            configured = (llm, llm.model_copy(update=update))
+            self._configured[cache_key] = configured
+        return configured[1]
+
+    def observe(self, request_type: str, model: str, seconds: float):
+        self._latencies.setdefault((request_type, model), deque(maxlen=LATENCY_WINDOW)).append(seconds)
+        ROUTE_LATENCY.observe(seconds, request_type=request_type, model=model)
+
+    @contextmanager
+    def timed(self, request_type: str, model: Optional[str] = None):
+        """Record the latency of the block for a request type (only when it succeeds)."""
+        start = time.perf_counter()
+        yield
+        self.observe(request_type, model or self.route(request_type).model, time.perf_counter() - start)
+
+    @staticmethod
+    def _percentile(samples, percentile: float) -> float:
+        ordered = sorted(samples)
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))], 3)
+
+    def stats(self) -> Dict[str, Any]:
+        observed = {}
+        for (request_type, model), samples in self._latencies.items():
+            observed.setdefault(request_type, {})[model] = {
+                "samples": len(samples),
+                "p50_seconds": self._percentile(samples, 50),
+                "p95_seconds": self._percentile(samples, 95),
+            }
+        return {
+            "path": str(self.path),
+            "generation": self.generation,
+            "routes": {name: asdict(route) for name, route in sorted(self._routes.items())},
+            "observed_latency": observed
+        }
+
+
+_model_router: Optional[ModelRouter] = None
+
+
+def get_model_router() -> ModelRouter:
+    """Return the process-wide model router, loading the routes file on first use."""
+    global _model_router
+    if _model_router is None:
+        _model_router = ModelRouter()
+    return _model_router
+
+
+def set_model_router(router: Optional[ModelRouter]):
+    """Install (or reset, with None) the process-wide model router."""
+    global _model_router
+    _model_router = router
@@ -0,0 +1,535 @@
+"""Resilience around LLM calls: per-route deadlines, hedged requests, circuit breakers and fallbacks."""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+
+import httpx
+import openai
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from services.governor import get_llm_governor
+from services.metrics import current_route, registry as metrics_registry
+
+logger = logging.getLogger(__name__)
+
+LLM_RESILIENCE_ENABLED = os.getenv("LLM_RESILIENCE_ENABLED", "true").lower() == "true"
+# Seconds an LLM call may take, by route template; other routes use LLM_DEFAULT_DEADLINE
+LLM_DEFAULT_DEADLINE = float(os.getenv("LLM_DEFAULT_DEADLINE", "30"))
+LLM_ROUTE_DEADLINES = json.loads(os.getenv("LLM_ROUTE_DEADLINES", json.dumps({
+    "/api/v1/conversation/message": 30,
+    "/generate-response": 30,
+    "/api/v1/conversation/generate-response": 30,
+    "background": 90,
+})))
+# Streams must produce their first token within this many seconds
+LLM_STREAM_FIRST_TOKEN_TIMEOUT = float(os.getenv("LLM_STREAM_FIRST_TOKEN_TIMEOUT", "15"))
+# ...and each later token within this many seconds of the previous one
+LLM_STREAM_IDLE_TIMEOUT = float(os.getenv("LLM_STREAM_IDLE_TIMEOUT", "10"))
+
+# A duplicate request is sent when the first has not answered within the observed p95 latency
+LLM_HEDGING_ENABLED = os.getenv("LLM_HEDGING_ENABLED", "true").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Upper bound on the share of recent calls that were hedged, so a general slowdown cannot double the load
+LLM_HEDGE_MAX_RATE = float(os.getenv("LLM_HEDGE_MAX_RATE", "0.1"))
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+# Model used when the primary fails or its circuit is open ("" disables model fallback)
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "")
+# Share of the deadline the primary model gets when a fallback model is configured
+LLM_PRIMARY_DEADLINE_SHARE = float(os.getenv("LLM_PRIMARY_DEADLINE_SHARE", "0.7"))
+
+LATENCY_WINDOW = 200
+
+LLM_REQUESTS = metrics_registry.counter(
+    "eva_llm_requests_total", "LLM calls by model and outcome (success, timeout, error, short_circuited).",
+    ("model", "outcome"))
+LLM_HEDGED = metrics_registry.counter(
+    "eva_llm_hedged_requests_total", "Duplicate (hedged) LLM requests sent after the p95 delay.", ("model",))
+LLM_HEDGE_WINS = metrics_registry.counter(
+    "eva_llm_hedge_wins_total", "Hedged requests that answered before the original.", ("model",))
+LLM_FALLBACKS = metrics_registry.counter(
+    "eva_llm_fallbacks_total", "Calls answered by a fallback (kind=model or cache).", ("kind",))
+
+
+class LLMUnavailable(Exception):
+    """No answer could be produced within the deadline, from the primary model or any fallback."""
+
+
+def is_model_failure(error: BaseException) -> bool:
+    """Whether an error says the model is unhealthy: timeouts, connection errors and 5xx responses.
+
+    Client errors (invalid request, context length, 4xx) mean the model answered and do not count.
+    """
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError, httpx.TransportError,
+                          openai.APIConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status, int) and status >= 500
+
+
+def llm_model_name(llm: Any) -> str:
+    return str(getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    Closed: calls pass. After `failure_threshold` consecutive failures (timeouts,
+    connection errors and 5xx, see `is_model_failure`) it opens and
+    rejects calls for `reset_timeout` seconds, then lets a single probe through
+    (half-open). The probe's success closes it again; its failure reopens it.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+    STATE_NAMES = {CLOSED: "closed", HALF_OPEN: "half_open", OPEN: "open"}
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+        return self.state == self.CLOSED
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_abandoned(self):
+        """The call was cancelled by its caller; it says nothing about the model's health."""
+        self._probe_in_flight = False
+
+    def record_error(self, error: BaseException):
+        """Count the error if it is a model failure; other errors only end a probe."""
+        if is_model_failure(error):
+            self.record_failure()
+        else:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit opened after {self.failures} consecutive LLM failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+
+class LLMResilience:
+    """Runs LLM calls under a deadline, with hedging, a per-model circuit breaker and fallbacks.
+
+    For each call:
+    1. If the model's circuit is closed (or half-open and free to probe), the call
+       runs under the route's deadline. If it has not answered after the model's
+       observed p95 latency, an identical request is sent and whichever answers
+       first wins; the other is cancelled.
+    2. On timeout, error or an open circuit, the configured fallback model gets the
+       rest of the deadline.
+    3. Failing that, the caller's cached answer (if any) is returned.
+    4. Otherwise `LLMUnavailable` is raised.
+    """
+
+    def __init__(self, enabled: bool = LLM_RESILIENCE_ENABLED, default_deadline: float = LLM_DEFAULT_DEADLINE,
+                 route_deadlines: Optional[Dict[str, float]] = None, hedging_enabled: bool = LLM_HEDGING_ENABLED,
+                 hedge_percentile: float = LLM_HEDGE_PERCENTILE, hedge_min_delay: float = LLM_HEDGE_MIN_DELAY,
+                 hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES, hedge_max_rate: float = LLM_HEDGE_MAX_RATE,
+                 fallback_model: str = LLM_FALLBACK_MODEL, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT,
+                 stream_first_token_timeout: float = LLM_STREAM_FIRST_TOKEN_TIMEOUT,
+                 stream_idle_timeout: float = LLM_STREAM_IDLE_TIMEOUT):
+        self.enabled = enabled
+        self.default_deadline = default_deadline
+        self.route_deadlines = dict(LLM_ROUTE_DEADLINES if route_deadlines is None else route_deadlines)
+        self.hedging_enabled = hedging_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_max_rate = hedge_max_rate
+        self.fallback_model = fallback_model
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.stream_first_token_timeout = stream_first_token_timeout
+        self.stream_idle_timeout = stream_idle_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._recent_hedges: Deque[bool] = deque(maxlen=LATENCY_WINDOW)
+        self._hedges_skipped = 0
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            breaker = self._breakers[model] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    def deadline_for(self, route: Optional[str] = None) -> float:
+        return float(self.route_deadlines.get(route or current_route(), self.default_deadline))
+
+    def observe_latency(self, model: str, seconds: float):
+        self._latencies.setdefault(model, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+    def latency_percentile(self, model: str, percentile: float) -> Optional[float]:
+        samples = sorted(self._latencies.get(model, ()))
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """Seconds to wait before hedging a call to `model`, or None to not hedge it."""
+        if not self.hedging_enabled or len(self._latencies.get(model, ())) < self.hedge_min_samples:
+            return None
+        if self._recent_hedges and sum(self._recent_hedges) / len(self._recent_hedges) >= self.hedge_max_rate:
+            return None
+        return max(self.hedge_min_delay, self.latency_percentile(model, self.hedge_percentile))
+
+    async def _hedged(self, model: str, attempt: Callable[[], Awaitable[Any]], hedge: bool) -> Any:
+        async def timed():
+            start = time.perf_counter()
+            result = await attempt()
+            self.observe_latency(model, time.perf_counter() - start)
+            return result
+
+        governor = get_llm_governor()
+
+        async def hedge_call():
+            start = time.perf_counter()
+            try:
+                return await timed()
+            finally:
+                governor.release(time.perf_counter() - start)
+
+        primary = asyncio.ensure_future(timed())
+        tasks = [primary]
+        try:
+            delay = self.hedge_delay(model) if hedge else None
+            hedged = False
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                # The hedge needs its own governor slot; without a free one it would exceed the concurrency cap
+                if not done and governor.try_acquire():
+                    hedged = True
+                    LLM_HEDGED.inc(model=model)
+                    tasks.append(asyncio.ensure_future(hedge_call()))
+                elif not done:
+                    self._hedges_skipped += 1
+            self._recent_hedges.append(hedged)
+
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            LLM_HEDGE_WINS.inc(model=model)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def arun(self, model: str, attempt: Callable[[], Awaitable[Any]], *,
+                   fallback_attempt: Optional[Callable[[], Awaitable[Any]]] = None,
+                   cached: Optional[Callable[[], Awaitable[Optional[Any]]]] = None,
+                   deadline: Optional[float] = None, hedge: bool = True) -> Any:
+        """Run `attempt` (one call to `model`) resiliently; see the class docstring.
+
+        `fallback_attempt` makes the same call with the fallback model; `cached` returns
+        a stored answer or None. Both are only used when the primary cannot answer.
+        """
+        if not self.enabled:
+            return await attempt()
+        deadline = deadline or self.deadline_for()
+        use_fallback_model = fallback_attempt is not None and bool(self.fallback_model) and self.fallback_model != model
+        primary_budget = deadline * LLM_PRIMARY_DEADLINE_SHARE if use_fallback_model else deadline
+        start = time.perf_counter()
+
+        breaker = self.breaker(model)
+        if breaker.allow():
+            try:
+                result = await asyncio.wait_for(self._hedged(model, attempt, hedge), primary_budget)
+                breaker.record_success()
+                LLM_REQUESTS.inc(model=model, outcome="success")
+                return result
+            except asyncio.CancelledError:
+                breaker.record_abandoned()
+                raise
+            except asyncio.TimeoutError:
+                breaker.record_failure()
+                LLM_REQUESTS.inc(model=model, outcome="timeout")
+                error: Exception = LLMUnavailable(f"{model} did not answer within {primary_budget:.1f}s")
+            except Exception as e:
+                breaker.record_error(e)
+                LLM_REQUESTS.inc(model=model, outcome="error")
+                error = e
+        else:
+            LLM_REQUESTS.inc(model=model, outcome="short_circuited")
+            error = LLMUnavailable(f"Circuit for {model} is open")
+        logger.warning(f"LLM call to {model} failed: {str(error)}. Trying fallbacks.")
+
+        if use_fallback_model:
+            remaining = deadline - (time.perf_counter() - start)
+            fallback_breaker = self.breaker(self.fallback_model)
+            if remaining > 0 and fallback_breaker.allow():
+                try:
+                    result = await asyncio.wait_for(fallback_attempt(), remaining)
+                    fallback_breaker.record_success()
+                    LLM_FALLBACKS.inc(kind="model")
+                    return result
+                except asyncio.CancelledError:
+                    fallback_breaker.record_abandoned()
+                    raise
+                except Exception as e:
+                    fallback_breaker.record_error(e)
+                    logger.error(f"Fallback model {self.fallback_model} failed: {str(e) or type(e).__name__}")
+
+        if cached is not None:
+            try:
+                value = await cached()
+            except Exception as e:
+                logger.error(f"Error reading cached fallback answer: {str(e)}")
+                value = None
+            if value is not None:
+                LLM_FALLBACKS.inc(kind="cache")
+                return value
+
+        raise LLMUnavailable(str(error) or type(error).__name__) from error
+
+    def _fallback_llm(self, llm: Any) -> Optional[Any]:
+        if not self.fallback_model or self.fallback_model == llm_model_name(llm):
+            return None
+        return llm.model_copy(update={"model_name": self.fallback_model})
+
+    async def ainvoke(self, llm: Any, messages: List, *,
+                      cached_answer: Optional[Callable[[], Awaitable[Optional[str]]]] = None,
+                      deadline: Optional[float] = None, hedge: bool = True) -> AIMessage:
+        """`llm.ainvoke(messages)` with deadline, hedging, breaker and fallbacks.
+
+        `cached_answer` returns a previously generated answer text, or None.
+        """
+        fallback_llm = self._fallback_llm(llm)
+
+        async def cached() -> Optional[AIMessage]:
+            text = await cached_answer()
+            return AIMessage(content=text) if text is not None else None
+
+        return await self.arun(
+            llm_model_name(llm), lambda: llm.ainvoke(messages),
+            fallback_attempt=(lambda: fallback_llm.ainvoke(messages)) if fallback_llm is not None else None,
+            cached=cached if cached_answer is not None else None,
+            deadline=deadline, hedge=hedge
+        )
+
+    @staticmethod
+    def _stream_wait(timeout: float, ends_at: Optional[float]) -> float:
+        """Seconds to wait for the next chunk: the idle timeout, capped by the overall deadline."""
+        if ends_at is None:
+            return timeout
+        return max(0.0, min(timeout, ends_at - time.perf_counter()))
+
+    async def astream(self, llm: Any, messages: List, *,
+                      cached_answer: Optional[Callable[[], Awaitable[Optional[str]]]] = None,
+                      first_token_timeout: Optional[float] = None, idle_timeout: Optional[float] = None,
+                      deadline: Optional[float] = None) -> AsyncIterator[AIMessageChunk]:
+        """`llm.astream(messages)` that fails over to the fallback model (then the cached answer)
+        if the stream errors or produces no token within `first_token_timeout`.
+
+        Once tokens have been sent there is no failover; a later error is raised. That
+        includes a stream that stalls for `idle_timeout` between tokens or runs past
+        `deadline` seconds in total, so a stuck stream cannot hold its slot forever.
+        """
+        idle_timeout = idle_timeout or self.stream_idle_timeout
+        ends_at = time.perf_counter() + deadline if deadline else None
+        if not self.enabled:
+            stream = llm.astream(messages).__aiter__()
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), self._stream_wait(idle_timeout, ends_at))
+                    except StopAsyncIteration:
+                        return
+                    yield chunk
+            except asyncio.TimeoutError:
+                raise LLMUnavailable(f"{llm_model_name(llm)} stream stalled or ran past its deadline")
+            finally:
+                await stream.aclose()
+        first_token_timeout = first_token_timeout or self.stream_first_token_timeout
+        candidates = [(llm_model_name(llm), llm)]
+        fallback_llm = self._fallback_llm(llm)
+        if fallback_llm is not None:
+            candidates.append((self.fallback_model, fallback_llm))
+
+        error: Optional[Exception] = None
+        for index, (model, candidate) in enumerate(candidates):
+            breaker = self.breaker(model)
+            if not breaker.allow():
+                LLM_REQUESTS.inc(model=model, outcome="short_circuited")
+                error = error or LLMUnavailable(f"Circuit for {model} is open")
+                continue
+            stream = candidate.astream(messages).__aiter__()
+            start = time.perf_counter()
+            try:
+                first = await asyncio.wait_for(stream.__anext__(), self._stream_wait(first_token_timeout, ends_at))
+            except (asyncio.CancelledError, GeneratorExit):
+                breaker.record_abandoned()
+                await stream.aclose()
+                raise
+            except StopAsyncIteration:
+                breaker.record_success()
+                LLM_REQUESTS.inc(model=model, outcome="success")
+                return
+            except asyncio.TimeoutError:
+                breaker.record_failure()
+                LLM_REQUESTS.inc(model=model, outcome="timeout")
+                error = LLMUnavailable(f"{model} sent no token within {first_token_timeout:.1f}s")
+                await stream.aclose()
+                continue
+            except Exception as e:
+                breaker.record_error(e)
+                LLM_REQUESTS.inc(model=model, outcome="error")
+                error = e
+                await stream.aclose()
+                continue
+
+            if index > 0:
+                LLM_FALLBACKS.inc(kind="model")
+            try:
+                yield first
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), self._stream_wait(idle_timeout, ends_at))
+                    except StopAsyncIteration:
+                        break
+                    yield chunk
+            except asyncio.TimeoutError:
+                breaker.record_failure()
+                LLM_REQUESTS.inc(model=model, outcome="timeout")
+                raise LLMUnavailable(f"{model} stream stalled for {idle_timeout:.1f}s or ran past its deadline")
+            except Exception as e:
+                breaker.record_error(e)
+                LLM_REQUESTS.inc(model=model, outcome="error")
+                raise
+            except BaseException:
+                breaker.record_abandoned()
+                raise
+            finally:
+                # Also runs when the consumer stops early, closing the upstream request
+                await stream.aclose()
+            breaker.record_success()
+            LLM_REQUESTS.inc(model=model, outcome="success")
+            self.observe_latency(model, time.perf_counter() - start)
+            return
+
+        if cached_answer is not None:
+            try:
+                text = await cached_answer()
+            except Exception as e:
+                logger.error(f"Error reading cached fallback answer: {str(e)}")
+                text = None
+            if text is not None:
+                LLM_FALLBACKS.inc(kind="cache")
+                yield AIMessageChunk(content=text)
+                return
+        raise LLMUnavailable(str(error) if error else "No LLM available") from error
+
+    def invoke(self, llm: Any, messages: List, deadline: Optional[float] = None) -> AIMessage:
+        """Blocking `llm.invoke` with the deadline passed as the request timeout, the breaker and
+        the fallback model (no hedging). For sync agent code paths."""
+        if not self.enabled:
+            return llm.invoke(messages)
+        deadline = deadline or self.deadline_for()
+        candidates = [(llm_model_name(llm), llm)]
+        fallback_llm = self._fallback_llm(llm)
+        if fallback_llm is not None:
+            candidates.append((self.fallback_model, fallback_llm))
+
+        start = time.perf_counter()
+        error: Optional[Exception] = None
+        for model, candidate in candidates:
+            remaining = deadline - (time.perf_counter() - start)
+            breaker = self.breaker(model)
+            if remaining <= 0 or not breaker.allow():
+                LLM_REQUESTS.inc(model=model, outcome="short_circuited")
+                continue
+            try:
+                result = candidate.invoke(messages, timeout=remaining)
+                breaker.record_success()
+                LLM_REQUESTS.inc(model=model, outcome="success")
+                return result
+            except Exception as e:
+                breaker.record_error(e)
+                LLM_REQUESTS.inc(model=model, outcome="error")
+                error = e
+        raise LLMUnavailable(str(error) if error else "No LLM available") from error
+
+    def circuit_states(self) -> Dict[tuple, int]:
+        return {(model,): breaker.state for model, breaker in self._breakers.items()}
+
+    def stats(self) -> Dict[str, Any]:
+        hedged = sum(self._recent_hedges)
+        return {
+            "enabled": self.enabled,
+            "fallback_model": self.fallback_model or None,
+            "route_deadlines": self.route_deadlines,
+            "default_deadline": self.default_deadline,
+            "hedge_rate": hedged / len(self._recent_hedges) if self._recent_hedges else 0.0,
+            "hedges_skipped_no_slot": self._hedges_skipped,
+            "circuits": {
+                model: {"state": CircuitBreaker.STATE_NAMES[breaker.state], "consecutive_failures": breaker.failures}
+                for model, breaker in self._breakers.items()
+            },
+            "latency": {
+                model: {"samples": len(samples),
+                        "p50": self.latency_percentile(model, 50),
+                        "p95": self.latency_percentile(model, self.hedge_percentile),
+                        "hedge_delay": self.hedge_delay(model)}
+                for model, samples in self._latencies.items()
+            }
+        }
+
+
+_llm_resilience: Optional[LLMResilience] = None
+
+
+def get_llm_resilience() -> LLMResilience:
+    """Return the process-wide resilience layer, creating one from the environment on first use."""
+    global _llm_resilience
+    if _llm_resilience is None:
+        _llm_resilience = LLMResilience()
+    return _llm_resilience
+
+
+def set_llm_resilience(resilience: Optional[LLMResilience]):
+    """Install (or reset, with None) the process-wide resilience layer."""
+    global _llm_resilience
+    _llm_resilience = resilience
+
+
+metrics_registry.gauge("eva_llm_circuit_state", "Circuit breaker state per model (0 closed, 1 half-open, 2 open).",
+                       ("model",), callback=lambda: get_llm_resilience().circuit_states())
+metrics_registry.gauge("eva_llm_hedge_rate", "Share of recent LLM calls that sent a hedged duplicate.",
+                       callback=lambda: get_llm_resilience().stats()["hedge_rate"])
@@ -0,0 +1,186 @@
+"""In-process semantic cache for first-turn LLM responses."""
+
+import os
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+
+
+@dataclass
+class CacheEntry:
+    query: str
+    response: str
+    created_at: float
+
+
+class _Namespace:
+    """LRU-ordered entries for one prompt type plus a lazily rebuilt matrix of their unit vectors."""
+
+    def __init__(self):
+        self.entries: "OrderedDict[int, CacheEntry]" = OrderedDict()
+        self.vectors: Dict[int, np.ndarray] = {}
+        self._ids: List[int] = []
+        self._matrix: Optional[np.ndarray] = None
+
+    def matrix(self):
+        if self._matrix is None:
+            self._ids = list(self.entries)
+            self._matrix = np.vstack([self.vectors[i] for i in self._ids]) if self._ids else None
+        return self._ids, self._matrix
+
+    def remove(self, entry_id: int):
+        self.entries.pop(entry_id, None)
+        self.vectors.pop(entry_id, None)
+        self._matrix = None
+
+    def add(self, entry_id: int, vector: np.ndarray, entry: CacheEntry):
+        self.entries[entry_id] = entry
+        self.vectors[entry_id] = vector
+        self._matrix = None
+
+
+class SemanticResponseCache:
+    """Caches LLM responses keyed by query embedding.
+
+    A lookup embeds the query and returns the response of the most similar cached
+    query in the same namespace if its cosine similarity reaches the threshold.
+    Namespaces separate prompt types (and prompt versions), so an answer produced
+    under one system prompt is never served for another. Entries expire after
+    `ttl_seconds`, and each namespace keeps at most `max_entries`, evicting the
+    least recently used.
+
+    Only use it for first-turn queries without history: the cached answer does not
+    depend on anything but the system prompt and the query.
+    """
+
+    def __init__(self, embed: Callable[[str], Awaitable[List[float]]], threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 ttl_seconds: int = SEMANTIC_CACHE_TTL, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+                 enabled: bool = SEMANTIC_CACHE_ENABLED):
+        """
+        Args:
+            embed: Coroutine function returning the embedding of a query.
+            threshold: Minimum cosine similarity for a hit.
+            ttl_seconds: Lifetime of an entry.
+            max_entries: Maximum entries per namespace.
+            enabled: If False, lookups always miss and nothing is stored.
+        """
+        self.embed = embed
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._namespaces: Dict[str, _Namespace] = {}
+        self._next_id = 0
+        self._stats = {"lookups": 0, "hits": 0, "misses": 0, "errors": 0, "stores": 0,
+                       "evictions": 0, "expirations": 0, "lookup_seconds_total": 0.0}
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    async def embed_query(self, query: str) -> Optional[np.ndarray]:
+        """Embed a query as a unit vector, or None if embedding fails."""
+        try:
+            return self._normalize(await self.embed(query.strip()))
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Error embedding query for semantic cache: {str(e)}")
+            return None
+
+    def _expire(self, namespace: _Namespace, now: float):
+        expired = [entry_id for entry_id, entry in namespace.entries.items()
+                   if now - entry.created_at > self.ttl_seconds]
+        for entry_id in expired:
+            namespace.remove(entry_id)
+        self._stats["expirations"] += len(expired)
+
+    async def lookup(self, namespace: str, query: str, vector: Optional[np.ndarray] = None) -> Optional[str]:
+        """Return a cached response for a similar query in the namespace, or None.
+
+        Pass `vector` to reuse an embedding the caller already has.
+        """
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        self._stats["lookups"] += 1
+        try:
+            if vector is None:
+                vector = await self.embed_query(query)
+            bucket = self._namespaces.get(namespace)
+            if vector is None or bucket is None:
+                self._stats["misses"] += 1
+                return None
+
+            self._expire(bucket, time.time())
+            ids, matrix = bucket.matrix()
+            if matrix is None:
+                self._stats["misses"] += 1
+                return None
+            similarities = matrix @ vector
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                self._stats["misses"] += 1
+                return None
+
+            entry_id = ids[best]
+            bucket.entries.move_to_end(entry_id)
+            self._stats["hits"] += 1
+            logger.info(f"Semantic cache hit in {namespace} (similarity {similarity:.3f}) for query "
+                        f"'{query[:50]}...' matching '{bucket.entries[entry_id].query[:50]}...'")
+            return bucket.entries[entry_id].response
+        finally:
+            self._stats["lookup_seconds_total"] += time.perf_counter() - start
+
+    async def store(self, namespace: str, query: str, response: str, vector: Optional[np.ndarray] = None) -> bool:
+        """Cache a response for a query, evicting the least recently used entry if the namespace is full."""
+        if not self.enabled:
+            return False
+        if vector is None:
+            vector = await self.embed_query(query)
+        if vector is None:
+            return False
+
+        bucket = self._namespaces.setdefault(namespace, _Namespace())
+        while len(bucket.entries) >= self.max_entries:
+            oldest_id = next(iter(bucket.entries))
+            bucket.remove(oldest_id)
+            self._stats["evictions"] += 1
+        self._next_id += 1
+        bucket.add(self._next_id, vector, CacheEntry(query=query, response=response, created_at=time.time()))
+        self._stats["stores"] += 1
+        return True
+
+    def clear(self, namespace: Optional[str] = None):
+        """Drop one namespace, or every namespace if none is given."""
+        if namespace is None:
+            self._namespaces.clear()
+        else:
+            self._namespaces.pop(namespace, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rate, lookup latency, threshold and entry counts."""
+        lookups = self._stats["lookups"]
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds,
+            "max_entries": self.max_entries,
+            "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+            "avg_lookup_ms": 1000 * self._stats["lookup_seconds_total"] / lookups if lookups else 0.0,
+            "entries": {name: len(bucket.entries) for name, bucket in self._namespaces.items()}
+        }
@@ -0,0 +1,361 @@
+"""Token and cost accounting for LLM and embedding calls, rolled up per request type, conversation and user."""
+
+import os
+import time
+import logging
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_community.callbacks.manager import get_openai_callback
+from langchain_community.callbacks.openai_info import TokenType, get_openai_token_cost_for_model
+
+logger = logging.getLogger(__name__)
+
+USAGE_TRACKING_ENABLED = os.getenv("USAGE_TRACKING_ENABLED", "true").lower() == "true"
+USAGE_RETENTION_DAYS = int(os.getenv("USAGE_RETENTION_DAYS", "35"))
+# Default tokens per user per UTC day; 0 disables the budget
+USAGE_USER_DAILY_TOKEN_BUDGET = int(os.getenv("USAGE_USER_DAILY_TOKEN_BUDGET", "0"))
+
+# USD per 1M tokens for embedding models (embedding calls do not report cost through the callback)
+EMBEDDING_PRICES = {
+    "text-embedding-ada-002": 0.10,
+    "text-embedding-3-small": 0.02,
+    "text-embedding-3-large": 0.13,
+}
+
+USAGE_FIELDS = ("calls", "prompt_tokens", "cached_prompt_tokens", "completion_tokens", "total_tokens",
+                "cost_usd", "latency_ms")
+
+# Conversation and user the current request is attributed to; tasks started by it inherit them
+_usage_context: ContextVar[Tuple[Optional[str], Optional[str]]] = ContextVar("usage_context", default=(None, None))
+
+# Usage of requests that name no user is rolled up under this id; it is never rate limited or budgeted
+ANONYMOUS_USER = "anonymous"
+
+
+def set_usage_context(conversation_id: Optional[str], user_id: Optional[str]):
+    """Attribute LLM and embedding calls made from here on (in this request) to a conversation and user."""
+    return _usage_context.set((conversation_id, user_id))
+
+
+def get_usage_context() -> Tuple[Optional[str], Optional[str]]:
+    """(conversation_id, user_id) the current request is attributed to."""
+    return _usage_context.get()
+
+
+def start_usage_attribution(conversation_id: Optional[str], body_user_id: Optional[str],
+                            header_user_id: Optional[str]) -> Optional[str]:
+    """Attribute this request's usage to its conversation and user (or ANONYMOUS_USER).
+
+    Returns the user's identity for per-user rate limits and budgets, or None when the
+    request names no user: all such requests share one usage bucket, which must not be
+    treated as a single user's quota.
+    """
+    user_id = body_user_id or header_user_id
+    set_usage_context(conversation_id, user_id or ANONYMOUS_USER)
+    return user_id or None
+
+
+def usage_day(now: Optional[float] = None) -> str:
+    return datetime.fromtimestamp(now if now is not None else time.time(), tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+def seconds_until_next_day(now: Optional[float] = None) -> int:
+    """Seconds until daily budgets reset (UTC midnight)."""
+    now = now if now is not None else time.time()
+    return int(86400 - now % 86400) or 86400
+
+
+def _decode(value) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else str(value)
+
+
+class UsageTracker:
+    """Rolls token usage, cost and latency up into Redis hashes.
+
+    Keys (all hashes with the fields in USAGE_FIELDS):
+    - `usage:{day}:type:{request_type}`: per request type (prompt path) per UTC day
+    - `usage:{day}:user:{user_id}`: per user per UTC day, which the daily budget is checked against
+    - `usage:conversation:{conversation_id}`: lifetime of a conversation
+    Day keys are indexed in `usage:{day}:types` / `usage:{day}:users` so a day's
+    rollups can be listed, and everything expires after USAGE_RETENTION_DAYS.
+
+    Without Redis the same rollups are kept in process memory.
+    """
+
+    def __init__(self, redis_client=None, async_redis_client=None, retention_days: int = USAGE_RETENTION_DAYS,
+                 default_daily_budget: int = USAGE_USER_DAILY_TOKEN_BUDGET, enabled: bool = USAGE_TRACKING_ENABLED):
+        self.redis = redis_client
+        self.async_redis = async_redis_client
+        self.ttl_seconds = retention_days * 86400
+        self.default_daily_budget = default_daily_budget
+        self.enabled = enabled
+        self._fallback: Dict[str, Dict[str, float]] = {}
+        self._fallback_sets: Dict[str, set] = {}
+        self._fallback_budgets: Dict[str, int] = {}
+
+    @staticmethod
+    def budget_key(user_id: str) -> str:
+        return f"usage:budget:{user_id}"
+
+    def _targets(self, request_type: str, conversation_id: Optional[str], user_id: Optional[str],
+                 day: str) -> Tuple[List[str], Dict[str, str]]:
+        keys = [f"usage:{day}:type:{request_type}"]
+        index = {f"usage:{day}:types": request_type}
+        if user_id:
+            keys.append(f"usage:{day}:user:{user_id}")
+            index[f"usage:{day}:users"] = user_id
+        if conversation_id:
+            keys.append(f"usage:conversation:{conversation_id}")
+        return keys, index
+
+    def _queue_record(self, pipe, keys: List[str], index: Dict[str, str], usage: Dict[str, float]):
+        for key in keys:
+            for field, value in usage.items():
+                if field == "cost_usd":
+                    pipe.hincrbyfloat(key, field, value)
+                else:
+                    pipe.hincrby(key, field, int(value))
+            pipe.expire(key, self.ttl_seconds)
+        for index_key, member in index.items():
+            pipe.sadd(index_key, member)
+            pipe.expire(index_key, self.ttl_seconds)
+
+    def _record_fallback(self, keys: List[str], index: Dict[str, str], usage: Dict[str, float]):
+        for key in keys:
+            totals = self._fallback.setdefault(key, {})
+            for field, value in usage.items():
+                totals[field] = totals.get(field, 0) + value
+        for index_key, member in index.items():
+            self._fallback_sets.setdefault(index_key, set()).add(member)
+
+    def _attribution(self, conversation_id: Optional[str], user_id: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        context_conversation, context_user = _usage_context.get()
+        return conversation_id or context_conversation, user_id or context_user
+
+    def record(self, request_type: str, usage: Dict[str, float], conversation_id: Optional[str] = None,
+               user_id: Optional[str] = None):
+        """Add one call's usage to the rollups (sync client; for scripts and sync agent code)."""
+        if not self.enabled:
+            return
+        conversation_id, user_id = self._attribution(conversation_id, user_id)
+        keys, index = self._targets(request_type, conversation_id, user_id, usage_day())
+        if self.redis is None:
+            self._record_fallback(keys, index, usage)
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            self._queue_record(pipe, keys, index, usage)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error recording usage for {request_type}: {str(e)}")
+            self._record_fallback(keys, index, usage)
+
+    async def arecord(self, request_type: str, usage: Dict[str, float], conversation_id: Optional[str] = None,
+                      user_id: Optional[str] = None):
+        """Async record()."""
+        if not self.enabled:
+            return
+        conversation_id, user_id = self._attribution(conversation_id, user_id)
+        keys, index = self._targets(request_type, conversation_id, user_id, usage_day())
+        if self.async_redis is None:
+            self._record_fallback(keys, index, usage)
+            return
+        try:
+            async with self.async_redis.pipeline(transaction=False) as pipe:
+                self._queue_record(pipe, keys, index, usage)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error recording usage for {request_type}: {str(e)}")
+            self._record_fallback(keys, index, usage)
+
+    @staticmethod
+    def _usage_from_callback(callback, latency_seconds: float) -> Dict[str, float]:
+        return {
+            "calls": max(callback.successful_requests, 1),
+            "prompt_tokens": callback.prompt_tokens,
+            "cached_prompt_tokens": getattr(callback, "prompt_tokens_cached", 0),
+            "completion_tokens": callback.completion_tokens,
+            "total_tokens": callback.total_tokens,
+            "cost_usd": callback.total_cost,
+            "latency_ms": int(latency_seconds * 1000)
+        }
+
+    @staticmethod
+    def embedding_usage(texts: List[str], model_name: str, latency_seconds: float = 0.0) -> Dict[str, float]:
+        """Usage of an embeddings call, counted with tiktoken (the callback does not see embeddings)."""
+        from memory.token_budget import count_tokens
+
+        tokens = sum(count_tokens(text) for text in texts)
+        return {
+            "calls": 1,
+            "prompt_tokens": tokens,
+            "total_tokens": tokens,
+            "cost_usd": tokens * EMBEDDING_PRICES.get(model_name, 0.0) / 1_000_000,
+            "latency_ms": int(latency_seconds * 1000)
+        }
+
+    @staticmethod
+    def estimated_chat_usage(prompt_text: str, completion_text: str, model_name: str,
+                             latency_seconds: float = 0.0) -> Dict[str, float]:
+        """Usage of a chat call that reported none (streamed responses), counted with tiktoken."""
+        from memory.token_budget import count_tokens
+
+        prompt_tokens = count_tokens(prompt_text, model_name)
+        completion_tokens = count_tokens(completion_text, model_name)
+        try:
+            cost = (get_openai_token_cost_for_model(model_name, prompt_tokens)
+                    + get_openai_token_cost_for_model(model_name, completion_tokens, token_type=TokenType.COMPLETION))
+        except ValueError:
+            cost = 0.0  # Model without a known price
+        return {
+            "calls": 1,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "cost_usd": cost,
+            "latency_ms": int(latency_seconds * 1000)
+        }
+
+    @asynccontextmanager
+    async def atrack(self, request_type: str, conversation_id: Optional[str] = None, user_id: Optional[str] = None):
+        """Record the tokens, cost and latency of the OpenAI chat calls made inside the block.
+
+        Calls made in tasks started inside the block are included. A nested `atrack`
+        records its own calls, which the outer block then does not count again.
+        """
+        if not self.enabled:
+            yield None
+            return
+        start = time.perf_counter()
+        with get_openai_callback() as callback:
+            try:
+                yield callback
+            finally:
+                if callback.successful_requests or callback.total_tokens:
+                    await self.arecord(request_type, self._usage_from_callback(callback, time.perf_counter() - start),
+                                       conversation_id, user_id)
+
+    @contextmanager
+    def track(self, request_type: str, conversation_id: Optional[str] = None, user_id: Optional[str] = None):
+        """Sync atrack() for agent code that calls chains synchronously."""
+        if not self.enabled:
+            yield None
+            return
+        start = time.perf_counter()
+        with get_openai_callback() as callback:
+            try:
+                yield callback
+            finally:
+                if callback.successful_requests or callback.total_tokens:
+                    self.record(request_type, self._usage_from_callback(callback, time.perf_counter() - start),
+                                conversation_id, user_id)
+
+    async def _aread_hashes(self, keys: List[str]) -> List[Dict[str, float]]:
+        if self.async_redis is None:
+            return [dict(self._fallback.get(key, {})) for key in keys]
+        async with self.async_redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hgetall(key)
+            raw = await pipe.execute()
+        return [{_decode(field): float(value) for field, value in entry.items()} for entry in raw]
+
+    async def _amembers(self, key: str) -> List[str]:
+        if self.async_redis is None:
+            return sorted(self._fallback_sets.get(key, set()))
+        return sorted(_decode(member) for member in await self.async_redis.smembers(key))
+
+    @staticmethod
+    def _with_averages(totals: Dict[str, float]) -> Dict[str, float]:
+        rollup = {field: totals.get(field, 0) for field in USAGE_FIELDS}
+        calls = rollup["calls"]
+        rollup["avg_latency_ms"] = rollup["latency_ms"] / calls if calls else 0.0
+        rollup["avg_total_tokens"] = rollup["total_tokens"] / calls if calls else 0.0
+        return rollup
+
+    async def request_type_rollups(self, day: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+        """Usage per request type for a UTC day (default today)."""
+        day = day or usage_day()
+        types = await self._amembers(f"usage:{day}:types")
+        totals = await self._aread_hashes([f"usage:{day}:type:{request_type}" for request_type in types])
+        return {request_type: self._with_averages(values) for request_type, values in zip(types, totals)}
+
+    async def user_rollup(self, user_id: str, day: Optional[str] = None) -> Dict[str, Any]:
+        """Usage of one user for a UTC day, with their daily budget."""
+        day = day or usage_day()
+        [totals] = await self._aread_hashes([f"usage:{day}:user:{user_id}"])
+        budget = await self.get_budget(user_id)
+        rollup = self._with_averages(totals)
+        return {**rollup, "day": day, "daily_token_budget": budget,
+                "remaining_tokens": max(budget - rollup["total_tokens"], 0) if budget else None}
+
+    async def user_rollups(self, day: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+        day = day or usage_day()
+        users = await self._amembers(f"usage:{day}:users")
+        totals = await self._aread_hashes([f"usage:{day}:user:{user_id}" for user_id in users])
+        return {user_id: self._with_averages(values) for user_id, values in zip(users, totals)}
+
+    async def conversation_rollup(self, conversation_id: str) -> Dict[str, float]:
+        [totals] = await self._aread_hashes([f"usage:conversation:{conversation_id}"])
+        return self._with_averages(totals)
+
+    async def get_budget(self, user_id: str) -> int:
+        """Daily token budget of a user: their override if set, else the default (0 = unlimited)."""
+        try:
+            if self.async_redis is not None:
+                value = await self.async_redis.get(self.budget_key(user_id))
+            else:
+                value = self._fallback_budgets.get(user_id)
+            return int(value) if value is not None else self.default_daily_budget
+        except Exception as e:
+            logger.error(f"Error reading token budget for {user_id}: {str(e)}")
+            return self.default_daily_budget
+
+    async def set_budget(self, user_id: str, daily_tokens: Optional[int]):
+        """Override a user's daily token budget; None restores the default."""
+        if self.async_redis is not None:
+            if daily_tokens is None:
+                await self.async_redis.delete(self.budget_key(user_id))
+            else:
+                await self.async_redis.set(self.budget_key(user_id), int(daily_tokens))
+        elif daily_tokens is None:
+            self._fallback_budgets.pop(user_id, None)
+        else:
+            self._fallback_budgets[user_id] = int(daily_tokens)
+
+    async def check_budget(self, user_id: Optional[str]) -> Tuple[bool, int, int]:
+        """Whether the user may make another LLM call today. Returns (allowed, tokens used, budget).
+
+        Fails open: if usage cannot be read the call is allowed.
+        """
+        if not self.enabled or not user_id:
+            return True, 0, 0
+        budget = await self.get_budget(user_id)
+        if not budget:
+            return True, 0, 0
+        try:
+            [totals] = await self._aread_hashes([f"usage:{usage_day()}:user:{user_id}"])
+        except Exception as e:
+            logger.error(f"Error reading usage for {user_id}: {str(e)}")
+            return True, 0, budget
+        used = int(totals.get("total_tokens", 0))
+        return used < budget, used, budget
+
+
+_usage_tracker: Optional[UsageTracker] = None
+
+
+def get_usage_tracker() -> UsageTracker:
+    """Return the process-wide usage tracker, creating an in-process-only one on first use."""
+    global _usage_tracker
+    if _usage_tracker is None:
+        _usage_tracker = UsageTracker()
+    return _usage_tracker
+
+
+def set_usage_tracker(tracker: Optional[UsageTracker]):
+    """Install (or reset, with None) the process-wide usage tracker."""
+    global _usage_tracker
+    _usage_tracker = tracker
@@ -0,0 +1,25 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+from fastapi import HTTPException
+
+from services.admin_auth import check_admin_key
+
+def test_admin_key_is_required_and_fails_closed():
+    """Test that management requests need the configured key, and are refused when none is configured."""
+    check_admin_key("s3cret", expected="s3cret")
+
+    for provided in (None, "", "wrong"):
+        with pytest.raises(HTTPException) as error:
+            check_admin_key(provided, expected="s3cret")
+        assert error.value.status_code == 403
+
+    with pytest.raises(HTTPException) as error:
+        check_admin_key("anything", expected="")
+    assert error.value.status_code == 403
@@ -0,0 +1,35 @@
+import sys
+import asyncio
+from pathlib import Path
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+from agents.artifact_cache import ArtifactCache, DiskArtifactStore
+
+def test_disk_fallback_hits_and_misses(tmp_path):
+    """Test that the disk store serves repeated chunks and counts hits and misses."""
+    cache = ArtifactCache(redis_client=None, disk_store=DiskArtifactStore(str(tmp_path / "cache.sqlite3")))
+    key = ArtifactCache.key("guideline", "gpt-4o-mini", "v1", "ACM Code 1.6: Respect privacy.")
+
+    async def run():
+        first = await cache.get(key)
+        await cache.set(key, "Title: Respect privacy")
+        return first, await cache.get(key)
+
+    first, second = asyncio.run(run())
+    assert first is None
+    assert second == "Title: Respect privacy"
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+    assert key != ArtifactCache.key("guideline", "gpt-4o-mini", "v2", "ACM Code 1.6: Respect privacy.")
+
+def test_disk_store_evicts_least_recently_used(tmp_path):
+    """Test that the disk store keeps at most max_entries, dropping the least recently read."""
+    store = DiskArtifactStore(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    store.set("a", "1")
+    store.set("b", "2")
+    assert store.get("a") == "1"
+    assert store.set("c", "3") == 1
+    assert store.get("b") is None
+    assert store.get("a") == "1" and store.get("c") == "3"
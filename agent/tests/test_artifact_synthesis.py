@@ -0,0 +1,94 @@
+import sys
+import json
+import threading
+import asyncio
+from pathlib import Path
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from agents.artifact_synthesis import card_to_artifact, parse_card, presynthesize_cards
+from agents import runtime as runtime_module
+from agents.runtime import AgentRuntime, RuntimeUnavailable, aget_runtime
+from services.model_routing import ModelRouter, set_model_router
+
+def test_parse_case_study_card():
+    """Test parsing of a case study synthesis into card fields and an artifact."""
+    card = parse_card("Title: Tracking app\nSummary: Location data sold.\nOutcome: Fined.\nSource: x.pdf", "cases.pdf")
+    assert card["title"] == "Tracking app"
+    assert card["description"] == "Location data sold."
+    assert card["outcome"] == "Fined."
+
+    artifact = card_to_artifact(card, 0.25)
+    assert artifact["relevance"] == 0.75
+    assert artifact["summary"] == "Location data sold."
+
+def test_presynthesize_cards_stores_card_per_chunk():
+    """Test that each guideline/case study chunk gets its own card and other chunks are skipped."""
+    shared_metadata = {"filename": "acm.pdf", "artifact_type": "guideline"}
+    chunks = [
+        {"content": "1.6 Respect privacy.", "metadata": shared_metadata},
+        {"content": "1.7 Honor confidentiality.", "metadata": shared_metadata},
+        {"content": "Survey results.", "metadata": {"filename": "r.pdf", "artifact_type": "unknown"}},
+    ]
+    llm = FakeListChatModel(responses=["Title: Privacy\nDescription: Respect privacy.\nSource: acm.pdf",
+                                       "Title: Confidentiality\nDescription: Keep secrets.\nSource: acm.pdf"])
+
+    created = asyncio.run(presynthesize_cards(chunks, llm, "fake-model", concurrency=1))
+
+    assert created == 2
+    assert [chunk["metadata"]["card"]["title"] for chunk in chunks[:2]] == ["Privacy", "Confidentiality"]
+    assert "card" not in chunks[2]["metadata"]
+    assert "card" not in shared_metadata
+
+def test_runtime_reuses_synthesis_chains_per_route(tmp_path, monkeypatch):
+    """Test that synthesis runnables are built once per artifact type and route, not per call."""
+    routes_path = tmp_path / "model_routes.json"
+    routes_path.write_text(json.dumps({"synthesis": {"model": "gpt-4o-mini", "max_tokens": 400}}))
+    router = ModelRouter(routes_path, reload_interval=0)
+    set_model_router(router)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    try:
+        runtime = AgentRuntime({"openai_api_key": "sk-test"})
+        chain = runtime.synthesis_chain("guideline")
+        assert runtime.synthesis_chain("guideline") is chain
+        assert runtime.synthesis_chain("case_study") is not chain
+
+        routes_path.write_text(json.dumps({"synthesis": {"model": "gpt-3.5-turbo", "max_tokens": 200}}))
+        assert router.reload()
+        rerouted = runtime.synthesis_chain("guideline")
+        assert rerouted is not chain and rerouted is runtime.synthesis_chain("guideline")
+        assert rerouted.steps[1].model_name == "gpt-3.5-turbo"
+    finally:
+        set_model_router(None)
+
+def test_failed_runtime_build_fails_fast_until_retry_interval(monkeypatch):
+    """Test that a failed build is not retried on every request and runs off the event loop."""
+    build_threads = []
+
+    def failing_build(*args, **kwargs):
+        build_threads.append(threading.current_thread())
+        raise RuntimeError("vector store missing")
+
+    monkeypatch.setattr(AgentRuntime, "from_config_file", failing_build)
+    monkeypatch.setattr(runtime_module, "RUNTIME_RETRY_INTERVAL", 60.0)
+    monkeypatch.setattr(runtime_module, "_last_build_failure", None)
+    monkeypatch.setattr(runtime_module, "_runtime", None)
+
+    async def run():
+        outcomes = await asyncio.gather(aget_runtime(), aget_runtime(), aget_runtime(), return_exceptions=True)
+        return outcomes, threading.current_thread()
+
+    outcomes, loop_thread = asyncio.run(run())
+    assert all(isinstance(outcome, RuntimeUnavailable) for outcome in outcomes)
+    assert len(build_threads) == 1 and build_threads[0] is not loop_thread
+
+    monkeypatch.setattr(runtime_module, "RUNTIME_RETRY_INTERVAL", 0.0)
+    try:
+        asyncio.run(aget_runtime())
+    except RuntimeUnavailable:
+        pass
+    assert len(build_threads) == 2
@@ -0,0 +1,59 @@
+import sys
+import asyncio
+from pathlib import Path
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+import httpx
+
+from services import backend_client
+from services.backend_client import close_backend_client, create_backend_client, get_backend_client
+
+def mock_backend(monkeypatch, handler):
+    """Answer requests from the pooled transport with `handler` instead of the network."""
+    mock = httpx.MockTransport(handler)
+    monkeypatch.setattr(httpx.AsyncHTTPTransport, "handle_async_request",
+                        lambda self, request: mock.handle_async_request(request))
+
+def test_shared_client_is_reused_until_closed(monkeypatch):
+    """Test that all calls go through one pooled client and that shutdown closes it."""
+    paths = []
+
+    def handler(request):
+        paths.append(request.url.path)
+        return httpx.Response(200, json={"ok": True})
+
+    mock_backend(monkeypatch, handler)
+    monkeypatch.setattr(backend_client, "_client", None)
+
+    async def run():
+        first = get_backend_client()
+        responses = [await get_backend_client().get("http://backend/api/a"),
+                     await get_backend_client().post("http://backend/api/b", json={})]
+        assert get_backend_client() is first
+        await close_backend_client()
+        return first, responses
+
+    client, responses = asyncio.run(run())
+    assert [response.json() for response in responses] == [{"ok": True}, {"ok": True}]
+    assert paths == ["/api/a", "/api/b"]
+    assert client.is_closed and backend_client._client is None
+
+def test_client_applies_configured_limits_and_timeouts(monkeypatch):
+    """Test the pool limits and timeouts, and the HTTP/1.1 fallback when 'h2' is missing."""
+    monkeypatch.setattr(backend_client, "BACKEND_MAX_CONNECTIONS", 7)
+    monkeypatch.setattr(backend_client, "BACKEND_MAX_KEEPALIVE", 3)
+    monkeypatch.setattr(backend_client, "BACKEND_KEEPALIVE_EXPIRY", 5.0)
+    monkeypatch.setattr(backend_client, "BACKEND_CONNECT_TIMEOUT", 1.5)
+    monkeypatch.setattr(backend_client, "BACKEND_TIMEOUT", 4.0)
+    monkeypatch.setattr(backend_client, "BACKEND_HTTP2", True)
+    monkeypatch.setattr(backend_client, "_http2_available", lambda: False)
+
+    client = create_backend_client()
+    pool = client._transport._pool
+    assert (pool._max_connections, pool._max_keepalive_connections, pool._keepalive_expiry) == (7, 3, 5.0)
+    assert pool._http2 is False and pool._http1 is True
+    assert client.timeout.connect == 1.5 and client.timeout.read == 4.0
+    asyncio.run(client.aclose())
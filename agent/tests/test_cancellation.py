@@ -0,0 +1,86 @@
+import sys
+import asyncio
+from pathlib import Path
+
+import pytest
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+from starlette.requests import Request
+
+from services.cancellation import ClientDisconnected, cancel_on_disconnect, run_until_disconnected
+from services.idempotency import RequestCoalescer
+
+def make_request(disconnect_after: float):
+    """Request whose client sends a JSON body, then disconnects after `disconnect_after` seconds."""
+    messages = [{"type": "http.request", "body": b'{"userQuery": "hi"}', "more_body": False}]
+    disconnect_at = asyncio.get_running_loop().time() + disconnect_after
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        remaining = disconnect_at - asyncio.get_running_loop().time()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+        return {"type": "http.disconnect"}
+
+    scope = {"type": "http", "method": "POST", "path": "/api/v1/conversation/message", "headers": [],
+             "query_string": b""}
+    return Request(scope, receive)
+
+def test_work_is_cancelled_when_the_client_disconnects():
+    """Test that the running work sees the cancellation and its cleanup runs."""
+    async def run():
+        steps = []
+
+        @cancel_on_disconnect
+        async def endpoint(request: Request):
+            body = await request.json()
+            steps.append(body["userQuery"])
+            try:
+                await asyncio.sleep(5)  # The LLM call
+                steps.append("saved")
+            finally:
+                steps.append("slot released")
+
+        with pytest.raises(ClientDisconnected):
+            await asyncio.wait_for(endpoint(request=make_request(0.05)), 2)
+        assert steps == ["hi", "slot released"]
+
+    asyncio.run(run())
+
+def test_finished_work_is_returned():
+    """Test that work finishing before any disconnect returns normally."""
+    async def run():
+        async def work():
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        assert await run_until_disconnected(make_request(5), work(), poll_interval=0.01) == "answer"
+
+    asyncio.run(run())
+
+def test_duplicate_takes_over_when_the_first_request_is_abandoned():
+    """Test that a coalesced duplicate runs the turn itself if the first request is cancelled."""
+    async def run():
+        coalescer = RequestCoalescer()
+        calls = []
+
+        async def producer():
+            calls.append("call")
+            await asyncio.sleep(0.05)
+            return {"answer": len(calls)}, True
+
+        first = asyncio.create_task(coalescer.run("turn", producer))
+        await asyncio.sleep(0.01)
+        duplicate = asyncio.create_task(coalescer.run("turn", producer))
+        await asyncio.sleep(0.01)
+        first.cancel()
+
+        result, outcome = await duplicate
+        assert result == {"answer": 2} and outcome == "executed"
+        assert first.cancelled()
+
+    asyncio.run(run())
@@ -0,0 +1,54 @@
+import sys
+import asyncio
+from pathlib import Path
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+import fakeredis
+
+from memory.conversation_memory import ConversationMemory
+from services.conversation_channel import ConversationChannel
+
+def test_history_is_read_once_and_saved_in_background():
+    """Test that turns are served from the channel's cache and still reach conversation memory."""
+    async def run():
+        memory = ConversationMemory(async_redis_client=fakeredis.aioredis.FakeRedis())
+        await memory.asave_exchange("conv-1", "first question", "first answer")
+
+        channel = ConversationChannel("conv-1", memory)
+        await channel.load()
+        assert "first question" in channel.context()
+
+        channel.record("second question", "second answer")
+        assert "second answer" in channel.context()  # Available before the save finishes
+        await channel.aclose()
+
+        history = await memory.aget_history("conv-1", 10)
+        assert [exchange["user"] for exchange in history] == ["first question", "second question"]
+
+    asyncio.run(run())
+
+def test_settings_limit_the_prompt_history():
+    """Test configure() and that historyLimit and includeHistory shape the prompt context."""
+    async def run():
+        channel = ConversationChannel("conv-2", ConversationMemory(async_redis_client=fakeredis.aioredis.FakeRedis()))
+        await channel.load()
+        for turn in range(3):
+            channel.record(f"question {turn}", f"answer {turn}")
+
+        settings = channel.configure({"historyLimit": 1, "temperature": 0.2, "unknown": True})
+        assert settings["historyLimit"] == 1 and "unknown" not in settings
+        assert "question 2" in channel.context() and "question 1" not in channel.context()
+
+        channel.configure({"includeHistory": False})
+        assert channel.context() == ""
+
+        created = []
+        for _ in range(2):
+            channel.llm_for(("default_system", 0.2), lambda: created.append("llm") or object())
+        assert created == ["llm"]
+        await channel.aclose()
+
+    asyncio.run(run())
@@ -0,0 +1,116 @@
+import sys
+import json
+import asyncio
+from pathlib import Path
+import pytest
+import fakeredis
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+from memory.conversation_memory import ConversationMemory
+
+@pytest.fixture
+def memory():
+    """Return a ConversationMemory using the in-memory fallback."""
+    return ConversationMemory(redis_client=None, async_redis_client=None, max_stored_turns=3)
+
+def test_save_and_get_history(memory):
+    """Test that exchanges are returned oldest first and limited to max_turns."""
+    for i in range(2):
+        assert memory.save_exchange("conv-1", f"question {i}", f"answer {i}")
+
+    history = memory.get_history("conv-1", max_turns=10)
+    assert [exchange["user"] for exchange in history] == ["question 0", "question 1"]
+    assert memory.get_history("conv-1", max_turns=1)[0]["assistant"] == "answer 1"
+
+def test_history_is_capped(memory):
+    """Test that only max_stored_turns exchanges are kept."""
+    for i in range(5):
+        memory.save_exchange("conv-1", f"question {i}", f"answer {i}")
+
+    history = memory.get_history("conv-1", max_turns=0)
+    assert [exchange["user"] for exchange in history] == ["question 2", "question 3", "question 4"]
+
+def test_async_api_matches_sync(memory):
+    """Test the async API against the same storage."""
+    async def run():
+        await memory.asave_exchange("conv-2", "hello", "hi there")
+        history, extras = await memory.aget_history_with("conv-2", 5, extra_keys=["conversation:conv-2:summary"])
+        prompt = await memory.aformat_for_prompt("conv-2")
+        await memory.aclear_history("conv-2")
+        return history, extras, prompt, await memory.aget_history("conv-2")
+
+    history, extras, prompt, cleared = asyncio.run(run())
+    assert history[0]["user"] == "hello"
+    assert extras == {"conversation:conv-2:summary": None}
+    assert "USER: hello" in prompt
+    assert cleared == []
+
+def test_legacy_history_conversion(memory):
+    """Test conversion of a legacy JSON-string history into list items."""
+    legacy = json.dumps([{"user": f"q{i}", "assistant": f"a{i}"} for i in range(5)])
+
+    items = memory._legacy_to_list(b"string", legacy)
+    assert [json.loads(item)["user"] for item in items] == ["q2", "q3", "q4"]
+    assert memory._legacy_to_list(b"list", None) is None
+
+def seed_legacy_history(client, conversation_id: str, turns: int):
+    """Store a history the way older versions did: one JSON string without a TTL."""
+    legacy = [{"user": f"q{i}", "assistant": f"a{i}", "timestamp": f"t{i}"} for i in range(turns)]
+    client.set(f"conversation:{conversation_id}:history", json.dumps(legacy))
+
+def test_legacy_history_is_migrated_on_write_and_read():
+    """Test that a write or read hitting a legacy string key converts it to a list with a TTL."""
+    server = fakeredis.FakeServer()
+    sync_client = fakeredis.FakeRedis(server=server)
+    memory = ConversationMemory(sync_client, fakeredis.aioredis.FakeRedis(server=server), expiry_seconds=600)
+    seed_legacy_history(sync_client, "conv-sync", 2)
+    seed_legacy_history(sync_client, "conv-async", 2)
+
+    assert memory.save_exchange("conv-sync", "q2", "a2")
+    history = asyncio.run(memory.aget_history("conv-sync", 0))
+    assert [exchange["user"] for exchange in history] == ["q0", "q1", "q2"]
+
+    async_history = asyncio.run(memory.aget_history("conv-async", 0))
+    assert [exchange["user"] for exchange in async_history] == ["q0", "q1"]
+
+    for conversation_id in ("conv-sync", "conv-async"):
+        key = memory.get_conversation_key(conversation_id)
+        assert sync_client.type(key) == b"list"
+        assert 0 < sync_client.ttl(key) <= 600
+
+def test_migrate_legacy_keys_converts_only_string_keys():
+    """Test the bulk migration used by scripts."""
+    sync_client = fakeredis.FakeRedis()
+    memory = ConversationMemory(sync_client, None, max_stored_turns=3)
+    seed_legacy_history(sync_client, "conv-1", 5)
+    memory.save_exchange("conv-2", "question", "answer")
+
+    assert memory.migrate_legacy_keys() == 1
+    assert [exchange["user"] for exchange in memory.get_history("conv-1", 0)] == ["q2", "q3", "q4"]
+    assert sync_client.ttl(memory.get_conversation_key("conv-1")) > 0
+    assert len(memory.get_history("conv-2", 0)) == 1
+
+def test_token_budgeted_history_schedules_summary(memory):
+    """Test that older turns are folded into a background summary once they go stale."""
+    from memory.token_budget import TokenBudgetedHistory
+
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    llm = FakeListChatModel(responses=["The user asked about privacy."])
+    memory.max_stored_turns = 20
+    history = TokenBudgetedHistory(memory, llm_provider=lambda: llm, token_budget=60, min_stale_turns=2)
+
+    async def run():
+        for i in range(6):
+            await memory.asave_exchange("conv-3", f"question {i} " * 5, f"answer {i} " * 5)
+        first = await history.aformat_for_prompt("conv-3")
+        await history.aclose()
+        return first, await history.aformat_for_prompt("conv-3")
+
+    first, second = asyncio.run(run())
+    assert "question 5" in first and "question 0" not in first
+    assert "SUMMARY OF EARLIER CONVERSATION" not in first
+    assert "The user asked about privacy." in second
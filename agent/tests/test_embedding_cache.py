@@ -0,0 +1,63 @@
+import sys
+import asyncio
+from pathlib import Path
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+import fakeredis
+import numpy as np
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+from services.embedding_cache import CachedEmbeddings, EmbeddingCache
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """Fake embeddings that count how many texts reach the model."""
+    calls: int = 0
+
+    def embed_documents(self, texts):
+        self.calls += len(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.calls += 1
+        return super().embed_query(text)
+
+    async def aembed_query(self, text):
+        await asyncio.sleep(0.01)
+        return self.embed_query(text)
+
+def test_documents_only_embed_misses():
+    """Test that cached texts and duplicates within a batch are not sent to the model again."""
+    model = CountingEmbeddings(size=8)
+    embeddings = CachedEmbeddings(model, cache=EmbeddingCache(), model_name="fake")
+
+    first = embeddings.embed_documents(["a", "b", "a"])
+    second = embeddings.embed_documents(["b", "c"])
+
+    assert model.calls == 3
+    assert first[0] == first[2]
+    assert np.allclose(first[0], DeterministicFakeEmbedding(size=8).embed_query("a"), atol=1e-6)
+    assert second[0] == first[1]
+
+def test_concurrent_queries_share_one_call_and_redis_tier():
+    """Test that concurrent identical queries embed once and that another process finds the vector in Redis."""
+    server = fakeredis.FakeServer()
+    model = CountingEmbeddings(size=8)
+
+    async def run():
+        cache = EmbeddingCache(async_redis_client=fakeredis.aioredis.FakeRedis(server=server))
+        embeddings = CachedEmbeddings(model, cache=cache, model_name="fake")
+        vectors = await asyncio.gather(*(embeddings.aembed_query("privacy") for _ in range(3)))
+        assert cache.stats()["coalesced"] == 2
+
+        other_process = EmbeddingCache(async_redis_client=fakeredis.aioredis.FakeRedis(server=server))
+        reloaded = await CachedEmbeddings(model, cache=other_process, model_name="fake").aembed_query("privacy")
+        assert other_process.stats()["l2_hits"] == 1
+        return vectors, reloaded
+
+    vectors, reloaded = asyncio.run(run())
+    assert model.calls == 1
+    assert vectors[0] == vectors[1] == vectors[2]
+    assert reloaded == vectors[0]
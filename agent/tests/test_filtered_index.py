@@ -0,0 +1,65 @@
+import sys
+import asyncio
+from pathlib import Path
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+
+from agents.filtered_index import FilteredVectorIndex
+
+def build_index():
+    """200 chunks: 4 case studies among guidelines, spread over three files."""
+    texts = [f"chunk {i}" for i in range(200)]
+    metadatas = [{"artifact_type": "case_study" if i % 50 == 0 else "guideline", "filename": f"file{i % 3}.pdf"}
+                 for i in range(200)]
+    vectorstore = FAISS.from_texts(texts, DeterministicFakeEmbedding(size=16), metadatas=metadatas)
+    return vectorstore, FilteredVectorIndex(vectorstore)
+
+def test_filtered_search_returns_whole_small_partition():
+    """Test that a rare artifact type is found even when it is outside the unfiltered top-k."""
+    vectorstore, index = build_index()
+    assert index.values("artifact_type") == {"case_study": 4, "guideline": 196}
+
+    results = index.search("privacy", k=5, filter={"artifact_type": "case_study"})
+
+    assert sorted(doc.page_content for doc, _ in results) == ["chunk 0", "chunk 100", "chunk 150", "chunk 50"]
+    assert [score for _, score in results] == sorted(score for _, score in results)
+
+def test_filtered_search_matches_brute_force_top_k():
+    """Test that combined filters give the exact top-k of the matching chunks."""
+    vectorstore, index = build_index()
+    query_filter = {"artifact_type": ["guideline", "case_study"], "filename": "file1.pdf"}
+
+    results = asyncio.run(index.asearch("consent", k=3, filter=query_filter))
+
+    everything = vectorstore.similarity_search_with_score("consent", k=200)
+    expected = [doc.page_content for doc, _ in everything if doc.metadata["filename"] == "file1.pdf"][:3]
+    assert [doc.page_content for doc, _ in results] == expected
+    assert index.search("consent", k=3, filter={"filename": "missing.pdf"}) == []
+
+def test_combined_retrieval_meets_quotas_with_one_embedding():
+    """Test that the single-pass retrieval splits by type and tops up a rare type without re-embedding."""
+    from agents.langchain_agent import LangChainAgent
+
+    class CountingEmbedding(DeterministicFakeEmbedding):
+        calls: int = 0
+
+        async def aembed_query(self, text):
+            self.calls += 1
+            return self.embed_query(text)
+
+    vectorstore, index = build_index()
+    embeddings = CountingEmbedding(size=16)
+    vectorstore.embedding_function = embeddings
+    agent = LangChainAgent.__new__(LangChainAgent)
+    agent.vectorstore, agent.filtered_index = vectorstore, index
+
+    docs = asyncio.run(agent.aretrieve_artifact_docs_by_type("privacy", {"guideline": 3, "case_study": 2}))
+
+    assert embeddings.calls == 1
+    assert len(docs["guideline"]) == 3 and len(docs["case_study"]) == 2
+    assert all(doc.metadata["artifact_type"] == "case_study" for doc, _ in docs["case_study"])
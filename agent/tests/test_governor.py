@@ -0,0 +1,93 @@
+import sys
+import asyncio
+from pathlib import Path
+
+import pytest
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+from services.governor import AdmissionRejected, LLMGovernor
+
+def test_waiters_are_served_by_priority():
+    """Test that a released slot goes to interactive calls before synthesis and offline work."""
+    async def run():
+        governor = LLMGovernor(max_concurrency=1, max_queue=10, user_calls_per_minute=0)
+        order = []
+
+        async def call(priority):
+            async with governor.slot(priority):
+                order.append(priority)
+
+        await governor.acquire("interactive")
+        tasks = []
+        for priority in ("offline", "synthesis", "feedback", "interactive"):
+            tasks.append(asyncio.create_task(call(priority)))
+            await asyncio.sleep(0)
+        assert governor.stats()["queued"] == 4
+
+        governor.release()
+        await asyncio.gather(*tasks)
+        assert order == ["interactive", "feedback", "synthesis", "offline"]
+        assert governor.active == 0
+
+    asyncio.run(run())
+
+def test_full_queue_evicts_lower_priority_or_rejects():
+    """Test that a full queue sheds background work for interactive calls and rejects the rest fast."""
+    async def run():
+        governor = LLMGovernor(max_concurrency=1, max_queue=1, user_calls_per_minute=0)
+        await governor.acquire("interactive")
+
+        background = asyncio.create_task(governor.acquire("offline"))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(governor.acquire("interactive"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected) as evicted:
+            await background
+        assert evicted.value.reason == "evicted"
+
+        with pytest.raises(AdmissionRejected) as rejected:
+            await governor.acquire("interactive")
+        assert rejected.value.reason == "queue_full" and rejected.value.retry_after >= 1
+
+        governor.release()
+        await interactive
+        governor.release()
+        assert governor.active == 0 and governor.stats()["queued"] == 0
+
+    asyncio.run(run())
+
+def test_queue_wait_times_out():
+    """Test that a waiter is rejected once its queue timeout passes and leaves the queue."""
+    async def run():
+        governor = LLMGovernor(max_concurrency=1, max_queue=5, queue_timeout=0.05, user_calls_per_minute=0)
+        await governor.acquire("interactive")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await governor.acquire("interactive")
+        assert rejected.value.reason == "timed_out"
+        assert governor.stats()["queued"] == 0
+        governor.release()
+        assert governor.active == 0
+
+    asyncio.run(run())
+
+def test_per_user_token_bucket():
+    """Test that a user is rate limited after their burst while other users are not."""
+    async def run():
+        governor = LLMGovernor(max_concurrency=10, user_calls_per_minute=6, user_burst=2)
+        for _ in range(2):
+            async with governor.slot("interactive", "alice"):
+                pass
+        with pytest.raises(AdmissionRejected) as rejected:
+            governor.check("interactive", "alice")
+        assert rejected.value.reason == "rate_limited"
+        assert 1 <= rejected.value.retry_after <= 10
+
+        async with governor.slot("interactive", "bob"):
+            pass
+        assert governor.stats()["rate_limited"] == 1
+
+    asyncio.run(run())
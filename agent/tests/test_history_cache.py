@@ -0,0 +1,108 @@
+import sys
+import asyncio
+from pathlib import Path
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+import fakeredis
+
+from memory.conversation_memory import ConversationMemory
+from memory.history_cache import HistoryCache
+
+def make_worker(server, worker_id: str, **cache_options):
+    """ConversationMemory of one worker process, with its own L1 in front of the shared Redis."""
+    async_client = fakeredis.aioredis.FakeRedis(server=server)
+    cache = HistoryCache(async_client, worker_id=worker_id, **cache_options)
+    memory = ConversationMemory(fakeredis.FakeRedis(server=server), async_client, history_cache=cache)
+    return memory, cache
+
+async def wait_until(condition, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not reached"
+        await asyncio.sleep(0.01)
+
+def test_reads_are_served_from_l1_after_the_first():
+    """Test that repeated reads and this worker's own writes keep the history in memory."""
+    async def run():
+        server = fakeredis.FakeServer()
+        memory, cache = make_worker(server, "worker-a")
+        await cache.start()
+        await wait_until(lambda: cache.active)
+
+        summary_key = memory.get_summary_key("conv-1")
+        await memory.asave_exchange("conv-1", "question 0", "answer 0")
+        await memory.aget_history_with("conv-1", 0, extra_keys=[summary_key])
+        await memory.asave_exchange("conv-1", "question 1", "answer 1")
+        await memory.aset_value(summary_key, '{"summary": "earlier"}', conversation_id="conv-1")
+
+        history, extras = await memory.aget_history_with("conv-1", 1, extra_keys=[summary_key])
+        stats = cache.stats()
+        await cache.stop()
+        return history, extras, stats
+
+    history, extras, stats = asyncio.run(run())
+    assert [exchange["user"] for exchange in history] == ["question 1"]
+    assert extras == {"conversation:conv-1:summary": b'{"summary": "earlier"}'}
+    assert stats["misses"] == 1 and stats["hits"] == 1 and stats["conversations"] == 1
+
+def test_writes_from_another_worker_invalidate_l1():
+    """Test that a turn saved by another worker (or a script) is seen on the next read."""
+    async def run():
+        server = fakeredis.FakeServer()
+        worker_a, cache_a = make_worker(server, "worker-a")
+        worker_b, cache_b = make_worker(server, "worker-b")
+        await cache_a.start()
+        await cache_b.start()
+        await wait_until(lambda: cache_a.active and cache_b.active)
+
+        await worker_a.asave_exchange("conv-1", "question 0", "answer 0")
+        assert len(await worker_a.aget_history("conv-1", 0)) == 1
+
+        await worker_b.asave_exchange("conv-1", "question 1", "answer 1")
+        await wait_until(lambda: cache_a.stats()["invalidations"] == 1)
+        after_other_worker = await worker_a.aget_history("conv-1", 0)
+
+        worker_b.save_exchange("conv-1", "question 2", "answer 2")  # Sync facade, as used by scripts
+        await wait_until(lambda: cache_a.stats()["invalidations"] == 2)
+        after_script = await worker_a.aget_history("conv-1", 0)
+
+        await worker_b.aclear_history("conv-1")
+        await wait_until(lambda: cache_a.stats()["invalidations"] == 3)
+        after_clear = await worker_a.aget_history("conv-1", 0)
+
+        await cache_a.stop()
+        await cache_b.stop()
+        return after_other_worker, after_script, after_clear
+
+    after_other_worker, after_script, after_clear = asyncio.run(run())
+    assert [exchange["user"] for exchange in after_other_worker] == ["question 0", "question 1"]
+    assert len(after_script) == 3
+    assert after_clear == []
+
+def test_l1_is_bounded_and_bypassed_without_invalidations():
+    """Test LRU eviction by count and that nothing is cached until the subscription is live."""
+    async def run():
+        server = fakeredis.FakeServer()
+        memory, cache = make_worker(server, "worker-a", max_conversations=2)
+        for conversation_id in ("conv-1", "conv-2", "conv-3"):
+            await memory.asave_exchange(conversation_id, "question", "answer")
+
+        await memory.aget_history("conv-1")
+        bypassed = cache.stats()
+
+        await cache.start()
+        await wait_until(lambda: cache.active)
+        for conversation_id in ("conv-1", "conv-2", "conv-1", "conv-3"):
+            await memory.aget_history(conversation_id)
+        memory.prefetch("conv-2")
+        await asyncio.sleep(0.05)
+        stats = cache.stats()
+        await cache.stop()
+        return bypassed, stats
+
+    bypassed, stats = asyncio.run(run())
+    assert bypassed["bypassed"] == 1 and bypassed["conversations"] == 0
+    assert stats["hits"] == 1 and stats["conversations"] == 2 and stats["evictions"] == 2
@@ -0,0 +1,70 @@
+import sys
+import asyncio
+from pathlib import Path
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+import fakeredis
+
+from services.idempotency import RequestCoalescer, idempotency_key
+
+def counting_producer(calls, result, storable=True, delay=0.05):
+    async def produce():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return result, storable
+    return produce
+
+def test_concurrent_duplicates_share_one_execution():
+    """Test that identical in-flight requests run the producer once and all get its result."""
+    async def run():
+        coalescer = RequestCoalescer()
+        calls = []
+        produce = counting_producer(calls, {"messages": [{"id": "a1"}]})
+        results = await asyncio.gather(*(coalescer.run("k", produce) for _ in range(3)))
+
+        assert len(calls) == 1
+        assert [outcome for _, outcome in results].count("executed") == 1
+        assert all(result == {"messages": [{"id": "a1"}]} for result, _ in results)
+
+    asyncio.run(run())
+
+def test_replay_within_window_but_not_after_failure():
+    """Test that a stored result is replayed, while a non-storable (failed) one lets the retry run."""
+    async def run():
+        coalescer = RequestCoalescer(fakeredis.aioredis.FakeRedis())
+        calls = []
+        await coalescer.run("ok", counting_producer(calls, {"answer": 1}, delay=0))
+        result, outcome = await coalescer.run("ok", counting_producer(calls, {"answer": 2}, delay=0))
+        assert (result, outcome, len(calls)) == ({"answer": 1}, "replayed", 1)
+
+        await coalescer.run("failed", counting_producer(calls, {"error": True}, storable=False, delay=0))
+        result, outcome = await coalescer.run("failed", counting_producer(calls, {"answer": 3}, delay=0))
+        assert (result, outcome, len(calls)) == ({"answer": 3}, "executed", 3)
+
+    asyncio.run(run())
+
+def test_duplicates_on_another_worker_wait_for_the_leader():
+    """Test that a second worker polls for the leader's result instead of running again."""
+    async def run():
+        server = fakeredis.FakeServer()
+        worker_a = RequestCoalescer(fakeredis.aioredis.FakeRedis(server=server))
+        worker_b = RequestCoalescer(fakeredis.aioredis.FakeRedis(server=server))
+        calls = []
+        leader = asyncio.create_task(worker_a.run("k", counting_producer(calls, {"answer": "a"}, delay=0.3)))
+        await asyncio.sleep(0.05)
+        result, outcome = await worker_b.run("k", counting_producer(calls, {"answer": "b"}))
+
+        assert (result, outcome) == ({"answer": "a"}, "coalesced")
+        assert (await leader)[1] == "executed"
+        assert len(calls) == 1
+
+    asyncio.run(run())
+
+def test_keys_are_scoped_and_derived():
+    """Test that client keys are scoped and derived keys depend on every identifying part."""
+    assert idempotency_key("conv-1", "retry-1") != idempotency_key("conv-2", "retry-1")
+    assert idempotency_key("conv-1", None, "conv-1", "hi", 3) == idempotency_key("conv-1", None, "conv-1", "hi", 3)
+    assert idempotency_key("conv-1", None, "conv-1", "hi", 3) != idempotency_key("conv-1", None, "conv-1", "hi", 4)
@@ -0,0 +1,45 @@
+import sys
+import asyncio
+from pathlib import Path
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+from services.job_queue import InMemoryJobQueue, JobWorkerPool
+
+def test_jobs_are_deduplicated_and_retried():
+    """Test that duplicate turns are skipped and failing jobs are retried until they succeed."""
+    attempts = {}
+
+    async def handler(job):
+        attempts[job.dedup_key] = attempts.get(job.dedup_key, 0) + 1
+        if job.payload["fail_times"] >= attempts[job.dedup_key]:
+            raise RuntimeError("backend unavailable")
+
+    async def run():
+        pool = JobWorkerPool(InMemoryJobQueue(), {"artifacts": handler}, concurrency=2,
+                             max_attempts=3, base_delay=0.01)
+        pool.start()
+        accepted = [
+            await pool.submit("artifacts", {"fail_times": 0}, "conv-1:turn-1"),
+            await pool.submit("artifacts", {"fail_times": 0}, "conv-1:turn-1"),
+            await pool.submit("artifacts", {"fail_times": 2}, "conv-2:turn-1"),
+            await pool.submit("artifacts", {"fail_times": 5}, "conv-3:turn-1"),
+        ]
+        await pool.stop(drain_timeout=5)
+        return accepted, pool.stats
+
+    accepted, stats = asyncio.run(run())
+    assert accepted == [True, False, True, True]
+    assert attempts == {"conv-1:turn-1": 1, "conv-2:turn-1": 3, "conv-3:turn-1": 3}
+    assert stats["succeeded"] == 2 and stats["failed"] == 1 and stats["retried"] == 4
+
+def test_queue_is_bounded():
+    """Test that jobs are rejected once the queue is full."""
+    async def run():
+        queue = InMemoryJobQueue(max_length=1)
+        pool = JobWorkerPool(queue, {"artifacts": lambda job: asyncio.sleep(0)}, concurrency=1)
+        return [await pool.submit("artifacts", {}, f"conv-{i}") for i in range(2)]
+
+    assert asyncio.run(run()) == [True, False]
@@ -0,0 +1,53 @@
+import sys
+import asyncio
+from pathlib import Path
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from services.metrics import (MetricsMiddleware, MetricsRegistry, STAGE_LATENCY, HTTP_REQUESTS,
+                              track_dependency, track_stage)
+
+def test_histogram_and_counter_exposition():
+    """Test that histograms render cumulative buckets, sum and count in the text format."""
+    registry = MetricsRegistry()
+    latency = registry.histogram("test_latency_seconds", "Test latency.", ("stage",), buckets=(0.1, 1.0))
+    errors = registry.counter("test_errors_total", "Test errors.", ("dependency",))
+    latency.observe(0.05, stage="llm")
+    latency.observe(0.5, stage="llm")
+    errors.inc(dependency="redis")
+
+    text = asyncio.run(registry.render())
+
+    assert 'test_latency_seconds_bucket{stage="llm",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{stage="llm",le="+Inf"} 2' in text
+    assert 'test_latency_seconds_count{stage="llm"} 2' in text
+    assert 'test_errors_total{dependency="redis"} 1' in text
+    assert "# TYPE test_latency_seconds histogram" in text
+
+def test_middleware_labels_route_template_and_stages():
+    """Test that requests and stages are labelled with the route template, not the raw path."""
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def read_item(item_id: str):
+        with track_stage("history_fetch"):
+            await asyncio.sleep(0)
+        try:
+            with track_dependency("redis", "get_history"):
+                raise ConnectionError("down")
+        except ConnectionError:
+            pass
+        return {"id": item_id}
+
+    client = TestClient(app)
+    client.get("/items/1")
+    client.get("/items/2")
+
+    assert HTTP_REQUESTS.value(method="GET", route="/items/{item_id}", status=200) == 2
+    assert STAGE_LATENCY.count(route="/items/{item_id}", stage="history_fetch") == 2
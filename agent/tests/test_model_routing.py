@@ -0,0 +1,64 @@
+import os
+import sys
+import json
+from pathlib import Path
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+from langchain_openai import ChatOpenAI
+
+from services.model_routing import DEFAULT_ROUTES, ModelRouter
+
+def write_routes(path: Path, routes: dict, mtime: float):
+    path.write_text(json.dumps(routes))
+    os.utime(path, (mtime, mtime))
+
+def test_routes_file_overrides_defaults(tmp_path):
+    """Test that file entries override defaults field by field and unknown types use "default"."""
+    path = tmp_path / "model_routes.json"
+    write_routes(path, {"rehearsal": {"model": "gpt-3.5-turbo"}, "default": {"max_tokens": 256}}, 1000)
+    router = ModelRouter(path, reload_interval=0)
+
+    rehearsal = router.route("rehearsal")
+    assert rehearsal.model == "gpt-3.5-turbo"
+    assert rehearsal.max_tokens == DEFAULT_ROUTES["rehearsal"].max_tokens
+    assert router.route("post_feedback") == DEFAULT_ROUTES["post_feedback"]
+    assert router.route("unknown_type").max_tokens == 256
+
+    kwargs = rehearsal.llm_kwargs(0.7)
+    assert kwargs == {"model_name": "gpt-3.5-turbo", "request_timeout": rehearsal.timeout,
+                      "max_tokens": rehearsal.max_tokens, "temperature": 0.7}
+    assert router.route("strategy_parsing").llm_kwargs(0.7)["temperature"] == 0.0
+
+def test_changed_file_is_reloaded_and_invalid_file_is_ignored(tmp_path):
+    """Test hot reload on change, and that a broken file keeps the current policy."""
+    path = tmp_path / "model_routes.json"
+    write_routes(path, {"email_draft": {"max_tokens": 500}}, 1000)
+    router = ModelRouter(path, reload_interval=0.0001)
+    assert router.route("email_draft").max_tokens == 500
+
+    write_routes(path, {"email_draft": {"max_tokens": 900}}, 2000)
+    assert router.route("email_draft").max_tokens == 900
+
+    path.write_text('{"email_draft": {"max_tokens": 100, "unknown_field": 1}}')
+    assert not router.reload()
+    assert router.route("email_draft").max_tokens == 900
+
+def test_configure_copies_llm_with_route_settings(tmp_path):
+    """Test that agent LLMs are copied with the route's model and budget, and latency is recorded."""
+    path = tmp_path / "model_routes.json"
+    write_routes(path, {"synthesis": {"model": "gpt-3.5-turbo", "max_tokens": 200}}, 1000)
+    router = ModelRouter(path, reload_interval=0)
+    llm = ChatOpenAI(model_name="gpt-4o-mini", openai_api_key="sk-test")
+
+    configured = router.configure(llm, "synthesis")
+    assert configured.model_name == "gpt-3.5-turbo" and configured.max_tokens == 200
+    assert llm.model_name == "gpt-4o-mini" and llm.max_tokens is None
+    assert router.configure(llm, "synthesis") is configured
+
+    with router.timed("synthesis", configured.model_name):
+        pass
+    observed = router.stats()["observed_latency"]["synthesis"]["gpt-3.5-turbo"]
+    assert observed["samples"] == 1 and observed["p95_seconds"] >= 0
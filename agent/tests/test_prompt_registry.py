@@ -0,0 +1,31 @@
+import sys
+from pathlib import Path
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+from prompts.registry import PromptRegistry, HISTORY_HEADER
+
+def test_prompts_are_loaded_and_versioned():
+    """Test that every template is loaded with a stable version and token count."""
+    registry = PromptRegistry()
+    assert {"initial_query", "default_system", "post_feedback", "email_draft",
+            "rehearsal", "simulate_reply"} <= set(registry.names())
+
+    prompt = registry.get("initial_query")
+    assert prompt.token_count > 0
+    assert prompt.version == PromptRegistry().get("initial_query").version
+    assert registry.for_generate_response("follow_up").name == "default_system"
+    assert registry.for_generate_response("unknown").name == "initial_query"
+
+def test_static_prompt_comes_first():
+    """Test that messages start with the unchanged system prompt, followed by history and query."""
+    registry = PromptRegistry()
+    prompt = registry.get("default_system")
+    messages = registry.build_messages(prompt, "USER: hi", "What should I do?")
+
+    assert messages[0].content == prompt.text
+    assert messages[1].content.startswith(HISTORY_HEADER)
+    assert messages[-1].content == "What should I do?"
+    assert len(registry.build_messages(prompt, "", "What should I do?")) == 2
@@ -0,0 +1,191 @@
+import sys
+import asyncio
+from pathlib import Path
+
+import pytest
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+import httpx
+import openai
+
+from services.governor import LLMGovernor, set_llm_governor
+from services.resilience import CircuitBreaker, LLMResilience, LLMUnavailable
+
+def test_hedge_answers_when_the_first_attempt_stalls():
+    """Test that a duplicate is sent after the p95 delay and the faster answer wins."""
+    async def run():
+        resilience = LLMResilience(hedge_min_samples=3, hedge_min_delay=0.01, hedge_max_rate=1.0)
+        for _ in range(3):
+            resilience.observe_latency("gpt-4o-mini", 0.01)
+        delays = iter([1.0, 0.0])
+        calls = []
+
+        async def attempt():
+            delay = next(delays)
+            calls.append(delay)
+            await asyncio.sleep(delay)
+            return f"answered after {delay}"
+
+        result = await asyncio.wait_for(resilience.arun("gpt-4o-mini", attempt, deadline=5), 0.5)
+        assert result == "answered after 0.0"
+        assert calls == [1.0, 0.0]
+        assert resilience.stats()["hedge_rate"] == 1.0
+
+    asyncio.run(run())
+
+def test_circuit_opens_and_half_opens():
+    """Test that consecutive failures open the circuit and a single probe may close it again."""
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.0)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    assert breaker.allow() and breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()  # Only one probe at a time
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    assert not breaker.allow()
+
+def test_timeout_falls_back_to_model_then_cache():
+    """Test the fallback order: fallback model within the remaining deadline, then the cached answer."""
+    async def run():
+        resilience = LLMResilience(hedging_enabled=False, fallback_model="gpt-3.5-turbo", failure_threshold=1)
+
+        async def slow():
+            await asyncio.sleep(1)
+            return "primary"
+
+        async def fallback():
+            return "fallback model"
+
+        async def cached():
+            return "cached"
+
+        assert await resilience.arun("gpt-4o-mini", slow, fallback_attempt=fallback, deadline=0.1) == "fallback model"
+        assert resilience.breaker("gpt-4o-mini").state == CircuitBreaker.OPEN
+
+        async def failing():
+            raise RuntimeError("rate limited")
+
+        # Primary circuit is open, fallback model fails: the cached answer is served
+        assert await resilience.arun("gpt-4o-mini", slow, fallback_attempt=failing, cached=cached,
+                                     deadline=0.1) == "cached"
+        with pytest.raises(LLMUnavailable):
+            await resilience.arun("gpt-4o-mini", slow, deadline=0.1)
+
+    asyncio.run(run())
+
+def test_stream_falls_back_to_cached_answer():
+    """Test that a stream failing before its first token yields the cached answer instead."""
+    async def run():
+        resilience = LLMResilience()
+
+        async def cached():
+            return "cached answer"
+
+        broken = GenericFakeChatModel(messages=iter([]))
+        chunks = [chunk.content async for chunk in resilience.astream(broken, ["hi"], cached_answer=cached)]
+        assert chunks == ["cached answer"]
+
+        working = GenericFakeChatModel(messages=iter([AIMessage(content="live answer")]))
+        chunks = [chunk.content async for chunk in resilience.astream(working, ["hi"], cached_answer=cached)]
+        assert "".join(chunks) == "live answer"
+
+    asyncio.run(run())
+
+def test_hedge_needs_a_free_governor_slot():
+    """Test that a hedge is only sent when the governor has a slot for it, so the cap holds."""
+    async def run():
+        governor = LLMGovernor(max_concurrency=1, user_calls_per_minute=0)
+        set_llm_governor(governor)
+        try:
+            resilience = LLMResilience(hedge_min_samples=1, hedge_min_delay=0.01, hedge_max_rate=1.0)
+            resilience.observe_latency("gpt-4o-mini", 0.01)
+            calls = []
+
+            async def attempt():
+                calls.append(governor.active)
+                await asyncio.sleep(0.05)
+                return "answer"
+
+            async with governor.slot("interactive"):  # The caller's slot is the only one
+                assert await resilience.arun("gpt-4o-mini", attempt, deadline=5) == "answer"
+            assert calls == [1] and resilience.stats()["hedges_skipped_no_slot"] == 1
+
+            governor.max_concurrency = 2
+            resilience = LLMResilience(hedge_min_samples=1, hedge_min_delay=0.01, hedge_max_rate=1.0)
+            resilience.observe_latency("gpt-4o-mini", 0.01)
+            async with governor.slot("interactive"):
+                assert await resilience.arun("gpt-4o-mini", attempt, deadline=5) == "answer"
+            assert calls[1:] == [1, 2] and governor.active == 0
+        finally:
+            set_llm_governor(None)
+
+    asyncio.run(run())
+
+def test_only_model_failures_open_the_circuit():
+    """Test that client errors (4xx, invalid requests) are not counted as model failures."""
+    async def run():
+        resilience = LLMResilience(hedging_enabled=False, failure_threshold=1)
+        request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+        async def context_too_long():
+            raise openai.BadRequestError("context_length_exceeded", response=httpx.Response(400, request=request),
+                                         body=None)
+
+        async def server_error():
+            raise openai.InternalServerError("upstream error", response=httpx.Response(503, request=request), body=None)
+
+        for attempt in (context_too_long, context_too_long):
+            with pytest.raises(LLMUnavailable):
+                await resilience.arun("gpt-4o-mini", attempt, deadline=1)
+        assert resilience.breaker("gpt-4o-mini").state == CircuitBreaker.CLOSED
+
+        with pytest.raises(LLMUnavailable):
+            await resilience.arun("gpt-4o-mini", server_error, deadline=1)
+        assert resilience.breaker("gpt-4o-mini").state == CircuitBreaker.OPEN
+
+    asyncio.run(run())
+
+def test_stream_that_stalls_after_its_first_token_is_ended():
+    """Test that the idle timeout and overall deadline stop a stream that stops sending tokens."""
+    class StallingLLM:
+        model_name = "gpt-4o-mini"
+        closed = 0
+
+        async def astream(self, messages):
+            try:
+                yield AIMessageChunk(content="partial")
+                await asyncio.sleep(5)
+                yield AIMessageChunk(content="never sent")
+            finally:
+                StallingLLM.closed += 1
+
+    async def consume(resilience, **kwargs):
+        chunks = []
+        with pytest.raises(LLMUnavailable):
+            async for chunk in resilience.astream(StallingLLM(), ["hi"], **kwargs):
+                chunks.append(chunk.content)
+        return chunks
+
+    async def run():
+        resilience = LLMResilience(stream_idle_timeout=0.05)
+        assert await asyncio.wait_for(consume(resilience), 1) == ["partial"]
+        assert resilience.breaker("gpt-4o-mini").failures == 1
+
+        # The overall deadline applies even with a generous idle timeout, and with resilience disabled
+        disabled = LLMResilience(enabled=False, stream_idle_timeout=60)
+        assert await asyncio.wait_for(consume(disabled, deadline=0.1), 1) == ["partial"]
+        assert StallingLLM.closed == 2
+
+    asyncio.run(run())
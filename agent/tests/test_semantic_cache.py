@@ -0,0 +1,60 @@
+import sys
+import asyncio
+from pathlib import Path
+import pytest
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+from services.semantic_cache import SemanticResponseCache
+
+VECTORS = {
+    "how should i handle location tracking?": [1.0, 0.0, 0.0],
+    "how do i handle location tracking": [0.99, 0.05, 0.0],
+    "is it ok to skip accessibility testing?": [0.0, 1.0, 0.0],
+    "should we ship without an accessibility review?": [0.0, 0.0, 1.0],
+}
+
+async def fake_embed(text):
+    return VECTORS[text.lower()]
+
+@pytest.fixture
+def cache():
+    """Return an enabled cache with a small namespace size."""
+    return SemanticResponseCache(embed=fake_embed, threshold=0.95, ttl_seconds=60, max_entries=2, enabled=True)
+
+def test_similar_query_hits_within_namespace(cache):
+    """Test that near-identical queries hit and other namespaces or queries miss."""
+    async def run():
+        await cache.store("initial_query:v1", "How should I handle location tracking?", "Answer A")
+        return (await cache.lookup("initial_query:v1", "How do I handle location tracking"),
+                await cache.lookup("default:v1", "How do I handle location tracking"),
+                await cache.lookup("initial_query:v1", "Is it ok to skip accessibility testing?"))
+
+    similar, other_namespace, different = asyncio.run(run())
+    assert similar == "Answer A"
+    assert other_namespace is None
+    assert different is None
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 2
+    assert stats["threshold"] == 0.95
+
+def test_lru_eviction_and_ttl(cache):
+    """Test that the least recently used entry is evicted and expired entries are dropped."""
+    async def run():
+        await cache.store("ns", "How should I handle location tracking?", "A")
+        await cache.store("ns", "Is it ok to skip accessibility testing?", "B")
+        await cache.lookup("ns", "How should I handle location tracking?")
+        await cache.store("ns", "Should we ship without an accessibility review?", "C")
+        kept = await cache.lookup("ns", "How should I handle location tracking?")
+        evicted = await cache.lookup("ns", "Is it ok to skip accessibility testing?")
+        cache.ttl_seconds = -1
+        expired = await cache.lookup("ns", "How should I handle location tracking?")
+        return kept, evicted, expired
+
+    kept, evicted, expired = asyncio.run(run())
+    assert kept == "A"
+    assert evicted is None
+    assert expired is None
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,134 @@
+import sys
+import asyncio
+from pathlib import Path
+
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+import fakeredis
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+from services.embedding_cache import CachedEmbeddings, EmbeddingCache
+from services.governor import LLMGovernor
+from services.usage import (ANONYMOUS_USER, UsageTracker, get_usage_context, set_usage_context, set_usage_tracker,
+                            start_usage_attribution)
+
+def fake_llm(*replies):
+    """Chat model that replies with fixed messages reporting 100 prompt and 20 completion tokens."""
+    return GenericFakeChatModel(messages=iter([
+        AIMessage(content=reply, response_metadata={"model_name": "gpt-4o-mini"},
+                  usage_metadata={"input_tokens": 100, "output_tokens": 20, "total_tokens": 120})
+        for reply in replies
+    ]))
+
+def test_chat_usage_is_rolled_up_per_type_user_and_conversation():
+    """Test that tokens and cost reach the request type, user and conversation rollups."""
+    async def run():
+        tracker = UsageTracker(async_redis_client=fakeredis.aioredis.FakeRedis())
+        llm = fake_llm("draft", "feedback", "draft again")
+        set_usage_context("conv-1", "alice")
+
+        async with tracker.atrack("email_draft"):
+            await llm.ainvoke("hi")
+        async with tracker.atrack("post_feedback"):
+            await llm.ainvoke("hi")
+        async with tracker.atrack("email_draft", conversation_id="conv-2"):
+            await llm.ainvoke("hi")
+
+        types = await tracker.request_type_rollups()
+        assert types["email_draft"]["calls"] == 2
+        assert types["email_draft"]["prompt_tokens"] == 200
+        assert types["email_draft"]["completion_tokens"] == 40
+        assert types["email_draft"]["cost_usd"] > 0
+        assert types["post_feedback"]["total_tokens"] == 120
+
+        user = await tracker.user_rollup("alice")
+        assert user["total_tokens"] == 360
+        assert user["daily_token_budget"] == 0 and user["remaining_tokens"] is None
+
+        assert (await tracker.conversation_rollup("conv-1"))["calls"] == 2
+        assert (await tracker.conversation_rollup("conv-2"))["calls"] == 1
+
+    asyncio.run(run())
+
+def test_daily_budget_blocks_once_exhausted():
+    """Test the default budget, a per-user override and resetting it."""
+    async def run():
+        tracker = UsageTracker(async_redis_client=fakeredis.aioredis.FakeRedis(), default_daily_budget=200)
+        llm = fake_llm("one", "two")
+
+        assert (await tracker.check_budget("bob"))[0]
+        async with tracker.atrack("default_system", user_id="bob"):
+            await llm.ainvoke("hi")
+        assert (await tracker.check_budget("bob"))[0]
+        async with tracker.atrack("default_system", user_id="bob"):
+            await llm.ainvoke("hi")
+        assert await tracker.check_budget("bob") == (False, 240, 200)
+
+        await tracker.set_budget("bob", 1000)
+        assert (await tracker.check_budget("bob"))[0]
+        assert (await tracker.user_rollup("bob"))["remaining_tokens"] == 760
+
+        await tracker.set_budget("bob", None)
+        assert not (await tracker.check_budget("bob"))[0]
+
+    asyncio.run(run())
+
+def test_only_embedding_misses_are_counted():
+    """Test that embeddings served from the cache do not count as usage."""
+    server = fakeredis.FakeServer()
+    tracker = UsageTracker(redis_client=fakeredis.FakeRedis(server=server),
+                           async_redis_client=fakeredis.aioredis.FakeRedis(server=server))
+    set_usage_tracker(tracker)
+    try:
+        embeddings = CachedEmbeddings(DeterministicFakeEmbedding(size=8), cache=EmbeddingCache(),
+                                      model_name="text-embedding-3-small")
+        embeddings.embed_documents(["some text", "more text"])
+        embeddings.embed_documents(["some text"])
+        asyncio.run(embeddings.aembed_query("some text"))
+
+        types = asyncio.run(tracker.request_type_rollups())
+        assert types["embedding"]["calls"] == 1
+        assert types["embedding"]["total_tokens"] > 0
+    finally:
+        set_usage_tracker(None)
+
+def test_requests_without_identity_are_not_limited_as_one_user():
+    """Test that anonymous requests are rolled up as "anonymous" but share no rate limit or budget."""
+    async def run():
+        tracker = UsageTracker(default_daily_budget=1)
+        governor = LLMGovernor(max_concurrency=4, user_calls_per_minute=20, user_burst=10)
+
+        user_id = start_usage_attribution("conv-1", None, None)
+        assert user_id is None and get_usage_context() == ("conv-1", ANONYMOUS_USER)
+        assert (await tracker.check_budget(user_id))[0]
+        for _ in range(30):
+            async with governor.slot("interactive", user_id):
+                pass
+
+        assert start_usage_attribution("conv-1", None, "carol") == "carol"
+
+    asyncio.run(run())
+
+def test_background_summary_is_counted_for_the_conversation():
+    """Test that the history summarizer's LLM call reaches the usage rollups."""
+    from memory.conversation_memory import ConversationMemory
+    from memory.token_budget import TokenBudgetedHistory
+
+    async def run():
+        tracker = UsageTracker(async_redis_client=fakeredis.aioredis.FakeRedis())
+        set_usage_tracker(tracker)
+        set_usage_context("conv-1", "alice")
+        memory = ConversationMemory(redis_client=None, async_redis_client=None)
+        history = TokenBudgetedHistory(memory, llm_provider=lambda: fake_llm("The user asked about privacy."))
+
+        await history.refresh_summary("conv-1", {}, [{"user": "question", "assistant": "answer", "timestamp": "t1"}])
+        set_usage_tracker(None)
+        return await tracker.request_type_rollups(), await tracker.conversation_rollup("conv-1")
+
+    types, conversation = asyncio.run(run())
+    assert types["conversation_summary"]["total_tokens"] == 120
+    assert conversation["calls"] == 1